@@ -12,29 +12,157 @@
 # sudo ~/jetson_clock_sh
 ######################################
 
+import argparse
+import collections
 import cv2
 import math
 import numpy as np
 import sys
-import pyzed.camera as zcam
-import pyzed.defines as sl
-import pyzed.types as tp
-import pyzed.core as core
-
-
-TENNIS_BALL_DIAMETER = 68.6 #millimeters
+import threading
+import time
+from frame_source import ZEDFrameSource, CameraSession, open_recording
+from pipeline import DetectionPipeline
+from tracking import BallTracker
+from smoothing import PositionEstimator
+from obstacles import ObstacleDetector, draw_obstacles
+from odometry import MotionEstimator, StallDetector, draw_motion
+from depth import estimate_contour_position
+from hsv_lut import HSVLookupTable
+from hsv_calibration import HSVSampler
+from candidates import rank_candidates
+from instrumentation import NULL_TIMER, StageTimer
+from result_stream import DEFAULT_ADDRESS, ResultPublisher
+from recorder import SessionRecorder
+from video_stream import DEFAULT_VIDEO_ADDRESS, VideoStreamer
+
+# Default lower and upper boundaries of "yellow" in HSV color space
+# and default iterations of the erode and dilate functions.
+DEFAULT_HSV_LOWER = (35, 70, 30)
+DEFAULT_HSV_UPPER = (85, 255, 255)
+DEFAULT_EROSIONS = 2
+DEFAULT_DILATIONS = 3
+# Address of the control plane (see control.py)
+DEFAULT_CONTROL_ADDRESS = "127.0.0.1:5806"
+# Frames sampled by the automatic HSV calibration from detected balls
+AUTO_CALIBRATION_FRAMES = 15
 
 def main():
+	# Optionally replay a recorded session instead of using the ZED camera
+	ap = argparse.ArgumentParser()
+	ap.add_argument("-r", "--recording",
+		help="path to a recorded session to use instead of the ZED camera")
+	ap.add_argument("-l", "--loop", action="store_true",
+		help="restart the recorded session when it ends")
+	ap.add_argument("-w", "--workers", type=int, default=0,
+		help="number of detection threads (0 runs capture, detection and display in one loop)")
+	ap.add_argument("-t", "--tracking", action="store_true",
+		help="only search around the predicted ball position once the ball is found")
+	ap.add_argument("-p", "--pyramid", type=int, default=0,
+		help="number of times the image is halved before searching for the color (0 = full resolution)")
+	ap.add_argument("-d", "--depth", default="median", choices=["pixel", "median", "trimmed"],
+		help="how the distance is read from the point cloud under the color region")
+	ap.add_argument("-c", "--classifier", default="hsv", choices=["hsv", "lut"],
+		help="color segmentation: HSV conversion + inRange, or a BGR lookup table")
+	ap.add_argument("-m", "--multi-candidate", action="store_true",
+		help="score every color region and use the best one instead of the largest one")
+	ap.add_argument("-a", "--adaptive-hough", action="store_true",
+		help="pick the Hough radius band, resolution and ROI size by distance")
+	ap.add_argument("-s", "--circle-shortcut", action="store_true",
+		help="skip the Hough transform when the color region is clearly round")
+	ap.add_argument("--smooth", action="store_true",
+		help="smooth the ball position over the last frames, reject outliers and estimate its velocity "
+		     "(see smoothing.py)")
+	ap.add_argument("--obstacles", action="store_true",
+		help="find the ground, obstacles and cliffs in the point cloud and draw them (see obstacles.py)")
+	ap.add_argument("--odometry", action="store_true",
+		help="measure the motion of the camera between frames and detect stalls (see odometry.py)")
+	ap.add_argument("--drive", type=float, default=0.0,
+		help="with --odometry, simulated commanded drive speed (mm/s) for the stall detection")
+	ap.add_argument("--timing", action="store_true",
+		help="time every stage, show the FPS and stage times on screen and print them on exit")
+	ap.add_argument("--trace",
+		help="with --timing, write every recorded stage time to this .csv or .json file on exit")
+	ap.add_argument("--headless", action="store_true",
+		help="start the detection right away without the menu, window or printed results "
+		     "and publish the results (see result_stream.py)")
+	ap.add_argument("--publish", nargs="?", const=DEFAULT_ADDRESS,
+		help="publish the results to host:port (UDP) or a Unix socket path (default {0})".format(DEFAULT_ADDRESS))
+	ap.add_argument("--format", default="binary", choices=["binary", "json"],
+		help="format of the published results")
+	ap.add_argument("--control", nargs="?", const=DEFAULT_CONTROL_ADDRESS,
+		help="instead of the menu, keep the camera open and take commands on host:port or a Unix socket path "
+		     "(default {0}, see control.py)".format(DEFAULT_CONTROL_ADDRESS))
+	ap.add_argument("--save",
+		help="record the frames and detection results to this directory (see recorder.py)")
+	ap.add_argument("--stream", nargs="?", const=DEFAULT_VIDEO_ADDRESS,
+		help="send the annotated frames to the video receiver on host:port or a Unix socket path "
+		     "(default {0}, see video_stream.py)".format(DEFAULT_VIDEO_ADDRESS))
+	ap.add_argument("--stream-width", type=int, default=640, help="width of the streamed frames")
+	ap.add_argument("--stream-quality", type=int, default=70, help="JPEG quality of the streamed frames")
+	ap.add_argument("--stream-fps", type=float, default=10, help="maximum frame rate of the stream")
+	args = vars(ap.parse_args())
+
 	# Define the lower and upper boundaries of "yellow" in HSV color space
 	# and default the iterations of the erode and dilate functions.
+	yellow_hsv_lower = np.array(DEFAULT_HSV_LOWER)
+	yellow_hsv_upper = np.array(DEFAULT_HSV_UPPER)
+	erosion_iterations = DEFAULT_EROSIONS
+	dilation_iterations = DEFAULT_DILATIONS
+
+	# The camera is opened once and shared by every mode
+	session = open_camera_session(args)
+	publisher = None
+	if args["publish"] or args["headless"] or args["control"]:
+		publisher = ResultPublisher(address=args["publish"] or DEFAULT_ADDRESS, record_format=args["format"])
+	recorder = None
+	if args["save"]:
+		# every detection run of the program is recorded into the same recording
+		session.open()
+		recorder = SessionRecorder(args["save"], session.frame_source.calibration)
+		recorder.open()
+	streamer = None
+	if args["stream"]:
+		streamer = VideoStreamer(address=args["stream"], width=args["stream_width"], quality=args["stream_quality"],
+		                         max_fps=args["stream_fps"])
+		streamer.open()
+
+	if args["headless"]:
+		find_tennis_ball(frame_source=session.acquire(), hsv_lower=yellow_hsv_lower, hsv_upper=yellow_hsv_upper,
+		                 num_erosions=erosion_iterations, num_dilations=dilation_iterations,
+		                 num_workers=args["workers"], tracking=args["tracking"],
+		                 pyramid_levels=args["pyramid"], depth_method=args["depth"],
+		                 color_classifier=args["classifier"], multi_candidate=args["multi_candidate"],
+		                 adaptive_hough=args["adaptive_hough"], circle_shortcut=args["circle_shortcut"],
+		                 smoothing=args["smooth"], obstacles=args["obstacles"],
+		                 odometry=args["odometry"], drive_speed=args["drive"],
+		                 timing=args["timing"] or bool(args["trace"]), trace_path=args["trace"],
+		                 headless=True, publisher=publisher, recorder=recorder, streamer=streamer)
+		session.close()
+		publisher.close()
+		close_recorder(recorder)
+		if streamer is not None:
+			streamer.close()
+		return
+
+	if args["control"]:
+		# control.py needs Python 3.5 (asyncio with async/await), so only import it when used
+		import control
+		service = control.DetectionService(frame_source=session.acquire(), publisher=publisher,
+		                                   hsv_lower=yellow_hsv_lower, hsv_upper=yellow_hsv_upper,
+		                                   num_erosions=erosion_iterations, num_dilations=dilation_iterations,
+		                                   tracking=args["tracking"], pyramid_levels=args["pyramid"],
+		                                   depth_method=args["depth"], color_classifier=args["classifier"],
+		                                   multi_candidate=args["multi_candidate"],
+		                                   adaptive_hough=args["adaptive_hough"],
+		                                   circle_shortcut=args["circle_shortcut"], smoothing=args["smooth"])
+		control.run(service, args["control"])
+		session.close()
+		publisher.close()
+		close_recorder(recorder)
+		if streamer is not None:
+			streamer.close()
+		return
 
-	h1 = 35; h2 = 85
-	s1 = 70; s2 = 255
-	v1 = 30; v2 = 255
-	yellow_hsv_lower = np.array([h1, s1, v1])
-	yellow_hsv_upper = np.array([h2, s2, v2])
-	erosion_iterations = 2
-	dilation_iterations = 3
 	print_help()
 
 	run_program = True
@@ -43,18 +171,58 @@ def main():
 		if key == 'q':
 			print("\nExiting program...")
 			run_program = False
+			session.close()
+			if publisher is not None:
+				publisher.close()
+			close_recorder(recorder)
+			if streamer is not None:
+				streamer.close()
 		elif key == 'h':
 			print_help()
 		elif key == 'r':
-			find_tennis_ball(hsv_lower=yellow_hsv_lower, hsv_upper=yellow_hsv_upper,
-			                 num_erosions=erosion_iterations, num_dilations=dilation_iterations)
+			find_tennis_ball(frame_source=session.acquire(), hsv_lower=yellow_hsv_lower, hsv_upper=yellow_hsv_upper,
+			                 num_erosions=erosion_iterations, num_dilations=dilation_iterations,
+			                 num_workers=args["workers"], tracking=args["tracking"],
+			                 pyramid_levels=args["pyramid"], depth_method=args["depth"],
+			                 color_classifier=args["classifier"], multi_candidate=args["multi_candidate"],
+			                 adaptive_hough=args["adaptive_hough"], circle_shortcut=args["circle_shortcut"],
+			                 smoothing=args["smooth"], obstacles=args["obstacles"],
+			                 odometry=args["odometry"], drive_speed=args["drive"],
+			                 timing=args["timing"] or bool(args["trace"]), trace_path=args["trace"],
+			                 publisher=publisher, recorder=recorder, streamer=streamer)
 			print_help()
 		elif key == 'v':
 			yellow_hsv_lower, yellow_hsv_upper, erosion_iterations, dilation_iterations = \
-				adjust_hsv_filter(hsv_lower=yellow_hsv_lower, hsv_higher=yellow_hsv_upper,
-				                  num_erosions=erosion_iterations, num_dilations=dilation_iterations)
+				adjust_hsv_filter(frame_source=session.acquire(loop=True), hsv_lower=yellow_hsv_lower, hsv_higher=yellow_hsv_upper,
+				                  num_erosions=erosion_iterations, num_dilations=dilation_iterations,
+				                  color_classifier=args["classifier"])
 			print_help()
 
+# Desc: Create the camera session (see frame_source.py) of the frame source
+#       selected by the command line arguments, either the ZED camera or a
+#       recorded session. The frame source is opened when it is first acquired
+#       and stays open until the session is closed; find_tennis_ball and
+#       adjust_hsv_filter give it back to the session when they exit.
+# Inputs: dict args
+# Outputs: CameraSession
+def open_camera_session(args):
+	if args.get("recording"):
+		frame_source = open_recording(args["recording"])
+	else:
+		frame_source = ZEDFrameSource()
+	return CameraSession(frame_source, loop=args.get("loop", False))
+
+# Desc: Write the pending frames of a SessionRecorder, close it and report
+#       how many frames were recorded
+# Inputs: SessionRecorder recorder (or None)
+# Outputs:
+def close_recorder(recorder):
+	if recorder is None:
+		return
+	recorder.close()
+	print("Recorded {0} frames ({1:.1f} MB) to {2}, {3} frames dropped.".format(
+		recorder.recorded, recorder.written_bytes / 1e6, recorder.path, recorder.dropped))
+
 # Desc: Uses the ZED SDK and OpenCV libraries to identify a circlular object of
 #       a specified color through computer vision. Current settings of the ZED
 #       camera can detect a tennis ball 0.7 meters away from the left lens. This
@@ -70,192 +238,591 @@ def main():
 #       If a circle is not detected, the function will provide coordinates for the
 #       color region detected as a guess for the rover to investigate.
 #
+#       frame_source is an opened frame source (see frame_source.py), usually
+#           lent by a CameraSession
 #       hsv_lower is an array with 3 indices (Hue, Saturation, Value/Brightness)
 #       hsv_higher is an array with 3 indices (Hue, Saturation, Value/Brightness)
 #       num_erosions is how many iterations of the OpenCV erode function
 #       num_dilations is how many iterations of the OpenCV dilate function
+#       num_workers is how many detection threads to run. With 0, every frame is
+#           grabbed, processed and shown one after the other. Otherwise capture,
+#           detection and display run concurrently (see pipeline.py) and frames
+#           that can not be processed in time are dropped.
+#       tracking turns on the tracking mode (see tracking.py): once the ball is
+#           found, only a window around its predicted position is searched until
+#           it is lost for several frames. Works best with 0 or 1 num_workers,
+#           since frames processed out of order confuse the prediction.
+#       pyramid_levels is how many times the image is halved (cv2.pyrDown) before
+#           the color mask and contours are computed. The largest contour is mapped
+#           back to full resolution for the distance and the Hough transform.
+#       depth_method is how the position is read from the point cloud, see
+#           coordinates_to_largest_contour
+#       color_classifier is 'hsv' to segment the color with an HSV conversion and
+#           cv2.inRange, or 'lut' to use a BGR lookup table (see hsv_lut.py)
+#       multi_candidate scores every color region and uses the best one instead
+#           of the largest one (see candidates.py); the other candidates are drawn
+#       adaptive_hough and circle_shortcut are passed to detect_tennis_ball
+#       smoothing fuses the results of the last frames with a PositionEstimator
+#           (see smoothing.py); the smoothed position is printed and published
+#       obstacles runs an ObstacleDetector (see obstacles.py) on the point cloud of
+#           every frame and draws the obstacles and cliffs it finds
+#       odometry runs a MotionEstimator (see odometry.py) on every frame, draws
+#           the motion of the camera and feeds a StallDetector; a stall is printed
+#           and drawn when the rover is commanded to drive at drive_speed (mm/s,
+#           simulated until the drive commands reach this loop) but does not move
+#       timing records how long every stage takes (see instrumentation.py),
+#           draws the FPS and the p50/p95/p99 of every stage on the frame and
+#           prints them on exit
+#       trace_path is a .csv or .json file where every recorded stage time is
+#           written on exit (only with timing)
+#       headless turns off the printed results and the OpenCV window; the
+#           detection runs until the recording ends or it is interrupted (Ctrl+C)
+#       publisher is a ResultPublisher (see result_stream.py) that every result
+#           is sent to, or None
+#       recorder is a SessionRecorder (see recorder.py) that every frame and its
+#           result is recorded to, or None
+#       streamer is a VideoStreamer (see video_stream.py) that every annotated
+#           frame is sent to, or None. The frames are annotated even when headless.
 #
-# Inputs: int[2] hsv_lower, int[2] hsv_higher, int num_erosions, int num_dilations
-# Outputs: int[2] hsv_lower, int[2] hsv_higher, int num_erosions, int num_dilations
-def find_tennis_ball(hsv_lower, hsv_upper, num_erosions, num_dilations):
-	# Create a PyZEDCamera object
-	zed = zcam.PyZEDCamera()
-
-	# Create a PyInitParameters object and set configuration parameters
-	init_params = zcam.PyInitParameters()
-	init_params.coordinate_units = sl.PyUNIT.PyUNIT_MILLIMETER  # Use milliliter units (for depth measurements)
-
-	# Open the camera
-	if not zed.is_opened():
-		print("Opening ZED Camera...")
-	status = zed.open(init_params)
-	if status != tp.PyERROR_CODE.PySUCCESS:
-		print(repr(status))
-		exit()
-
-	# Create and set PyRuntimeParameters after opening the camera
-	runtime_parameters = zcam.PyRuntimeParameters()
-	runtime_parameters.sensing_mode = sl.PySENSING_MODE.PySENSING_MODE_STANDARD  # Use STANDARD sensing mode
-
-	# Initialize arrays with proper format from ZED SDK
-	left_image = core.PyMat()
-	point_cloud = core.PyMat()
-
+#       The frame source is closed (given back to its CameraSession) when the
+#       function exits.
+#
+# Inputs: frame_source, int[2] hsv_lower, int[2] hsv_higher, int num_erosions, int num_dilations,
+#         int num_workers, bool tracking, int pyramid_levels, str depth_method, str color_classifier,
+#         bool multi_candidate, bool adaptive_hough, bool circle_shortcut, bool smoothing, bool obstacles,
+#         bool odometry, float drive_speed, bool timing, str trace_path, bool headless,
+#         ResultPublisher publisher, SessionRecorder recorder, VideoStreamer streamer
+# Outputs:
+def find_tennis_ball(frame_source, hsv_lower, hsv_upper, num_erosions, num_dilations, num_workers=0,
+                     tracking=False, pyramid_levels=0, depth_method='median', color_classifier='hsv',
+                     multi_candidate=False, adaptive_hough=False, circle_shortcut=False, smoothing=False,
+                     obstacles=False, odometry=False, drive_speed=0.0, timing=False, trace_path=None, headless=False,
+                     publisher=None, recorder=None, streamer=None):
 	# Update user with information
-	print_camera_information(camera=zed)
-
-	# Capture images and depth until 'q' is pressed
+	frame_source.print_information()
+
+	calibration = frame_source.calibration
+	tracker = BallTracker() if tracking else None
+	# the results reach the main loop in frame order, so the estimator is only used here
+	estimator = PositionEstimator() if smoothing else None
+	estimate = None
+	obstacle_detector = ObstacleDetector(calibration) if obstacles else None
+	motion_estimator = MotionEstimator() if odometry else None
+	stall_detector = StallDetector() if odometry else None
+	stalled = False
+	lookup_table = HSVLookupTable(hsv_lower, hsv_upper) if color_classifier == 'lut' else None
+	# every detection thread reuses its own working buffers
+	thread_buffers = threading.local()
+	timer = StageTimer(trace=bool(trace_path)) if timing else NULL_TIMER
+
+	def detect(frame):
+		if not hasattr(thread_buffers, 'buffers'):
+			thread_buffers.buffers = DetectionBuffers()
+		return detect_tennis_ball(frame=frame, calibration=calibration, hsv_lower=hsv_lower, hsv_upper=hsv_upper,
+		                          num_erosions=num_erosions, num_dilations=num_dilations, tracker=tracker,
+		                          pyramid_levels=pyramid_levels, depth_method=depth_method,
+		                          buffers=thread_buffers.buffers, color_classifier=lookup_table,
+		                          multi_candidate=multi_candidate, adaptive_hough=adaptive_hough,
+		                          circle_shortcut=circle_shortcut, timer=timer)
+
+	# Count processed frames and their latency to report on exit
+	frame_count = 0
+	total_latency = 0.0
+	max_latency = 0.0
+	start_time = time.time()
+
+	if num_workers > 0:
+		pipeline = DetectionPipeline(frame_source=frame_source, detect=detect, num_workers=num_workers,
+		                             timer=timer)
+		pipeline.start()
+
+	# Capture images and depth until 'q' is pressed (or until interrupted when headless)
 	key = ''
-	while key != 113:  # for 'q' key
-		# grab the current frame
-		if zed.grab(runtime_parameters) == tp.PyERROR_CODE.PySUCCESS:
-			# Retrieve left image
-			zed.retrieve_image(left_image, sl.PyVIEW.PyVIEW_LEFT)
-			cv_frame = left_image.get_data()
+	frame_id = 0
+	try:
+		while key != 113:  # for 'q' key
+			if num_workers > 0:
+				item = pipeline.get_result(timeout=0.005)
+				if item is None:
+					if pipeline.is_finished():
+						break
+					if not headless:
+						# keep the window responsive while waiting for a result
+						key = cv2.waitKey(1)
+					continue
+				frame_id, capture_time, frame, result = item
+			else:
+				# grab the current frame
+				capture_time = time.time()
+				grabbed, frame = frame_source.read(timer=timer)
+
+				# if we are replaying a recording and did not grab a frame,
+				# then we have reached the end of the recording
+				if not frame_source.is_live and not grabbed:
+					break
+				if not grabbed:
+					continue
+				result = detect(frame)
+				frame_id += 1
+
+			t = timer.clock()
+			if estimator is not None:
+				estimate = estimator.update(capture_time, result)
+				t = timer.record('smooth', t)
+			if obstacle_detector is not None:
+				obstacle_map = obstacle_detector.detect(frame.point_cloud)
+				t = timer.record('obstacles', t)
+			if motion_estimator is not None:
+				# the pipeline hands the frames over in order, possibly with dropped
+				# frames, so the motion and the stall window go by the capture time
+				motion = motion_estimator.update(capture_time, frame)
+				if stall_detector.update(capture_time, motion, drive_speed > 0) != stalled:
+					stalled = stall_detector.stalled
+					if not headless:
+						translation, rotation = stall_detector.net_motion()
+						print("{0}: {1:.0f} mm, {2:.1f} deg in the last {3} s, commanded {4:.0f} mm/s".format(
+							"Stall" if stalled else "Moving again", translation, rotation, stall_detector.window,
+							drive_speed))
+				t = timer.record('odometry', t)
+			if publisher is not None:
+				publisher.publish(frame_id, capture_time, result, smoothing, estimate)
+				t = timer.record('publish', t)
+			if recorder is not None:
+				# before the detection is drawn on the frame
+				recorder.record(capture_time, frame, result, timer=timer)
+				t = timer.clock()
+
+			if not headless:
+				print_detection(result, estimate)
+			if not headless or streamer is not None:
+				draw_detection(frame.image, result)
+				if obstacle_detector is not None:
+					draw_obstacles(frame.image, obstacle_map, calibration)
+				if motion_estimator is not None:
+					draw_motion(frame.image, motion, stalled)
+				if timing:
+					timer.draw_overlay(frame.image)
+				t = timer.record('draw', t)
+			if streamer is not None:
+				streamer.submit(frame_id, capture_time, frame.image)
+				t = timer.record('stream', t)
+
+			if not headless:
+				# show the frame to our screen
+				cv2.imshow('final', frame.image)
+				# cv2.imshow('temp', cv_frame_temp)
+				# cv2.imshow('mask', mask3)
+			if num_workers > 0:
+				# the frame buffer can be reused by the capture thread
+				pipeline.release(item)
+
+			latency = time.time() - capture_time
+			frame_count += 1
+			total_latency += latency
+			max_latency = max(max_latency, latency)
+
+			if not headless:
+				key = cv2.waitKey(5)
+				timer.record('imshow', t)
+			timer.add('latency', latency)
+			timer.end_frame()
+	except KeyboardInterrupt:
+		# the headless mode runs until it is interrupted
+		if not headless:
+			raise
+
+	if num_workers > 0:
+		pipeline.stop()
+	# Give the camera back to the session
+	if not headless:
+		cv2.destroyAllWindows()
+	frame_source.close()
+	elapsed_time = time.time() - start_time
+	if elapsed_time > 0 and frame_count > 0:
+		print("Processed {0} frames in {1:.1f} seconds ({2:.1f} FPS).".format(
+			frame_count, elapsed_time, frame_count / elapsed_time))
+		print("Latency from capture to output: {0:.1f} ms average, {1:.1f} ms max.".format(
+			1000 * total_latency / frame_count, 1000 * max_latency))
+	if num_workers > 0:
+		print("Dropped {0} stale frames and {1} stale results.".format(
+			pipeline.frames.dropped, pipeline.results.dropped))
+	if estimator is not None:
+		print("Rejected {0} outlier positions.".format(estimator.rejected))
+	if publisher is not None:
+		print("Published {0} results ({1} could not be sent).".format(publisher.sent, publisher.dropped))
+	if streamer is not None:
+		print("Streamed {0} frames ({1:.1f} MB), {2} frames dropped.".format(
+			streamer.sent, streamer.sent_bytes / 1e6, streamer.dropped()))
+	if timing:
+		timer.print_summary()
+		if trace_path:
+			timer.dump(trace_path)
+			print("Wrote the stage times to {0}".format(trace_path))
+	print("Exiting tennis ball detection module...")
 
-			# Retrieve colored point cloud. Point cloud is aligned on the left camera
-			zed.retrieve_measure(point_cloud, sl.PyMEASURE.PyMEASURE_XYZ)
+# Desc: Result of running the detection on one frame.
+#       found is True when a color region with a valid distance was found
+#       detected is True when the Hough transform confirmed a circle in that region
+#       distance (mm), azimuth and elevation (radians) are the rover coordinates
+#           of the region (None if not found)
+#       guess_circle is the (x, y, radius) of the largest (or best scored) color
+#           region (None if none)
+#       circle is the (x, y, radius) of the detected circle in frame coordinates
+#           (None if not detected)
+#       search_window is the (x1, y1, x2, y2) part of the frame that was searched
+#           in tracking mode (None if the full frame was searched)
+#       depth_confidence is how much the distance can be trusted, from 0 to 1
+#           (see coordinates_to_largest_contour)
+#       candidates is the list of scored color regions, best first, with
+#           multi_candidate (see candidates.py), otherwise None
+#       roi_clipped is the fraction (0 to 1) of the Hough ROI that was off the
+#           frame and padded (None if HoughCircles did not run)
+DetectionResult = collections.namedtuple('DetectionResult', ['found', 'detected', 'distance', 'azimuth',
+                                                             'elevation', 'guess_circle', 'circle',
+                                                             'search_window', 'depth_confidence', 'candidates',
+                                                             'roi_clipped'])
+
+# Desc: Working buffers (HSV frame, masks, pyramid levels) of detect_tennis_ball.
+#       Each buffer is allocated once for the largest image it has to hold and
+#       smaller images (tracking windows, pyramid levels) use a view of it, so
+#       the detection loop does not allocate new arrays every frame. One
+#       DetectionBuffers must not be shared between threads.
+class DetectionBuffers(object):
+	def __init__(self):
+		self.arrays = {}
+
+	# Desc: Return a uint8 view of the given shape of the named buffer,
+	#       (re)allocating the buffer only if it is too small
+	# Inputs: str name, tuple shape
+	# Outputs: numpy array
+	def view(self, name, shape):
+		array = self.arrays.get(name)
+		if (array is None or array.shape[2:] != tuple(shape[2:]) or
+				array.shape[0] < shape[0] or array.shape[1] < shape[1]):
+			array = np.empty(shape, dtype=np.uint8)
+			self.arrays[name] = array
+		return array[:shape[0], :shape[1]]
+
+	# Desc: Total size of the buffers in bytes
+	# Inputs:
+	# Outputs: int
+	def nbytes(self):
+		return sum(array.nbytes for array in self.arrays.values())
+
+# Desc: Run the tennis ball detection described in find_tennis_ball on one frame.
+#       Does not draw on the frame or print anything.
+#       calibration is the CameraCalibration of the frame source
+#       tracker is an optional BallTracker. When it is locked on the ball, only
+#           its search window is converted, masked and searched for contours.
+#       pyramid_levels is how many times the searched image is halved before the
+#           color mask and contours are computed. The erosions and dilations then
+#           work on the downscaled mask, where each iteration removes/adds more
+#           pixels of the full resolution image, so one iteration of each is left
+#           out per level (otherwise a far ball is eroded away at level 2).
+#       depth_method is how the position is read from the point cloud, see
+#           coordinates_to_largest_contour
+#       buffers is an optional DetectionBuffers the working images are written
+#           into instead of allocating new ones
+#       color_classifier is an optional HSVLookupTable. If given, it segments the
+#           color instead of the HSV conversion and cv2.inRange, and its own
+#           bounds are used instead of hsv_lower/hsv_upper.
+#       hough_param1, hough_param2 and radius_band are passed to detect_circle
+#       multi_candidate scores every color region (circularity, color fill and
+#           size against depth, see candidates.py) and uses the best one instead
+#           of the largest one, so a bigger distractor does not hide the ball
+#       adaptive_hough picks the radius band, the accumulator resolution (dp) and
+#           the ROI buffer of the distance bucket (see HOUGH_DISTANCE_BUCKETS in
+#           calibration.py) instead of the fixed ones
+#       circle_shortcut accepts the color region as the circle without running
+#           HoughCircles when its contour is confidently round (see moment_circle)
+#       timer records how long each stage takes (see instrumentation.py)
+# Inputs: Frame frame, CameraCalibration calibration, int[2] hsv_lower, int[2] hsv_higher,
+#         int num_erosions, int num_dilations, BallTracker tracker, int pyramid_levels,
+#         str depth_method, DetectionBuffers buffers, HSVLookupTable color_classifier,
+#         int hough_param1, int hough_param2, float[2] radius_band, bool multi_candidate,
+#         bool adaptive_hough, bool circle_shortcut, StageTimer timer
+# Outputs: DetectionResult
+def detect_tennis_ball(frame, calibration, hsv_lower, hsv_upper, num_erosions, num_dilations, tracker=None,
+                       pyramid_levels=0, depth_method='median', buffers=None, color_classifier=None,
+                       hough_param1=200, hough_param2=15, radius_band=None, multi_candidate=False,
+                       adaptive_hough=False, circle_shortcut=False, timer=NULL_TIMER):
+	t = timer.clock()
+	cv_frame = frame.image
+	point_cloud = frame.point_cloud
+	image_height, image_width = cv_frame.shape[:2]
+
+	# In tracking mode, only search the window around the predicted ball position
+	search_window = None
+	if tracker is not None:
+		search_window = tracker.predict(image_width, image_height)
+	if search_window is not None:
+		wx1, wy1, wx2, wy2 = search_window
+		search_frame = cv_frame[wy1:wy2, wx1:wx2]
+		offset = (wx1, wy1)
+	else:
+		search_frame = cv_frame
+		offset = (0, 0)
+
+	# In pyramid mode, search for the color on a downscaled image
+	scale = 1
+	for i in range(pyramid_levels):
+		height, width = search_frame.shape[:2]
+		level = None
+		if buffers is not None:
+			level = buffers.view('pyramid{0}'.format(i),
+			                     ((height + 1) // 2, (width + 1) // 2) + search_frame.shape[2:])
+		search_frame = cv2.pyrDown(search_frame, dst=level)
+		scale *= 2
+	if pyramid_levels > 0:
+		t = timer.record('pyrDown', t)
+	num_erosions = max(num_erosions - pyramid_levels, 0)
+	num_dilations = max(num_dilations - pyramid_levels, 0)
+
+	hsv = mask1 = mask2 = mask3 = None
+	if buffers is not None:
+		height, width = search_frame.shape[:2]
+		if color_classifier is None:
+			hsv = buffers.view('hsv', (height, width, 3))
+		mask1 = buffers.view('mask1', (height, width))
+		mask2 = buffers.view('mask2', (height, width))
+		mask3 = buffers.view('mask3', (height, width))
+
+	# Construct a mask for the color "yellow", then perform a series of dilations
+	# and erosions to remove any small blobs left in the mask
+	# OpenCV examples found here: https://docs.opencv.org/master/db/df6/tutorial_erosion_dilatation.html
+	# More information on morphological operations:
+	#   https://docs.opencv.org/3.0-beta/doc/py_tutorials/py_imgproc/py_morphological_ops/py_morphological_ops.html
+	if color_classifier is not None:
+		# one table lookup per pixel, no color space conversion
+		mask1 = color_classifier.apply(search_frame, dst=mask1)
+		t = timer.record('lookup table', t)
+	else:
+		# Convert the frame to the HSV color space. A median blur with a kernel size
+		# of 1 only copies the frame, so the blur is skipped.
+		hsv = cv2.cvtColor(search_frame, cv2.COLOR_BGR2HSV, dst=hsv)
+		t = timer.record('cvtColor', t)
+		mask1 = cv2.inRange(hsv, hsv_lower, hsv_upper, dst=mask1)
+		t = timer.record('inRange', t)
+	mask2 = cv2.erode(mask1, None, dst=mask2, iterations=num_erosions)
+	mask3 = cv2.dilate(mask2, None, dst=mask3, iterations=num_dilations)
+	t = timer.record('morphology', t)
+
+	# Find contours in the mask
+	# Documentation for findContours found here:
+	# https://docs.opencv.org/3.1.0/d3/dc0/group__imgproc__shape.html#ga17ed9f5d79ae97bd4c7cf18403e1689a
+	# findCountours returns an array of x,y coordinates that outlines the contours.
+	# Since OpenCV 3.2 it does not modify the mask, so the mask is not copied.
+	cnts = cv2.findContours(mask3, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+	t = timer.record('findContours', t)
+
+	candidates = None
+	if multi_candidate:
+		# Score every contour at once and keep the best one instead of the largest one
+		candidates = rank_candidates(contours=cnts, color_mask=mask1, point_cloud=point_cloud,
+		                             calibration=calibration, scale=scale, offset=offset)
+		cnts = [candidates[0].contour] if candidates else []
+		t = timer.record('candidates', t)
+
+	# only proceed if at least one contour was found
+	if len(cnts) == 0:
+		if tracker is not None:
+			tracker.miss()
+		return DetectionResult(found=False, detected=False, distance=None, azimuth=None, elevation=None,
+		                       guess_circle=None, circle=None, search_window=search_window,
+		                       depth_confidence=0.0, candidates=candidates, roi_clipped=None)
+
+	# find the largest contour in mask3 (the only one with multi_candidate)
+	c = max(cnts, key=cv2.contourArea)
+
+	# move the contour from the (downscaled) search window to full resolution frame
+	# coordinates; a downscaled pixel covers scale x scale pixels, so use their center
+	if scale != 1 or offset != (0, 0):
+		c = c * scale + np.array([offset[0] + scale // 2, offset[1] + scale // 2], dtype=c.dtype)
 
-			# Resize the frame, blur it, and convert it to the HSV color space
-			blur_frame = cv2.medianBlur(cv_frame, 1)
-			hsv = cv2.cvtColor(blur_frame, cv2.COLOR_BGR2HSV)
+	#################################
+	# For debugging
+	#
+	# cv2.drawContours(cv_frame, c, -1, (0, 255, 0), 3)
+	#################################
 
-			# Construct a mask for the color "yellow", then perform a series of dilations
-			# and erosions to remove any small blobs left in the mask
-			# OpenCV examples found here: https://docs.opencv.org/master/db/df6/tutorial_erosion_dilatation.html
-			# More information on morphological operations:
-			#   https://docs.opencv.org/3.0-beta/doc/py_tutorials/py_imgproc/py_morphological_ops/py_morphological_ops.html
-			mask1 = cv2.inRange(hsv, hsv_lower, hsv_upper)
-			mask2 = cv2.erode(mask1, None, iterations=num_erosions)
-			mask3 = cv2.dilate(mask2, None, iterations=num_dilations)
-
-			# Find contours in the mask
-			# Documentation for findContours found here:
-			# https://docs.opencv.org/3.1.0/d3/dc0/group__imgproc__shape.html#ga17ed9f5d79ae97bd4c7cf18403e1689a
-			# findCountours returns an array of x,y coordinates that outlines the contours
-			cnts = cv2.findContours(mask3.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
-
-			guess_x_coord = 0
-			guess_y_coord = 0
-			guess_radius = 0
-
-			# only proceed if at least one contour was found
-			if len(cnts) > 0:
-				# find the largest contour in mask3
-				c = max(cnts, key=cv2.contourArea)
-
-				#################################
-				# For debugging
-				#
-				# cv2.drawContours(cv_frame, c, -1, (0, 255, 0), 3)
-				#################################
-
-				# guess where the tennis ball is from the largest contour,
-				# draw a yellow circle around it, and find the x, y coordinates
-				guess_x_coord, guess_y_coord, guess_radius = guess_circle(contour_array=c)
-
-				# determine centroid coordinates and distance to centroid from camera
-				distance_to_ball, centroid_x_coord, centroid_y_coord, tennis_ball_coord = \
-					coordinates_to_largest_contour(moment=cv2.moments(c), point_cloud_matrix=point_cloud)
-
-				if distance_to_ball != -1: #if coordinates_to_largest_contour did not error
-					tennis_ball_pixels_x, tennis_ball_pixels_y = \
-						size_tennis_ball_pixels(zed=zed, distance=distance_to_ball)
-
-					# Can't have non-integer pixels, so take the ceiling of the pixels/2 to create a Region of Interest (ROI)
-					# Also, add some buffer pixels to deal with image rectication stretching the image (mostly around
-					# the edges).
-					buffer = tennis_ball_pixels_x * 0.5
-					x1 = math.ceil(centroid_x_coord - (tennis_ball_pixels_x / 2 + buffer))
-					x2 = math.ceil(centroid_x_coord + (tennis_ball_pixels_x / 2 + buffer))
-					y1 = math.ceil(centroid_y_coord - (tennis_ball_pixels_y / 2 + buffer))
-					y2 = math.ceil(centroid_y_coord + (tennis_ball_pixels_y / 2 + buffer))
-					image_width = left_image.get_width()
-					image_height = left_image.get_height()
-
-					# If ROI extends off the frame, program crashes. Checks if the ROI would extend
-					# off the frame. If so, the code does not run.
-					#
-					###############################################################################
-					# FUTURE WORK:
-					#   Instead of not running the following code when the ROI extends off the
-					#   frame, shift/change the ROI to only go to the edge of the frame.
-					###############################################################################
-					if (0 <= y1 <= image_height and 0 <= y2 <= image_height and
-							0 <= x1 <= image_width and 0 <= x2 <= image_width and
-							x1 != x2 and y1 != y2):
-						tennis_ball = cv_frame[y1:y2, x1:x2]
-
-						#################################
-						# For debugging
-						#
-						# cv2.rectangle(img=cv_frame, pt1=(x1, y1), pt2=(x2,y2), color=(0,0,255), thickness=2)
-						#
-						#################################
-
-						# expected radius from averaging tennis_ball_pixels_x & tennis_ball_pixels_y
-						radius = int(((tennis_ball_pixels_x + tennis_ball_pixels_y) / 2) / 2)
-						circles = detect_circle(frame=tennis_ball, expected_radius=radius)
-
-						# ensure at least some circles were found
-						if circles is not None:
-							# convert the (x, y) coordinates and radius of the circles to integers
-							circles = np.round(circles[0, :]).astype("int")
-
-							# draw the largest circle (the 0th index of array circles) by x-y coordinates and radius
-							x = circles.item(0, 0)
-							y = circles.item(0, 1)
-							r = circles.item(0, 2)
-							cv2.circle(img=tennis_ball, center=(x, y), radius=r, color=(0, 0, 255), thickness=2)
-							distance, azimuth, elevation = get_rover_coordinates(x_coord=tennis_ball_coord[0],
-							                                                     y_coord=tennis_ball_coord[1],
-							                                                     z_coord=tennis_ball_coord[2])
-							#################################
-							# For debugging
-							#
-							print("Detected tennis ball at\n"
-							      "    Distance: {0} meters\n"
-							      "    Rotate: {1} degrees\n"
-							      "    Elevate: {2} degrees\n".format(np.around(distance / 1000, decimals=2),
-							                                          np.around(azimuth * 180 / np.pi, decimals=2),
-							                                          np.around(elevation * 180 / np.pi, decimals=2)))
-							#
-							#################################
-						else:
-							# If a circle is not detected, guess the rover coordinates by color only
-							distance_guess, azimuth_guess, elevation_guess = get_rover_coordinates(
-								x_coord=tennis_ball_coord[0],
-								y_coord=tennis_ball_coord[1],
-								z_coord=tennis_ball_coord[2])
-							#################################
-							# For debugging
-							#
-							print("Guessed tennis ball location at\n"
-							      "    Distance: {0} meters\n"
-							      "    Rotate: {1} degrees\n"
-							      "    Elevate: {2} degrees\n".format(np.around(distance_guess / 1000, decimals=2),
-							                                          np.around(azimuth_guess * 180 / np.pi, decimals=2),
-							                                          np.around(elevation_guess * 180 / np.pi, decimals=2)))
-							#
-							#################################
-
-			if guess_radius > 1:
-				# draw the guess_circle on the frame,
-				cv2.circle(img=cv_frame, center=(int(guess_x_coord), int(guess_y_coord)), radius=int(guess_radius)
-						   , color=(0, 255, 255), thickness=1)
-			cv2.drawMarker(img=cv_frame, position=(guess_x_coord, guess_y_coord), color=(0, 0, 255),
-						   markerType=cv2.MARKER_TILTED_CROSS, markerSize=10, thickness=1)
-
-			# show the frame to our screen
-			cv2.imshow('final', cv_frame)
-			# cv2.imshow('temp', cv_frame_temp)
-			# cv2.imshow('mask', mask3)
+	# guess where the tennis ball is from the largest contour
+	guess = guess_circle(contour_array=c)
+	if tracker is not None:
+		tracker.update(*guess)
+
+	# determine centroid coordinates and distance to centroid from camera
+	moment = cv2.moments(c)
+	t = timer.record('contour', t)
+	distance_to_ball, centroid_x_coord, centroid_y_coord, tennis_ball_coord, depth_confidence = \
+		coordinates_to_largest_contour(moment=moment, point_cloud_matrix=point_cloud,
+		                               contour=c, depth_method=depth_method)
+	t = timer.record('depth', t)
+
+	if distance_to_ball == -1: # if coordinates_to_largest_contour errored
+		return DetectionResult(found=False, detected=False, distance=None, azimuth=None, elevation=None,
+		                       guess_circle=guess, circle=None, search_window=search_window,
+		                       depth_confidence=0.0, candidates=candidates, roi_clipped=None)
+
+	distance, elevation, azimuth = get_rover_coordinates(x_coord=tennis_ball_coord[0],
+	                                                     y_coord=tennis_ball_coord[1],
+	                                                     z_coord=tennis_ball_coord[2])
+
+	tennis_ball_pixels_x, tennis_ball_pixels_y = \
+		size_tennis_ball_pixels(calibration=calibration, distance=distance_to_ball)
+
+	# expected radius from averaging tennis_ball_pixels_x & tennis_ball_pixels_y, the
+	# radius band, the accumulator resolution and the ROI buffer
+	radius, min_radius, max_radius = calibration.hough_radius_band(distance_to_ball)
+	dp = 1
+	roi_buffer = 0.5
+	if adaptive_hough:
+		settings = calibration.adaptive_hough(distance_to_ball)
+		# None when the distance has no bucket (e.g. a depth that rounds to 0): keep the fixed band
+		if settings is not None:
+			radius, min_radius, max_radius, dp, roi_buffer = settings
+	if radius_band is not None:
+		min_radius = math.floor(radius * radius_band[0])
+		max_radius = math.ceil(radius * radius_band[1])
+
+	circle = None
+	if circle_shortcut:
+		# each dilation grows and each erosion shrinks the region by a pixel of the searched image
+		circle = moment_circle(contour=c, moment=moment, min_radius=min_radius, max_radius=max_radius,
+		                       grow=(num_dilations - num_erosions) * scale)
+		t = timer.record('moment circle', t)
+	if circle is not None:
+		return DetectionResult(found=True, detected=True, distance=distance, azimuth=azimuth,
+		                       elevation=elevation, guess_circle=guess, circle=circle, search_window=search_window,
+		                       depth_confidence=depth_confidence, candidates=candidates, roi_clipped=None)
+
+	# Can't have non-integer pixels, so take the ceiling of the pixels/2 to create a Region of Interest (ROI)
+	# Also, add some buffer pixels to deal with image rectication stretching the image (mostly around
+	# the edges).
+	buffer = tennis_ball_pixels_x * roi_buffer
+	x1 = math.ceil(centroid_x_coord - (tennis_ball_pixels_x / 2 + buffer))
+	x2 = math.ceil(centroid_x_coord + (tennis_ball_pixels_x / 2 + buffer))
+	y1 = math.ceil(centroid_y_coord - (tennis_ball_pixels_y / 2 + buffer))
+	y2 = math.ceil(centroid_y_coord + (tennis_ball_pixels_y / 2 + buffer))
+
+	# The ROI is clamped to the frame; the part of it off the frame is padded so
+	# a ball cut by the edge of the frame can still be found
+	tennis_ball, roi_clipped = crop_roi(cv_frame=cv_frame, x1=x1, y1=y1, x2=x2, y2=y2, buffers=buffers)
+	if tennis_ball is not None:
+		#################################
+		# For debugging
+		#
+		# cv2.rectangle(img=cv_frame, pt1=(x1, y1), pt2=(x2,y2), color=(0,0,255), thickness=2)
+		#
+		#################################
 
-			key = cv2.waitKey(5)
-	# Close the camera
-	cv2.destroyAllWindows()
-	zed.close()
-	print("Exiting tennis ball detection module...")
+		circles = detect_circle(frame=tennis_ball, expected_radius=radius,
+		                        min_radius=min_radius, max_radius=max_radius,
+		                        param1=hough_param1, param2=hough_param2, radius_band=radius_band, dp=dp)
+		t = timer.record('HoughCircles', t)
+
+		# ensure at least some circles were found
+		if circles is not None:
+			# convert the (x, y) coordinates and radius of the circles to integers
+			circles = np.round(circles[0, :]).astype("int")
+
+			# the largest circle is the 0th index of array circles; move it from ROI to frame coordinates
+			circle = (x1 + circles.item(0, 0), y1 + circles.item(0, 1), circles.item(0, 2))
+
+	return DetectionResult(found=True, detected=circle is not None, distance=distance, azimuth=azimuth,
+	                       elevation=elevation, guess_circle=guess, circle=circle, search_window=search_window,
+	                       depth_confidence=depth_confidence, candidates=candidates, roi_clipped=roi_clipped)
+
+# Desc: Cut the ROI x1..x2, y1..y2 out of the frame. The ROI is clamped to the
+#       frame and, only when it goes past an edge, the missing part is filled by
+#       repeating the edge pixels (cv2.BORDER_REPLICATE). Repeated pixels have no
+#       gradient across the edge of the frame, so unlike a constant border they
+#       add no edge for HoughCircles to vote on, and the returned ROI keeps its
+#       full size so circle coordinates are still relative to x1, y1.
+#       buffers is an optional DetectionBuffers the padded ROI is written into
+# Inputs: cv2 frame, int x1, int y1, int x2, int y2, DetectionBuffers buffers
+# Outputs: ROI image (None if the ROI is empty or entirely off the frame),
+#          float fraction of the ROI that was off the frame
+def crop_roi(cv_frame, x1, y1, x2, y2, buffers=None):
+	image_height, image_width = cv_frame.shape[:2]
+	roi_area = (x2 - x1) * (y2 - y1)
+	cx1, cy1 = max(x1, 0), max(y1, 0)
+	cx2, cy2 = min(x2, image_width), min(y2, image_height)
+	if x2 <= x1 or y2 <= y1 or cx2 <= cx1 or cy2 <= cy1:
+		return None, 1.0
+	clipped = 1.0 - (cx2 - cx1) * (cy2 - cy1) / float(roi_area)
+	roi = cv_frame[cy1:cy2, cx1:cx2]
+	if clipped == 0:
+		# inside the frame: a view, nothing is copied
+		return roi, 0.0
+	padded = None
+	if buffers is not None:
+		padded = buffers.view('roi', (y2 - y1, x2 - x1) + cv_frame.shape[2:])
+	padded = cv2.copyMakeBorder(roi, cy1 - y1, y2 - cy2, cx1 - x1, x2 - cx2, cv2.BORDER_REPLICATE, dst=padded)
+	return padded, clipped
+
+# Desc: Draw the guess circle, the guess marker, the detected circle and the
+#       tracking search window on the frame
+# Inputs: cv2 frame, DetectionResult result
+# Outputs:
+def draw_detection(cv_frame, result):
+	guess_x_coord, guess_y_coord, guess_radius = result.guess_circle or (0, 0, 0)
+	# the other scored color regions, with their score
+	for candidate in (result.candidates or [])[1:]:
+		cv2.circle(img=cv_frame, center=(candidate.x, candidate.y), radius=max(candidate.radius, 1),
+		           color=(128, 128, 128), thickness=1)
+		cv2.putText(cv_frame, "{0:.2f}".format(candidate.score), (candidate.x, candidate.y),
+		            cv2.FONT_HERSHEY_SIMPLEX, 0.4, (128, 128, 128), 1)
+	if result.search_window is not None:
+		x1, y1, x2, y2 = result.search_window
+		cv2.rectangle(img=cv_frame, pt1=(x1, y1), pt2=(x2, y2), color=(255, 0, 0), thickness=1)
+	if result.circle is not None:
+		x, y, r = result.circle
+		cv2.circle(img=cv_frame, center=(x, y), radius=r, color=(0, 0, 255), thickness=2)
+	if guess_radius > 1:
+		# draw the guess_circle on the frame,
+		cv2.circle(img=cv_frame, center=(int(guess_x_coord), int(guess_y_coord)), radius=int(guess_radius)
+				   , color=(0, 255, 255), thickness=1)
+	cv2.drawMarker(img=cv_frame, position=(guess_x_coord, guess_y_coord), color=(0, 0, 255),
+				   markerType=cv2.MARKER_TILTED_CROSS, markerSize=10, thickness=1)
+
+# Desc: Print the rover coordinates of a detected or guessed tennis ball,
+#       or its smoothed position when an estimate is given
+# Inputs: DetectionResult result, PositionEstimate estimate
+# Outputs:
+def print_detection(result, estimate=None):
+	if estimate is not None:
+		print("Tracked tennis ball at\n"
+		      "    Distance: {0} meters\n"
+		      "    Rotate: {1} degrees\n"
+		      "    Elevate: {2} degrees\n"
+		      "    Speed: {3} meters/second\n"
+		      "    Confidence: {4}{5}\n".format(np.around(estimate.distance / 1000, decimals=2),
+		                                       np.around(estimate.azimuth * 180 / np.pi, decimals=2),
+		                                       np.around(estimate.elevation * 180 / np.pi, decimals=2),
+		                                       np.around(estimate.speed / 1000, decimals=2),
+		                                       np.around(estimate.confidence, decimals=2),
+		                                       " (outlier rejected)" if estimate.outlier else ""))
+		return
+	if not result.found:
+		return
+	#################################
+	# For debugging
+	#
+	if result.detected:
+		header = "Detected tennis ball at\n"
+	else:
+		# If a circle is not detected, the rover coordinates are guessed by color only
+		header = "Guessed tennis ball location at\n"
+	if result.roi_clipped:
+		header += "    ({0:.0f}% of the search region was off the frame)\n".format(100 * result.roi_clipped)
+	print(header +
+	      "    Distance: {0} meters\n"
+	      "    Rotate: {1} degrees\n"
+	      "    Elevate: {2} degrees\n".format(np.around(result.distance / 1000, decimals=2),
+	                                          np.around(result.azimuth * 180 / np.pi, decimals=2),
+	                                          np.around(result.elevation * 180 / np.pi, decimals=2)))
+	#
+	#################################
 
 # Desc: Transform the ZED x,y,z-coordinate system to distance, elevation, and azimuth (rotation)
 #           Distance is always positive
@@ -266,7 +833,7 @@ def find_tennis_ball(hsv_lower, hsv_upper, num_erosions, num_dilations):
 #       Documentation for ZED coordinate system:
 #       https://docs.stereolabs.com/overview/positional-tracking/coordinate-frames/
 # Inputs: float x_coord, float y_coord, float z_coord
-# Outputs: int r, int y, int radius
+# Outputs: float r (distance), float elevation, float azimuth
 def get_rover_coordinates(x_coord, y_coord, z_coord):
 	hxz = np.hypot(x_coord, z_coord)
 	# r is distance from left lens to coordinate
@@ -277,6 +844,33 @@ def get_rover_coordinates(x_coord, y_coord, z_coord):
 	azimuth = np.arctan2(x_coord, z_coord)
 	return float(r), float(elevation), float(azimuth)
 
+# Desc: get_rover_coordinates for many points in one vectorized call
+#           points is an N x 3 array of x,y,z-coordinates, or an H x W x 3 (or 4, as
+#               the ZED XYZRGBA point cloud) array; only the first 3 channels are used
+#           dtype is the type of the results (float32 by default, like the point cloud)
+#           out is an optional preallocated 3 x N (or 3 x H x W) array for the results,
+#               so a loop over frames does not allocate; its dtype is used instead
+#           Points with NaN or inf coordinates give NaN (or inf) results.
+# Inputs: numpy array points, numpy dtype dtype, numpy array out
+# Outputs: numpy arrays distance, elevation, azimuth (views of out when given)
+def get_rover_coordinates_batch(points, dtype=np.float32, out=None):
+	points = np.asarray(points)
+	x_coord = points[..., 0]
+	y_coord = points[..., 1]
+	z_coord = points[..., 2]
+	if out is None:
+		out = np.empty((3,) + points.shape[:-1], dtype=dtype)
+	elif out.shape != (3,) + points.shape[:-1]:
+		raise ValueError("out has shape {0}, expected {1}".format(out.shape, (3,) + points.shape[:-1]))
+	r, elevation, azimuth = out
+	# hxz is kept in r until the distance is computed
+	np.hypot(x_coord, z_coord, out=r)
+	np.arctan2(y_coord, r, out=elevation)
+	np.negative(elevation, out=elevation)
+	np.hypot(r, y_coord, out=r)
+	np.arctan2(x_coord, z_coord, out=azimuth)
+	return r, elevation, azimuth
+
 # Desc: Use minEnclosingCirce function to guess where circle is and return the circle
 #       center point and radius.
 #       Documentation for minEnlcosingCircle found here:
@@ -292,53 +886,91 @@ def guess_circle(contour_array):
 #       https://docs.opencv.org/3.4.1/dd/d1a/group__imgproc__feature.html#ga47849c3be0d0406ad3ca45db65a25d2d
 #       A great summary of the function is found in the second comment here:
 #       https://dsp.stackexchange.com/questions/22648/in-opecv-function-hough-circles-how-does-parameter-1-and-2-affect-circle-detecti
-# Inputs: cv2 frame, int expected_radius
+#       The radius band searched is radius_band (default 0.8 to 1.2) times
+#       expected_radius, unless min_radius and max_radius are given (see
+#       CameraCalibration.hough_radius_band).
+#       param1 and param2 are the HoughCircles Canny threshold and accumulator threshold.
+#       dp is the inverse ratio of the accumulator resolution to the image resolution
+# Inputs: cv2 frame, int expected_radius, int min_radius, int max_radius, int param1, int param2,
+#         float[2] radius_band, float dp
 # Outputs: array of circles[index_of_circle][x_coord][y_coord][radius]
-def detect_circle(frame, expected_radius):
+def detect_circle(frame, expected_radius, min_radius=None, max_radius=None, param1=200, param2=15,
+                  radius_band=None, dp=1):
+	if min_radius is None or max_radius is None:
+		band_low, band_high = radius_band or (.8, 1.2)
+		min_radius = math.floor(expected_radius*band_low)
+		max_radius = math.ceil(expected_radius*band_high)
+
 	blur_frame = cv2.medianBlur(frame, 1)
 	gray_frame = cv2.cvtColor(blur_frame,cv2.COLOR_BGR2GRAY)
 
 	# setting minDist to 1 because ASSUMING (ass U me) there is only 1 tennis ball
 	min_dist = 1
-	circles = cv2.HoughCircles(image=gray_frame,method=cv2.HOUGH_GRADIENT,dp=1,
-							   minDist=min_dist,param1=200,param2=15,
-							   minRadius=math.floor(expected_radius*.8),
-							   maxRadius=math.ceil(expected_radius*1.2))
+	circles = cv2.HoughCircles(image=gray_frame,method=cv2.HOUGH_GRADIENT,dp=dp,
+							   minDist=min_dist,param1=param1,param2=param2,
+							   minRadius=min_radius,
+							   maxRadius=max_radius)
 	#################################
 	# For debugging
 	#
-	# print('Expected radius between {0} - {1})\n'.format(int(expected_radius*.8), int(expected_radius*1.2)))
+	# print('Expected radius between {0} - {1})\n'.format(min_radius, max_radius))
 	# cv2.imshow('gray', gray_frame)
 	#################################
 	return circles
 
+# Desc: Cheap circle test from the contour of the color region, used instead
+#       of HoughCircles when it is confident. The region is a circle when
+#           - its second moments are the same in every direction (isotropy:
+#             smallest / largest eigenvalue of the covariance >= min_isotropy)
+#           - it is compact (4 pi area / perimeter^2 >= min_circularity; a
+#             square is pi/4 = 0.785, a digital disk of radius >= 12 is > 0.85)
+#           - its radius, less the grow pixels added by erode/dilate, is within
+#             min_radius..max_radius
+#       Regions smaller than min_pixels in radius are too coarse to judge (and
+#       HoughCircles is cheap for them), so they are left to HoughCircles.
+#       Returns None when the test is not confident, so HoughCircles runs.
+# Inputs: numpy array contour, dict moment (cv2.moments of the contour), int min_radius, int max_radius,
+#         float grow, float min_circularity, float min_isotropy, float min_pixels
+# Outputs: (x, y, radius) or None
+def moment_circle(contour, moment, min_radius, max_radius, grow=0, min_circularity=.85, min_isotropy=.9,
+                  min_pixels=10):
+	area = moment['m00']
+	if area < math.pi * min_pixels * min_pixels:
+		return None
+	# covariance of the region from its central moments
+	mu20 = moment['mu20'] / area
+	mu02 = moment['mu02'] / area
+	mu11 = moment['mu11'] / area
+	spread = math.sqrt(4 * mu11 * mu11 + (mu20 - mu02) * (mu20 - mu02))
+	if mu20 + mu02 + spread <= 0 or (mu20 + mu02 - spread) / (mu20 + mu02 + spread) < min_isotropy:
+		return None
+	perimeter = cv2.arcLength(contour, True)
+	if 4 * math.pi * area / (perimeter * perimeter) < min_circularity:
+		return None
+	# the contour goes through the centers of the edge pixels, so the region is half a pixel bigger
+	radius = math.sqrt(area / math.pi) + .5 - grow
+	if not min_radius <= radius <= max_radius:
+		return None
+	return int(moment['m10'] / area), int(moment['m01'] / area), int(round(radius))
+
 # Desc: Calculate the expected number of pixels in the x & y dimension
 #       for a standard tennis ball from the inputed distance and focal length.
-#       The focal length is pulled directly from the ZED camera parameters.
-# Inputs: pyzed.camera zed, int distance
+#       The sizes are precomputed from the camera calibration when the frame
+#       source is opened (see calibration.py), so this is only a table lookup.
+# Inputs: CameraCalibration calibration, int distance
 # Outputs: (pixels_x, pixels_y)
-def size_tennis_ball_pixels(zed, distance):
-	# get focal length in pixels of camera
-	calibration_params = zed.get_camera_information().calibration_parameters
-
-	focal_length_x = calibration_params.left_cam.fx
-	focal_length_y = calibration_params.left_cam.fy
-
-	# somehow distance can be None (Null); using conditional logic to prevent crash
-	if distance is not None and not np.isnan(distance) and not np.isinf(distance):
-		pixels_x = math.ceil(TENNIS_BALL_DIAMETER / distance * focal_length_x)
-		pixels_y = math.ceil(TENNIS_BALL_DIAMETER / distance * focal_length_y)
-		#################################
-		# For debugging
-		#
-		# print("Expected pixel dimensions for Tennis Ball on image\n"
-		#      "    x-dimension: {0} pixels\n"
-		#      "    y-dimension: {1} pixels\n".format(pixels_x, pixels_y))
-		#
-		#################################
-		return pixels_x, pixels_y
-	else:
-		return 0, 0
+def size_tennis_ball_pixels(calibration, distance):
+	# somehow distance can be None (Null); tennis_ball_pixels returns (0, 0) for it
+	pixels_x, pixels_y = calibration.tennis_ball_pixels(distance)
+	#################################
+	# For debugging
+	#
+	# print("Expected pixel dimensions for Tennis Ball on image\n"
+	#      "    x-dimension: {0} pixels\n"
+	#      "    y-dimension: {1} pixels\n".format(pixels_x, pixels_y))
+	#
+	#################################
+	return pixels_x, pixels_y
 
 # Desc: Determine the distance to the largest contour identified by it's moment
 #       and provide the centroid's x and y coordinate, along with the point cloud
@@ -346,16 +978,35 @@ def size_tennis_ball_pixels(zed, distance):
 #       If no distance is identified return -1 (impossible distance).
 #       Reference for image moments: https://en.wikipedia.org/wiki/Image_moment
 #       m00 = area
-# Inputs: cv2.moment, pyzed.core.PyMat matrix= point_cloud_matrix
-# Outputs: int distance, int cx (centroid_x_coord), int cy (centroid_y_coord), point_cloud_data
-def coordinates_to_largest_contour(moment, point_cloud_matrix):
-	#if moment["m00"] != 0:
+#
+#       depth_method selects where the point cloud data comes from:
+#           'pixel'   the single point cloud pixel at the centroid
+#           'median'  the median of every valid point under the contour
+#           'trimmed' the mean of the valid points near their median distance
+#       'median' and 'trimmed' need the contour and skip NaN/inf points (see depth.py).
+#       The confidence (0 to 1) is 1 for a valid 'pixel' read, otherwise the one
+#       returned by estimate_contour_position.
+# Inputs: cv2.moment, numpy array point_cloud_matrix (H x W x 3 or 4, from the frame source),
+#         numpy array contour, str depth_method
+# Outputs: int distance, int cx (centroid_x_coord), int cy (centroid_y_coord), point_cloud_data,
+#          float confidence
+def coordinates_to_largest_contour(moment, point_cloud_matrix, contour=None, depth_method='pixel'):
+	# a contour of one or two pixels (a far ball at a high pyramid level) has no area
+	if moment['m00'] == 0:
+		return -1, None, None, None, 0.0
 	centroid_x = int(moment['m10'] / moment['m00'])
 	centroid_y = int(moment['m01'] / moment['m00'])
 
 	# Get and print distance value in mm at the center of the image
 	# We measure the distance camera - object using Euclidean distance
-	err, point_cloud_value = point_cloud_matrix.get_value(int(centroid_x), int(centroid_y))
+	if depth_method == 'pixel' or contour is None:
+		point_cloud_value = point_cloud_matrix[int(centroid_y), int(centroid_x)]
+		confidence = 1.0
+	else:
+		point_cloud_value, confidence = estimate_contour_position(point_cloud=point_cloud_matrix,
+		                                                          contour=contour, method=depth_method)
+		if point_cloud_value is None:
+			return -1, None, None, None, 0.0
 
 	###############################################################################
 	# FUTURE WORK:
@@ -377,7 +1028,7 @@ def coordinates_to_largest_contour(moment, point_cloud_matrix):
 		#
 		#################################
 		sys.stdout.flush()
-		return distance, centroid_x, centroid_y, point_cloud_value
+		return distance, centroid_x, centroid_y, point_cloud_value, confidence
 	else:
 		#################################
 		# For debugging
@@ -387,17 +1038,7 @@ def coordinates_to_largest_contour(moment, point_cloud_matrix):
 		#################################
 
 		sys.stdout.flush()
-		return -1, None, None, None
-
-# Desc: Helper function to print ZED camera information
-# Inputs:
-# Outputs:
-def print_camera_information(camera):
-	print("Resolution: {0}, {1}.".format(camera.get_resolution().width, camera.get_resolution().height))
-	print("Camera FPS: {0}.".format(camera.get_camera_fps()))
-	print("Firmware: {0}.".format(camera.get_camera_information().firmware_version))
-	print("Serial number: {0}.\n".format(camera.get_camera_information().serial_number))
-	sys.stdout.flush()
+		return -1, None, None, None, 0.0
 
 # Desc: Helper function to print options for main menu
 # Inputs:
@@ -426,6 +1067,9 @@ def print_help_hsv():
 		  "    Increase hsv settings value:      +\n"
 		  "    Decrease hsv settings value:      -\n"
 		  "    Cycle through the HSV masks:      m\n"
+		  "    Freeze/unfreeze the frame:        f\n"
+		  "    Auto-calibrate from detections:   a\n"
+		  "    Auto-calibrate from a region:     o\n"
 		  "    Display current HSV filter:       s\n"
 	      "    Reset to original settings:       r\n"
 		  "    Exit adjusting HSV filter:        q\n"
@@ -442,6 +1086,60 @@ def is_negative_number(integer):
 	else:
 		return False
 
+# Desc: The three masks of the HSV tuning mode for one frame: 1 is the raw
+#       color mask, 2 adds the erosions and 3 the dilations. Only the stages up
+#       to the requested mask are computed, and a stage is only recomputed when
+#       its parameters (or the ones of a stage before it) changed, so on a
+#       frozen frame a keypress only redoes the stages it affects. The HSV frame
+#       is converted once per frame. The masks are written into DetectionBuffers.
+#       lookup_table is an optional HSVLookupTable used instead of the HSV
+#       conversion and cv2.inRange (its bounds must follow hsv_lower/hsv_upper)
+# Inputs: HSVLookupTable lookup_table
+class HSVTuningMasks(object):
+	def __init__(self, lookup_table=None):
+		self.lookup_table = lookup_table
+		self.buffers = DetectionBuffers()
+		self.image = None
+		self.hsv = None
+		self.masks = [None, None, None]
+		# parameters each mask was computed with
+		self.keys = [None, None, None]
+
+	# Desc: Use a new frame; every stage is computed again
+	# Inputs: cv2 frame image
+	# Outputs:
+	def set_frame(self, image):
+		self.image = image
+		self.hsv = None
+		self.keys = [None, None, None]
+
+	# Desc: Return mask 1, 2 or 3 of the current frame
+	# Inputs: int stage, int[3] hsv_lower, int[3] hsv_upper, int num_erosions, int num_dilations
+	# Outputs: numpy array mask
+	def mask(self, stage, hsv_lower, hsv_upper, num_erosions, num_dilations):
+		height, width = self.image.shape[:2]
+		keys = [(tuple(hsv_lower), tuple(hsv_upper))]
+		keys.append(keys[0] + (num_erosions,))
+		keys.append(keys[1] + (num_dilations,))
+		for i in range(stage):
+			if self.keys[i] == keys[i]:
+				continue
+			dst = self.buffers.view('mask{0}'.format(i + 1), (height, width))
+			if i == 0 and self.lookup_table is not None:
+				self.masks[0] = self.lookup_table.apply(self.image, dst=dst)
+			elif i == 0:
+				if self.hsv is None:
+					# a median blur with a kernel size of 1 only copies the frame, so it is skipped
+					self.hsv = cv2.cvtColor(self.image, cv2.COLOR_BGR2HSV,
+					                        dst=self.buffers.view('hsv', (height, width, 3)))
+				self.masks[0] = cv2.inRange(self.hsv, np.array(hsv_lower), np.array(hsv_upper), dst=dst)
+			elif i == 1:
+				self.masks[1] = cv2.erode(self.masks[0], None, dst=dst, iterations=num_erosions)
+			else:
+				self.masks[2] = cv2.dilate(self.masks[1], None, dst=dst, iterations=num_dilations)
+			self.keys[i] = keys[i]
+		return self.masks[stage - 1]
+
 # Desc: Allows user to adjust the OpenCV settings for identifying the
 #       tennis ball by color. On exit, the user is given the option to save
 #       the changes they made. If not, the initial values are returned.
@@ -449,33 +1147,24 @@ def is_negative_number(integer):
 #       hsv_higher is an array with 3 indices (Hue, Saturation, Value/Brightness)
 #       num_erosions is how many iterations of the OpenCV erode function
 #       num_dilations is how many iterations of the OpenCV dilate function
-# Inputs: int[2] hsv_lower, int[2] hsv_higher, int num_erosions, int num_dilations
+#       frame_source is an opened frame source (see frame_source.py), usually
+#           lent by a CameraSession, and is closed (given back to the
+#           session) when the function exits.
+#       color_classifier is 'hsv' or 'lut' (see find_tennis_ball). With 'lut', the
+#       lookup table is updated for the one bound changed by each keypress.
+#       Only the shown mask and the stages before it are computed (see
+#       HSVTuningMasks). The 'f' key freezes the frame: no new frame is read and
+#       a keypress only recomputes the stages it changes.
+#       The filter can also be calibrated automatically (see hsv_calibration.py)
+#       from the ball pixels of the circles detected with the current filter in
+#       the next AUTO_CALIBRATION_FRAMES frames ('a'), or of a region selected
+#       around the ball ('o'). The samples add up until the settings are reset.
+# Inputs: frame_source, int[2] hsv_lower, int[2] hsv_higher, int num_erosions, int num_dilations,
+#         str color_classifier
 # Outputs: int[2] hsv_lower, int[2] hsv_higher, int num_erosions, int num_dilations
-def adjust_hsv_filter(hsv_lower, hsv_higher, num_erosions, num_dilations):
-	# Create a PyZEDCamera object
-	zed = zcam.PyZEDCamera()
-
-	# Create a PyInitParameters object and set configuration parameters
-	init_params = zcam.PyInitParameters()
-	init_params.coordinate_units = sl.PyUNIT.PyUNIT_MILLIMETER  # Use milliliter units (for depth measurements)
-
-	# Open the camera
-	if not zed.is_opened():
-		print("Opening ZED Camera...")
-	status = zed.open(init_params)
-	if status != tp.PyERROR_CODE.PySUCCESS:
-		print(repr(status))
-		exit()
-
-	# Create and set PyRuntimeParameters after opening the camera
-	runtime_parameters = zcam.PyRuntimeParameters()
-	runtime_parameters.sensing_mode = sl.PySENSING_MODE.PySENSING_MODE_STANDARD  # Use STANDARD sensing mode
-
-	# Initialize arrays with proper format from ZED SDK
-	left_image = core.PyMat()
-
+def adjust_hsv_filter(frame_source, hsv_lower, hsv_higher, num_erosions, num_dilations, color_classifier='hsv'):
 	# Update user with information
-	print_camera_information(camera=zed)
+	frame_source.print_information()
 
 	print("Adjusting HSV filter for tennis ball detection."
 		  "\nHere you can adjust the filter while viewing the mask live."
@@ -495,35 +1184,46 @@ def adjust_hsv_filter(hsv_lower, hsv_higher, num_erosions, num_dilations):
 	key = ''
 	mask_cycle = 1
 	run_hsv_filter = True
+	lookup_table = HSVLookupTable(hsv_temp[0], hsv_temp[1]) if color_classifier == 'lut' else None
+	masks = HSVTuningMasks(lookup_table)
+	sampler = HSVSampler()
+	auto_frames = 0
+	frozen = False
+	# mask and parameters last shown, so a frozen frame is only shown again when it changes
+	shown = None
 
 	# Capture images until 'q' is pressed
 	while run_hsv_filter:
-		# grab the current frame
-		if zed.grab(runtime_parameters) == tp.PyERROR_CODE.PySUCCESS:
-			# Retrieve left image
-			zed.retrieve_image(left_image, sl.PyVIEW.PyVIEW_LEFT)
-			cv_frame = left_image.get_data()
-
-			# Blur the frame and convert it to the HSV color space
-			blur_frame = cv2.medianBlur(cv_frame, 1)
-			hsv = cv2.cvtColor(blur_frame, cv2.COLOR_BGR2HSV)
-
-			# Construct a mask for the color "yellow", then perform a series of dilations
-			# and erosions to remove any small blobs left in the mask
-			# OpenCV examples found here: https://docs.opencv.org/master/db/df6/tutorial_erosion_dilatation.html
-			# More information on morphological operations:
-			#   https://docs.opencv.org/3.0-beta/doc/py_tutorials/py_imgproc/py_morphological_ops/py_morphological_ops.html
-			mask1 = cv2.inRange(hsv, hsv_temp[0], hsv_temp[1])
-			mask2 = cv2.erode(mask1, None, iterations=num_erosions_temp)
-			mask3 = cv2.dilate(mask2, None, iterations=num_dilations_temp)
-
+		if frozen:
+			grabbed = True
+		else:
+			# grab the current frame
+			grabbed, frame = frame_source.read()
+			if grabbed:
+				masks.set_frame(frame.image)
+				shown = None
+		calibrate = False
+		if grabbed and auto_frames > 0:
+			# sample the balls confirmed by the Hough transform with the current filter; the color
+			# regions are scored so a larger distractor of the same color is not sampled
+			result = detect_tennis_ball(frame=frame, calibration=frame_source.calibration, hsv_lower=hsv_temp[0],
+			                            hsv_upper=hsv_temp[1], num_erosions=num_erosions_temp,
+			                            num_dilations=num_dilations_temp, color_classifier=lookup_table,
+			                            multi_candidate=True)
+			if result.detected:
+				sampler.add_circle(frame.image, result.circle)
+			auto_frames -= 1
+			if auto_frames == 0:
+				print("Detected the ball in {0} sampled frames".format(len(sampler)))
+				calibrate = True
+		if grabbed:
 			# When q is pressed, the entire function will end from inside the nested loops,
 			# returning either the old or new HSV filter parameters.
 			if key == ord('q'):
 				while True:
-					# Close the camera
+					# Give the camera back to the session
 					cv2.destroyAllWindows()
-					zed.close()
+					frame_source.close()
 					temp = input("\nDo you want to save the new hsv filter? [Y/N]:")
 					if temp == 'Y':
 						return hsv_temp[0], hsv_temp[1], num_erosions_temp, num_dilations_temp
@@ -585,6 +1285,9 @@ def adjust_hsv_filter(hsv_lower, hsv_higher, num_erosions, num_dilations):
 			elif key == ord('+') or key == 171: # includes numpad +
 				if setting_dilate == False and setting_erode == False:
 					hsv_temp[setting_hsv_low_or_high, setting_hue_sat_val] += 1
+					if lookup_table is not None:
+						lookup_table.set_bound(setting_hsv_low_or_high, setting_hue_sat_val,
+						                       hsv_temp[setting_hsv_low_or_high, setting_hue_sat_val])
 					print(str_setting + ": " + str(hsv_temp[setting_hsv_low_or_high, setting_hue_sat_val]))
 					if setting_hsv_low_or_high == 1:
 						print("HSV high setting [Hue, Saturation, Brightness] = " + str(hsv_temp[1]))
@@ -601,6 +1304,9 @@ def adjust_hsv_filter(hsv_lower, hsv_higher, num_erosions, num_dilations):
 					hsv_temp[setting_hsv_low_or_high, setting_hue_sat_val] -= 1
 					if is_negative_number(hsv_temp[setting_hsv_low_or_high, setting_hue_sat_val]):
 						hsv_temp[setting_hsv_low_or_high, setting_hue_sat_val] += 1
+					if lookup_table is not None:
+						lookup_table.set_bound(setting_hsv_low_or_high, setting_hue_sat_val,
+						                       hsv_temp[setting_hsv_low_or_high, setting_hue_sat_val])
 					print(str_setting + ": " + str(hsv_temp[setting_hsv_low_or_high, setting_hue_sat_val]))
 					if setting_hsv_low_or_high == 1:
 						print("HSV high setting [Hue, Saturation, Brightness] = " + str(hsv_temp[1]))
@@ -620,6 +1326,8 @@ def adjust_hsv_filter(hsv_lower, hsv_higher, num_erosions, num_dilations):
 				print("\n Current HSV filter: ({0}, {1})".format(hsv_temp[0], hsv_temp[1]))
 			elif key == ord('r'):
 				hsv_temp = np.array([hsv_lower, hsv_higher])
+				if lookup_table is not None:
+					lookup_table.set_bounds(hsv_temp[0], hsv_temp[1])
 				num_erosions_temp = num_erosions
 				num_dilations_temp = num_dilations
 				setting_hsv_low_or_high = 0
@@ -628,6 +1336,8 @@ def adjust_hsv_filter(hsv_lower, hsv_higher, num_erosions, num_dilations):
 				setting_dilate = False
 				str_setting = "No setting selected"
 				mask_cycle = 1
+				sampler.clear()
+				auto_frames = 0
 				print("\n Resetting settings to orginal values...\n"
 				      "    HSV filter: ({0}, {1})\n"
 				      "    Number of erosions: {2}\n"
@@ -636,6 +1346,20 @@ def adjust_hsv_filter(hsv_lower, hsv_higher, num_erosions, num_dilations):
 				cv2.destroyAllWindows()
 			elif key == ord('h'):
 				print_help_hsv()
+			elif key == ord('f'):
+				frozen = not frozen
+				print("Frame frozen" if frozen else "Frame live")
+			elif key == ord('a'):
+				frozen = False
+				auto_frames = AUTO_CALIBRATION_FRAMES
+				print("Sampling the detected ball over the next {0} frames...".format(auto_frames))
+			elif key == ord('o'):
+				# the region around the ball is taken as the circle inscribed in it
+				x, y, w, h = cv2.selectROI("Select the tennis ball", frame.image[:, :, :3].copy())
+				cv2.destroyWindow("Select the tennis ball")
+				if w > 0 and h > 0:
+					sampler.add_circle(frame.image, (x + w / 2.0, y + h / 2.0, min(w, h) / 2.0))
+					calibrate = True
 			elif key == ord('m'):
 				if mask_cycle == 1:
 					mask_cycle = 2
@@ -650,12 +1374,35 @@ def adjust_hsv_filter(hsv_lower, hsv_higher, num_erosions, num_dilations):
 					print("mask_cycle = RAW HSV Filter")
 					cv2.destroyAllWindows()
 
-			if mask_cycle == 1:
-				cv2.imshow("RAW HSV Mask", mask1)
-			elif mask_cycle == 2:
-				cv2.imshow("HSV Mask + Erosions", mask2)
-			else:
-				cv2.imshow("HSV Mask + Erosions + Dilations", mask3)
+			if calibrate and len(sampler) > 0:
+				hsv_temp = np.array(sampler.bounds())
+				num_erosions_temp, num_dilations_temp = sampler.morphology(hsv_temp[0], hsv_temp[1])
+				if lookup_table is not None:
+					lookup_table.set_bounds(hsv_temp[0], hsv_temp[1])
+				print("\n Calibrated from {0} samples:\n"
+				      "    HSV filter: ({1}, {2})\n"
+				      "    Number of erosions: {3}\n"
+				      "    Number of dilations: {4}\n".format(
+					len(sampler), hsv_temp[0], hsv_temp[1], num_erosions_temp, num_dilations_temp))
+
+			# Construct a mask for the color "yellow", then perform a series of dilations
+			# and erosions to remove any small blobs left in the mask; only as far as
+			# the shown mask needs
+			# OpenCV examples found here: https://docs.opencv.org/master/db/df6/tutorial_erosion_dilatation.html
+			# More information on morphological operations:
+			#   https://docs.opencv.org/3.0-beta/doc/py_tutorials/py_imgproc/py_morphological_ops/py_morphological_ops.html
+			mask = masks.mask(mask_cycle, hsv_temp[0], hsv_temp[1], num_erosions_temp, num_dilations_temp)
+			if key in (ord('m'), ord('r')):
+				# the windows were closed
+				shown = None
+			if (mask_cycle, masks.keys[mask_cycle - 1]) != shown:
+				shown = (mask_cycle, masks.keys[mask_cycle - 1])
+				if mask_cycle == 1:
+					cv2.imshow("RAW HSV Mask", mask)
+				elif mask_cycle == 2:
+					cv2.imshow("HSV Mask + Erosions", mask)
+				else:
+					cv2.imshow("HSV Mask + Erosions + Dilations", mask)
 
 			key = cv2.waitKey(5)
 
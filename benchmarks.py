@@ -0,0 +1,552 @@
+##############################################
+# Benchmarks for the tennis ball detection module. They run on recorded
+# sessions (see frame_source.py), so they do not need the ZED camera.
+#
+# USAGE
+# python benchmarks.py pyramid --recording path/to/session --levels 3
+# python benchmarks.py allocations --recording path/to/session
+# python benchmarks.py classifier --recording path/to/session
+# python benchmarks.py startup --open-latency 2 --switches 6
+# python benchmarks.py tuning --recording path/to/session
+# python benchmarks.py coordinates --recording path/to/session
+# python benchmarks.py obstacles --recording path/to/session --steps 4 8 16
+# python benchmarks.py occupancy --recording path/to/session --sizes 100 200 400
+##############################################
+
+import argparse
+import collections
+import time
+import tracemalloc
+import numpy as np
+import cv2
+import ball_tracker_final as ball_tracker
+from frame_source import Frame, CameraSession, open_recording
+from calibration import CameraCalibration
+from hsv_lut import HSVLookupTable
+from obstacles import ObstacleDetector
+from occupancy import OccupancyGrid, GridPlanner, plan_astar
+from tracking import BallTracker
+
+# the pyramid benchmark always runs up to this level and reports a regression
+# when a level up to it finds the ball much less often than full resolution
+CHECKED_PYRAMID_LEVEL = 2
+
+
+# Desc: Compare the detection rate and per-frame time of the pyramid (coarse to
+#       fine) color search at every level up to max_level against the full
+#       resolution search (level 0) on a recorded session.
+#       For each level, prints the share of frames with a color region found and
+#       with a circle detected, how far the guessed ball center is from the one
+#       found at full resolution, and the mean/median/95th percentile time per frame.
+#       Levels up to CHECKED_PYRAMID_LEVEL are always run and checked.
+# Inputs: str recording, int max_level, hsv bounds and morphology iterations
+# Outputs: list of dict with the results for each level
+def benchmark_pyramid(recording, max_level, hsv_lower=ball_tracker.DEFAULT_HSV_LOWER,
+                      hsv_upper=ball_tracker.DEFAULT_HSV_UPPER, num_erosions=ball_tracker.DEFAULT_EROSIONS,
+                      num_dilations=ball_tracker.DEFAULT_DILATIONS):
+	hsv_lower = np.array(hsv_lower)
+	hsv_upper = np.array(hsv_upper)
+	rows = []
+	full_resolution_guesses = None
+
+	print("{0:>5} {1:>7} {2:>9} {3:>9} {4:>11} {5:>9} {6:>9} {7:>9}".format(
+		"level", "frames", "found", "detected", "center err", "mean ms", "p50 ms", "p95 ms"))
+	for level in range(max(max_level, CHECKED_PYRAMID_LEVEL) + 1):
+		frame_source = open_recording(recording)
+		frame_source.open()
+		times = []
+		guesses = []
+		found = 0
+		detected = 0
+		while True:
+			grabbed, frame = frame_source.read()
+			if not grabbed:
+				break
+			start = time.perf_counter()
+			result = ball_tracker.detect_tennis_ball(frame=frame, calibration=frame_source.calibration,
+			                                         hsv_lower=hsv_lower, hsv_upper=hsv_upper,
+			                                         num_erosions=num_erosions, num_dilations=num_dilations,
+			                                         pyramid_levels=level)
+			times.append(time.perf_counter() - start)
+			found += result.found
+			detected += result.detected
+			guesses.append(result.guess_circle)
+		frame_source.close()
+
+		if level == 0:
+			full_resolution_guesses = guesses
+		# pixel distance between the guessed centers at this level and at full resolution
+		errors = [np.hypot(g[0] - f[0], g[1] - f[1]) for g, f in zip(guesses, full_resolution_guesses)
+		          if g is not None and f is not None]
+		times_ms = 1000 * np.array(times) if times else np.zeros(1)
+		row = {"level": level, "frames": len(times), "found": found, "detected": detected,
+		       "center_error": float(np.mean(errors)) if errors else float('nan'),
+		       "mean_ms": float(np.mean(times_ms)), "p50_ms": float(np.percentile(times_ms, 50)),
+		       "p95_ms": float(np.percentile(times_ms, 95))}
+		rows.append(row)
+		frames = max(row["frames"], 1)
+		print("{0:>5} {1:>7} {2:>8.1%} {3:>8.1%} {4:>9.1f}px {5:>9.2f} {6:>9.2f} {7:>9.2f}".format(
+			level, row["frames"], found / frames, detected / frames, row["center_error"],
+			row["mean_ms"], row["p50_ms"], row["p95_ms"]))
+
+	for row in rows[1:CHECKED_PYRAMID_LEVEL + 1]:
+		if row["found"] < .95 * rows[0]["found"]:
+			print("REGRESSION: level {0} finds the ball in {1} frames against {2} at full resolution".format(
+				row["level"], row["found"], rows[0]["found"]))
+	return rows
+
+
+# Desc: Report how much memory detect_tennis_ball allocates per frame with
+#       and without reusing DetectionBuffers. tracemalloc sees every NumPy
+#       array (including the ones OpenCV returns), so the peak traced memory
+#       of a frame is the memory allocated and thrown away by that frame.
+#       The first frame is not counted because it allocates the buffers.
+# Inputs: str recording, int pyramid_levels, bool tracking
+# Outputs: dict with the mean/max bytes allocated per frame for each mode
+def benchmark_allocations(recording, pyramid_levels=0, tracking=False):
+	hsv_lower = np.array(ball_tracker.DEFAULT_HSV_LOWER)
+	hsv_upper = np.array(ball_tracker.DEFAULT_HSV_UPPER)
+	report = {}
+
+	print("{0:>18} {1:>7} {2:>15} {3:>15} {4:>15} {5:>9}".format(
+		"mode", "frames", "mean KiB/frame", "max KiB/frame", "buffers KiB", "mean ms"))
+	for mode in ("allocate", "reuse buffers"):
+		frame_source = open_recording(recording)
+		frame_source.open()
+		buffers = ball_tracker.DetectionBuffers() if mode == "reuse buffers" else None
+		tennis_ball_tracker = BallTracker() if tracking else None
+		allocated = []
+		times = []
+		tracemalloc.start()
+		while True:
+			grabbed, frame = frame_source.read()
+			if not grabbed:
+				break
+			_reset_peak()
+			before = tracemalloc.get_traced_memory()[0]
+			start = time.perf_counter()
+			ball_tracker.detect_tennis_ball(frame=frame, calibration=frame_source.calibration,
+			                                hsv_lower=hsv_lower, hsv_upper=hsv_upper,
+			                                num_erosions=ball_tracker.DEFAULT_EROSIONS,
+			                                num_dilations=ball_tracker.DEFAULT_DILATIONS,
+			                                tracker=tennis_ball_tracker, pyramid_levels=pyramid_levels,
+			                                buffers=buffers)
+			times.append(time.perf_counter() - start)
+			allocated.append(tracemalloc.get_traced_memory()[1] - before)
+		tracemalloc.stop()
+		frame_source.close()
+
+		allocated = np.array(allocated[1:] or [0]) / 1024.0
+		buffers_kib = buffers.nbytes() / 1024.0 if buffers is not None else 0.0
+		report[mode] = {"mean_kib": float(allocated.mean()), "max_kib": float(allocated.max()),
+		                "buffers_kib": buffers_kib, "mean_ms": 1000 * float(np.mean(times))}
+		print("{0:>18} {1:>7} {2:>15.1f} {3:>15.1f} {4:>15.1f} {5:>9.2f}".format(
+			mode, len(times), report[mode]["mean_kib"], report[mode]["max_kib"], buffers_kib,
+			report[mode]["mean_ms"]))
+	return report
+
+# Desc: Compare the color segmentation time of the HSV conversion + cv2.inRange
+#       against the BGR lookup table (hsv_lut.py) on a recorded session, and how
+#       closely the lookup table mask matches the HSV mask (intersection over
+#       union of the mask pixels).
+# Inputs: str recording, int bits
+# Outputs: dict with the mean ms per frame of each classifier and the mean IoU
+def benchmark_classifier(recording, bits=6):
+	hsv_lower = np.array(ball_tracker.DEFAULT_HSV_LOWER)
+	hsv_upper = np.array(ball_tracker.DEFAULT_HSV_UPPER)
+	start = time.perf_counter()
+	lookup_table = HSVLookupTable(hsv_lower, hsv_upper, bits=bits)
+	build_ms = 1000 * (time.perf_counter() - start)
+	start = time.perf_counter()
+	lookup_table.set_bound(0, 0, hsv_lower[0] + 1)
+	lookup_table.set_bound(0, 0, hsv_lower[0])
+	update_ms = 1000 * (time.perf_counter() - start) / 2
+
+	frame_source = open_recording(recording)
+	frame_source.open()
+	hsv_times = []
+	lut_times = []
+	ious = []
+	while True:
+		grabbed, frame = frame_source.read()
+		if not grabbed:
+			break
+		start = time.perf_counter()
+		hsv_mask = cv2.inRange(cv2.cvtColor(frame.image, cv2.COLOR_BGR2HSV), hsv_lower, hsv_upper)
+		hsv_times.append(time.perf_counter() - start)
+		start = time.perf_counter()
+		lut_mask = lookup_table.apply(frame.image)
+		lut_times.append(time.perf_counter() - start)
+		union = np.count_nonzero(hsv_mask | lut_mask)
+		ious.append(np.count_nonzero(hsv_mask & lut_mask) / float(union) if union else 1.0)
+	frame_source.close()
+
+	report = {"hsv_ms": 1000 * float(np.mean(hsv_times)), "lut_ms": 1000 * float(np.mean(lut_times)),
+	          "iou": float(np.mean(ious)), "build_ms": build_ms, "update_ms": update_ms}
+	print("Lookup table: {0} bits per channel, built in {1:.1f} ms, one bound updated in {2:.2f} ms".format(
+		bits, build_ms, update_ms))
+	print("HSV + inRange: {0:.2f} ms/frame".format(report["hsv_ms"]))
+	print("Lookup table:  {0:.2f} ms/frame".format(report["lut_ms"]))
+	print("Mask IoU:      {0:.3f} over {1} frames".format(report["iou"], len(ious)))
+	return report
+
+# Desc: Stand-in for the ZED camera for the startup benchmark: opening and
+#       closing it take open_latency and close_latency seconds, and read()
+#       returns a synthetic frame at fps frames per second.
+# Inputs: float open_latency, float close_latency, float fps, int width, int height
+class MockCamera(object):
+	is_live = True
+
+	def __init__(self, open_latency=2.0, close_latency=0.2, fps=60, width=1280, height=720):
+		self.open_latency = open_latency
+		self.close_latency = close_latency
+		self.frame_time = 1.0 / fps
+		self.width = width
+		self.height = height
+		self.calibration = None
+		self.frame = None
+
+	def open(self):
+		time.sleep(self.open_latency)
+		self.calibration = CameraCalibration(fx=700.0, fy=700.0, cx=(self.width - 1) / 2.0,
+		                                     cy=(self.height - 1) / 2.0, width=self.width, height=self.height)
+		self.frame = Frame(image=np.zeros((self.height, self.width, 4), dtype=np.uint8),
+		                   point_cloud=np.full((self.height, self.width, 4), np.nan, dtype=np.float32),
+		                   fx=self.calibration.fx, fy=self.calibration.fy)
+
+	def read(self, timer=None):
+		time.sleep(self.frame_time)
+		return True, self.frame
+
+	def print_information(self):
+		pass
+
+	def close(self):
+		time.sleep(self.close_latency)
+
+
+# Desc: Compare switching between modes (detection, HSV tuning, ...) by
+#       reopening the camera for every mode, as the menu used to, against
+#       lending one open camera through a CameraSession. Each mode reads
+#       frames_per_mode frames. Prints the time from a mode switch to its first
+#       frame and the total time of all the switches.
+# Inputs: int switches, int frames_per_mode, float open_latency, float close_latency
+# Outputs: dict strategy -> (list of seconds to the first frame, float total seconds)
+def benchmark_startup(switches=6, frames_per_mode=10, open_latency=2.0, close_latency=0.2):
+	results = {}
+
+	start = time.perf_counter()
+	first_frame = []
+	for i in range(switches):
+		switch_time = time.perf_counter()
+		camera = MockCamera(open_latency=open_latency, close_latency=close_latency)
+		camera.open()
+		for j in range(frames_per_mode):
+			camera.read()
+			if j == 0:
+				first_frame.append(time.perf_counter() - switch_time)
+		camera.close()
+	results["reopen"] = (first_frame, time.perf_counter() - start)
+
+	start = time.perf_counter()
+	first_frame = []
+	session = CameraSession(MockCamera(open_latency=open_latency, close_latency=close_latency))
+	for i in range(switches):
+		switch_time = time.perf_counter()
+		camera = session.acquire()
+		for j in range(frames_per_mode):
+			camera.read()
+			if j == 0:
+				first_frame.append(time.perf_counter() - switch_time)
+		camera.close()
+	session.close()
+	results["session"] = (first_frame, time.perf_counter() - start)
+
+	print("{0} mode switches, {1} frames per mode, {2:.1f} s to open the camera".format(
+		switches, frames_per_mode, open_latency))
+	print("{0:>8} {1:>16} {2:>16} {3:>10}".format("strategy", "first switch ms", "later switch ms", "total s"))
+	for strategy in ("reopen", "session"):
+		first_frame, total = results[strategy]
+		later = np.mean(first_frame[1:]) if len(first_frame) > 1 else float('nan')
+		print("{0:>8} {1:>16.1f} {2:>16.1f} {3:>10.2f}".format(strategy, 1000 * first_frame[0], 1000 * later, total))
+	return results
+
+
+# Desc: Time one keypress of the HSV tuning mode on a frozen frame: recomputing
+#       the whole mask pipeline (blur, cvtColor, inRange, erode, dilate) as the
+#       tuning mode used to, against HSVTuningMasks, which only recomputes the
+#       stages the changed setting affects and only as far as the shown mask.
+#       Every frame of the recording is frozen in turn and each setting is
+#       changed up and down once per shown mask.
+# Inputs: str recording
+# Outputs: dict (shown mask, changed setting) -> (full ms, incremental ms)
+def benchmark_tuning(recording):
+	hsv_lower = np.array(ball_tracker.DEFAULT_HSV_LOWER)
+	hsv_upper = np.array(ball_tracker.DEFAULT_HSV_UPPER)
+	erosions = ball_tracker.DEFAULT_EROSIONS
+	dilations = ball_tracker.DEFAULT_DILATIONS
+	changes = [("hue", (hsv_lower + [1, 0, 0], hsv_upper, erosions, dilations)),
+	           ("erosions", (hsv_lower, hsv_upper, erosions + 1, dilations)),
+	           ("dilations", (hsv_lower, hsv_upper, erosions, dilations + 1))]
+	times = {}
+
+	frame_source = open_recording(recording)
+	frame_source.open()
+	masks = ball_tracker.HSVTuningMasks()
+	while True:
+		grabbed, frame = frame_source.read()
+		if not grabbed:
+			break
+		for stage in (1, 2, 3):
+			for setting, changed in changes:
+				if stage == 1 and setting != "hue" or stage == 2 and setting == "dilations":
+					# the setting does not change the shown mask
+					continue
+				full = []
+				incremental = []
+				masks.set_frame(frame.image)
+				masks.mask(stage, hsv_lower, hsv_upper, erosions, dilations)
+				for parameters in (changed, (hsv_lower, hsv_upper, erosions, dilations)):
+					start = time.perf_counter()
+					hsv = cv2.cvtColor(cv2.medianBlur(frame.image, 1), cv2.COLOR_BGR2HSV)
+					mask = cv2.inRange(hsv, parameters[0], parameters[1])
+					mask = cv2.erode(mask, None, iterations=parameters[2])
+					cv2.dilate(mask, None, iterations=parameters[3])
+					full.append(time.perf_counter() - start)
+					start = time.perf_counter()
+					masks.mask(stage, *parameters)
+					incremental.append(time.perf_counter() - start)
+				times.setdefault((stage, setting), ([], []))
+				times[(stage, setting)][0].extend(full)
+				times[(stage, setting)][1].extend(incremental)
+	frame_source.close()
+
+	report = {}
+	print("{0:>12} {1:>10} {2:>9} {3:>15}".format("shown mask", "setting", "full ms", "incremental ms"))
+	for (stage, setting), (full, incremental) in sorted(times.items()):
+		report[(stage, setting)] = (1000 * float(np.mean(full)), 1000 * float(np.mean(incremental)))
+		print("{0:>12} {1:>10} {2:>9.2f} {3:>15.2f}".format(stage, setting, *report[(stage, setting)]))
+	return report
+
+
+# Desc: Compare get_rover_coordinates called in a Python loop against
+#       get_rover_coordinates_batch on the point clouds of a recorded session:
+#       the loop on num_points valid points of every frame, the batch call on the
+#       same points (float64 and float32) and on the whole point cloud (float32,
+#       with and without a preallocated output). Also checks that both agree.
+# Inputs: str recording, int num_points
+# Outputs: dict method -> mean ms per frame
+def benchmark_coordinates(recording, num_points=10000):
+	times = collections.OrderedDict((method, []) for method in (
+		"loop (points)", "batch float64 (points)", "batch float32 (points)",
+		"batch float32 (cloud)", "batch float32 out= (cloud)"))
+	max_error = 0.0
+	out = None
+
+	frame_source = open_recording(recording)
+	frame_source.open()
+	while True:
+		grabbed, frame = frame_source.read()
+		if not grabbed:
+			break
+		cloud = frame.point_cloud
+		points = cloud[..., :3].reshape(-1, 3)
+		points = points[np.isfinite(points).all(axis=1)]
+		points = points[np.linspace(0, len(points) - 1, min(num_points, len(points))).astype(np.int64)]
+
+		start = time.perf_counter()
+		looped = [ball_tracker.get_rover_coordinates(x, y, z) for x, y, z in points.tolist()]
+		times["loop (points)"].append(time.perf_counter() - start)
+		start = time.perf_counter()
+		batch = ball_tracker.get_rover_coordinates_batch(points, dtype=np.float64)
+		times["batch float64 (points)"].append(time.perf_counter() - start)
+		start = time.perf_counter()
+		ball_tracker.get_rover_coordinates_batch(points)
+		times["batch float32 (points)"].append(time.perf_counter() - start)
+		if looped:
+			max_error = max(max_error, float(np.abs(np.array(looped).T - np.array(batch)).max()))
+
+		start = time.perf_counter()
+		ball_tracker.get_rover_coordinates_batch(cloud)
+		times["batch float32 (cloud)"].append(time.perf_counter() - start)
+		if out is None or out.shape[1:] != cloud.shape[:2]:
+			out = np.empty((3,) + cloud.shape[:2], dtype=np.float32)
+		start = time.perf_counter()
+		ball_tracker.get_rover_coordinates_batch(cloud, out=out)
+		times["batch float32 out= (cloud)"].append(time.perf_counter() - start)
+	frame_source.close()
+
+	report = collections.OrderedDict()
+	print("{0} points per frame, point cloud {1}x{2}".format(num_points, out.shape[2], out.shape[1]))
+	print("{0:>28} {1:>10}".format("method", "ms/frame"))
+	for method, durations in times.items():
+		report[method] = 1000 * float(np.mean(durations))
+		print("{0:>28} {1:>10.2f}".format(method, report[method]))
+	print("Largest difference between the loop and the batch call: {0:.2e}".format(max_error))
+	return report
+
+
+# Desc: Time the obstacle detection (see obstacles.py) on the point clouds of a
+#       recorded session for every subsampling step, with the number of points
+#       sampled, the share of them on the ground and the flagged points per frame
+# Inputs: str recording, list of int steps
+# Outputs: dict step -> (p50 ms, p95 ms)
+def benchmark_obstacles(recording, steps=(4, 8, 16)):
+	report = collections.OrderedDict()
+	print("{0:>6} {1:>8} {2:>8} {3:>8} {4:>8} {5:>8}".format("step", "points", "ground", "flagged", "p50 ms",
+	                                                         "p95 ms"))
+	for step in steps:
+		frame_source = open_recording(recording)
+		frame_source.open()
+		detector = ObstacleDetector(frame_source.calibration, step=step)
+		durations = []
+		ground = []
+		flagged = []
+		while True:
+			grabbed, frame = frame_source.read()
+			if not grabbed:
+				break
+			start = time.perf_counter()
+			obstacle_map = detector.detect(frame.point_cloud)
+			durations.append(time.perf_counter() - start)
+			ground.append(obstacle_map.ground_fraction)
+			flagged.append(len(obstacle_map.labels))
+		frame_source.close()
+		points = len(range(step // 2, frame_source.calibration.height, step)) * \
+			len(range(step // 2, frame_source.calibration.width, step))
+		report[step] = (1000 * float(np.percentile(durations, 50)), 1000 * float(np.percentile(durations, 95)))
+		print("{0:>6} {1:>8} {2:>8.2f} {3:>8.0f} {4:>8.2f} {5:>8.2f}".format(step, points, np.mean(ground),
+		                                                                   np.mean(flagged), *report[step]))
+	return report
+
+
+# Desc: Time the occupancy grid (see occupancy.py) for every grid size: the
+#       obstacle maps of a recorded session (looped) are added from a rover pose
+#       driving forward speed mm per frame, and every frame the route to a goal
+#       goal_distance mm ahead (and a bit to the left) is replanned with D* Lite
+#       (GridPlanner) and with a new A* search. Prints the p50/p95 ms of the
+#       update and of both plans, and the cells each plan expands. The first
+#       D* Lite plan and the ones after a scroll of the grid are full searches
+#       and are shown apart.
+# Inputs: str recording, list of int sizes, int num_frames, float resolution, float speed, float goal_distance
+# Outputs: dict size -> dict measure -> (p50 ms, p95 ms)
+def benchmark_occupancy(recording, sizes=(100, 200, 400), num_frames=100, resolution=50.0, speed=20.0,
+                        goal_distance=8000.0):
+	frame_source = open_recording(recording, loop=True)
+	frame_source.open()
+	detector = ObstacleDetector(frame_source.calibration)
+	obstacle_maps = []
+	for frame_index in range(num_frames):
+		grabbed, frame = frame_source.read()
+		if not grabbed:
+			break
+		obstacle_maps.append(detector.detect(frame.point_cloud))
+	frame_source.close()
+
+	report = collections.OrderedDict()
+	print("{0:>6} {1:>22} {2:>8} {3:>8} {4:>10}".format("size", "", "p50 ms", "p95 ms", "expanded"))
+	for size in sizes:
+		grid = OccupancyGrid(size=size, resolution=resolution)
+		planner = GridPlanner(grid)
+		times = collections.OrderedDict((measure, []) for measure in (
+			"update", "D* Lite full search", "D* Lite replan", "A* search"))
+		expanded = collections.OrderedDict((measure, []) for measure in times)
+		goal = (goal_distance, goal_distance / 4)
+		for frame_index, obstacle_map in enumerate(obstacle_maps):
+			pose = (frame_index * speed, 0.0, 0.0)
+			start = time.perf_counter()
+			grid.update(pose, obstacle_map)
+			times["update"].append(time.perf_counter() - start)
+			searches = planner.searches
+			start = time.perf_counter()
+			planner.plan(pose[:2], goal)
+			measure = "D* Lite full search" if planner.searches != searches else "D* Lite replan"
+			times[measure].append(time.perf_counter() - start)
+			expanded[measure].append(planner.expanded)
+			start = time.perf_counter()
+			route, cells = plan_astar(grid, pose[:2], goal)
+			times["A* search"].append(time.perf_counter() - start)
+			expanded["A* search"].append(cells)
+		report[size] = collections.OrderedDict()
+		for measure, durations in times.items():
+			if not durations:
+				continue
+			report[size][measure] = (1000 * float(np.percentile(durations, 50)),
+			                         1000 * float(np.percentile(durations, 95)))
+			print("{0:>6} {1:>22} {2:>8.2f} {3:>8.2f} {4:>10}".format(
+				size, measure, report[size][measure][0], report[size][measure][1],
+				"{0:.0f}".format(np.mean(expanded[measure])) if expanded[measure] else ""))
+	return report
+
+
+# Desc: Reset the peak of tracemalloc (tracemalloc.reset_peak is only in python 3.9+)
+# Inputs:
+# Outputs:
+def _reset_peak():
+	if hasattr(tracemalloc, 'reset_peak'):
+		tracemalloc.reset_peak()
+	else:
+		tracemalloc.clear_traces()
+
+def main():
+	ap = argparse.ArgumentParser(description="Benchmarks for the tennis ball detection module")
+	subparsers = ap.add_subparsers(dest="benchmark")
+
+	pyramid = subparsers.add_parser("pyramid", help="pyramid color search against full resolution")
+	pyramid.add_argument("-r", "--recording", required=True, help="path to a recorded session")
+	pyramid.add_argument("-l", "--levels", type=int, default=3, help="highest pyramid level to test")
+
+	allocations = subparsers.add_parser("allocations", help="memory allocated per frame by the detection")
+	allocations.add_argument("-r", "--recording", required=True, help="path to a recorded session")
+	allocations.add_argument("-p", "--pyramid", type=int, default=0, help="pyramid levels")
+	allocations.add_argument("-t", "--tracking", action="store_true", help="use the tracking mode")
+
+	classifier = subparsers.add_parser("classifier", help="HSV conversion against the BGR lookup table")
+	classifier.add_argument("-r", "--recording", required=True, help="path to a recorded session")
+	classifier.add_argument("-b", "--bits", type=int, default=6, help="bits per channel of the lookup table")
+
+	startup = subparsers.add_parser("startup", help="reopening the camera for every mode against a camera session")
+	startup.add_argument("-s", "--switches", type=int, default=6, help="number of mode switches")
+	startup.add_argument("-f", "--frames", type=int, default=10, help="frames read in every mode")
+	startup.add_argument("--open-latency", type=float, default=2.0, help="seconds the mock camera takes to open")
+	startup.add_argument("--close-latency", type=float, default=0.2, help="seconds the mock camera takes to close")
+
+	tuning = subparsers.add_parser("tuning", help="HSV tuning keypress: full pipeline against changed stages only")
+	tuning.add_argument("-r", "--recording", required=True, help="path to a recorded session")
+
+	coordinates = subparsers.add_parser("coordinates", help="rover coordinates in a loop against one batch call")
+	coordinates.add_argument("-r", "--recording", required=True, help="path to a recorded session")
+	coordinates.add_argument("-n", "--points", type=int, default=10000, help="points per frame for the loop")
+
+	obstacles = subparsers.add_parser("obstacles", help="obstacle detection time per subsampling step")
+	obstacles.add_argument("-r", "--recording", required=True, help="path to a recorded session")
+	obstacles.add_argument("-s", "--steps", type=int, nargs="+", default=[4, 8, 16], help="subsampling steps")
+
+	occupancy = subparsers.add_parser("occupancy", help="occupancy grid update and route replanning time per grid size")
+	occupancy.add_argument("-r", "--recording", required=True, help="path to a recorded session")
+	occupancy.add_argument("-s", "--sizes", type=int, nargs="+", default=[100, 200, 400], help="cells per side")
+	occupancy.add_argument("-f", "--frames", type=int, default=100, help="frames (the recording is looped)")
+
+	args = ap.parse_args()
+	if args.benchmark == "pyramid":
+		benchmark_pyramid(recording=args.recording, max_level=args.levels)
+	elif args.benchmark == "allocations":
+		benchmark_allocations(recording=args.recording, pyramid_levels=args.pyramid, tracking=args.tracking)
+	elif args.benchmark == "classifier":
+		benchmark_classifier(recording=args.recording, bits=args.bits)
+	elif args.benchmark == "startup":
+		benchmark_startup(switches=args.switches, frames_per_mode=args.frames, open_latency=args.open_latency,
+		                  close_latency=args.close_latency)
+	elif args.benchmark == "tuning":
+		benchmark_tuning(recording=args.recording)
+	elif args.benchmark == "coordinates":
+		benchmark_coordinates(recording=args.recording, num_points=args.points)
+	elif args.benchmark == "obstacles":
+		benchmark_obstacles(recording=args.recording, steps=args.steps)
+	elif args.benchmark == "occupancy":
+		benchmark_occupancy(recording=args.recording, sizes=args.sizes, num_frames=args.frames)
+	else:
+		ap.print_help()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,150 @@
+##############################################
+# Camera calibration (intrinsics) for the tennis ball detection module.
+#
+# The calibration is read once when the frame source is opened. The
+# expected size of a tennis ball on the image and the radius band given to
+# the Hough transform only depend on the distance, so they are precomputed
+# for every millimeter of distance and the per-frame code only reads them.
+##############################################
+
+import collections
+import math
+import numpy as np
+
+TENNIS_BALL_DIAMETER = 68.6 #millimeters
+
+# Longest distance (mm) in the lookup table. Past this distance a tennis
+# ball is only a few pixels wide on the ZED image.
+MAX_TABLE_DISTANCE = 20000
+
+# HoughCircles settings by distance bucket, used with adaptive_hough. Up to
+# each distance (mm): the radius band (times the expected radius), the
+# accumulator resolution dp and the ROI buffer (times the ball size) added
+# around the color region. Close up the ball is large and the distance is
+# accurate, so the band and the ROI are tighter and a coarser accumulator
+# (dp=2) cuts the cost; far away the ball is only a few pixels wide, so the
+# band is wider and dp=2 collects enough votes for a small circle.
+HOUGH_DISTANCE_BUCKETS = [
+	# max distance, band low, band high, dp, ROI buffer
+	(600, .85, 1.15, 2.0, .25),
+	(1500, .8, 1.2, 1.5, .35),
+	(3000, .8, 1.2, 1.5, .5),
+	(MAX_TABLE_DISTANCE, .75, 1.3, 2.0, .5),
+]
+
+# Desc: HoughCircles settings for a distance (see CameraCalibration.adaptive_hough)
+HoughSettings = collections.namedtuple('HoughSettings', ['radius', 'min_radius', 'max_radius', 'dp', 'roi_buffer'])
+
+
+# Desc: Intrinsics of the left camera and the distance lookup table.
+#       fx, fy are the focal lengths in pixels
+#       cx, cy are the principal point in pixels
+#       width, height are the image resolution in pixels
+#
+#       The table is indexed by the distance in whole millimeters:
+#           pixels_x[d], pixels_y[d]  expected tennis ball size in pixels
+#           radius[d]                 expected radius in pixels
+#           min_radius[d], max_radius[d]  radius band (+-20%) for HoughCircles
+#           bucket_min_radius[d], bucket_max_radius[d], hough_dp[d], roi_buffer[d]
+#                                     HoughCircles settings of the distance bucket
+#                                     (see HOUGH_DISTANCE_BUCKETS)
+# Inputs: float fx, float fy, float cx, float cy, int width, int height, int max_distance,
+#         list hough_buckets
+class CameraCalibration(object):
+	def __init__(self, fx, fy, cx, cy, width, height, max_distance=MAX_TABLE_DISTANCE,
+	             hough_buckets=HOUGH_DISTANCE_BUCKETS):
+		self.fx = float(fx)
+		self.fy = float(fy)
+		self.cx = float(cx)
+		self.cy = float(cy)
+		self.width = int(width)
+		self.height = int(height)
+		self.max_distance = int(max_distance)
+		self.hough_buckets = hough_buckets
+		self._build_table()
+
+	# Desc: Precompute the expected tennis ball size for every distance in mm.
+	#       Same math as the original per-frame computation:
+	#           pixels = ceil(TENNIS_BALL_DIAMETER / distance * focal_length)
+	#           radius = int(((pixels_x + pixels_y) / 2) / 2)
+	#       and a band of 0.8 to 1.2 times the radius for HoughCircles.
+	# Inputs:
+	# Outputs:
+	def _build_table(self):
+		distance = np.arange(self.max_distance + 1, dtype=np.float64)
+		distance[0] = np.inf # no ball can be at 0 mm
+		self.pixels_x = np.ceil(TENNIS_BALL_DIAMETER / distance * self.fx).astype(np.int32)
+		self.pixels_y = np.ceil(TENNIS_BALL_DIAMETER / distance * self.fy).astype(np.int32)
+		self.radius = ((self.pixels_x + self.pixels_y) // 2 // 2).astype(np.int32)
+		self.min_radius = np.floor(self.radius * .8).astype(np.int32)
+		self.max_radius = np.ceil(self.radius * 1.2).astype(np.int32)
+
+		# settings of the bucket of every distance; past the last bucket, use the last one
+		buckets = np.array(self.hough_buckets, dtype=np.float64)
+		bucket = np.minimum(np.searchsorted(buckets[:, 0], np.arange(self.max_distance + 1)), len(buckets) - 1)
+		self.bucket_min_radius = np.floor(self.radius * buckets[bucket, 1]).astype(np.int32)
+		self.bucket_max_radius = np.ceil(self.radius * buckets[bucket, 2]).astype(np.int32)
+		self.hough_dp = buckets[bucket, 3]
+		self.roi_buffer = buckets[bucket, 4]
+
+	# Desc: Index into the lookup table for a distance in mm, or -1 for a
+	#       distance that can not be looked up (None, NaN, inf or <= 0)
+	# Inputs: float distance
+	# Outputs: int index
+	def table_index(self, distance):
+		if distance is None or not math.isfinite(distance) or distance <= 0:
+			return -1
+		return min(int(round(distance)), self.max_distance)
+
+	# Desc: table_index for an array of distances
+	# Inputs: numpy array distances
+	# Outputs: numpy array of int indices (-1 where the distance is not valid)
+	def table_indices(self, distances):
+		distances = np.asarray(distances, dtype=np.float64)
+		valid = np.isfinite(distances) & (distances > 0)
+		indices = np.full(distances.shape, -1, dtype=np.int64)
+		indices[valid] = np.minimum(np.round(distances[valid]), self.max_distance).astype(np.int64)
+		return indices
+
+	# Desc: Expected number of pixels in the x & y dimension of a tennis ball
+	#       at the distance. Returns (0, 0) if the distance is not valid.
+	# Inputs: float distance
+	# Outputs: (pixels_x, pixels_y)
+	def tennis_ball_pixels(self, distance):
+		i = self.table_index(distance)
+		if i < 0:
+			return 0, 0
+		return int(self.pixels_x[i]), int(self.pixels_y[i])
+
+	# Desc: Expected radius and the HoughCircles radius band of a tennis ball
+	#       at the distance. Returns (0, 0, 0) if the distance is not valid.
+	# Inputs: float distance
+	# Outputs: (radius, min_radius, max_radius)
+	def hough_radius_band(self, distance):
+		i = self.table_index(distance)
+		if i < 0:
+			return 0, 0, 0
+		return int(self.radius[i]), int(self.min_radius[i]), int(self.max_radius[i])
+
+	# Desc: HoughCircles settings of the distance bucket of a distance. Returns
+	#       None if the distance is not valid.
+	# Inputs: float distance
+	# Outputs: HoughSettings (radius, min_radius, max_radius, dp, roi_buffer)
+	def adaptive_hough(self, distance):
+		i = self.table_index(distance)
+		if i < 0:
+			return None
+		return HoughSettings(radius=int(self.radius[i]), min_radius=int(self.bucket_min_radius[i]),
+		                     max_radius=int(self.bucket_max_radius[i]), dp=float(self.hough_dp[i]),
+		                     roi_buffer=float(self.roi_buffer[i]))
+
+
+# Desc: Build the calibration of the left camera from the ZED camera. Only
+#       called once, when the camera is opened.
+# Inputs: pyzed.camera.PyZEDCamera camera information
+#         (from camera.get_camera_information()), int width, int height
+# Outputs: CameraCalibration
+def calibration_from_zed(camera_information, width, height):
+	left_cam = camera_information.calibration_parameters.left_cam
+	return CameraCalibration(fx=left_cam.fx, fy=left_cam.fy, cx=left_cam.cx, cy=left_cam.cy,
+	                         width=width, height=height)
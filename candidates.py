@@ -0,0 +1,146 @@
+##############################################
+# Multi-candidate scoring for the tennis ball detection module.
+#
+# Instead of keeping only the largest color region, every contour of the
+# color mask is scored at once. The points of all the contours are put in
+# one array and the area, bounding box and centroid of every contour are
+# computed together with np.add.reduceat/np.minimum.reduceat (the only
+# Python work per contour is reading its length), then:
+#   circularity       a ball fills a square bounding box like a disk (pi/4);
+#                     elongated regions and square/rectangular blobs score low
+#   color fill        share of the square inscribed in the region's circle
+#                     that has the ball color (before erode/dilate), read
+#                     from an integral image of the color mask
+#   size consistency  the region's radius against the radius a tennis ball
+#                     would have at the region's depth (point cloud sampled
+#                     at the centroid and around it)
+# The score is the product of the three, so a big yellow-green distractor
+# whose size does not match its depth ranks below the real ball.
+##############################################
+
+import collections
+import math
+import cv2
+import numpy as np
+
+# Desc: One scored color region.
+#       x, y, radius are the center and radius in full resolution pixels
+#       area is the area in full resolution pixels
+#       distance is the depth (mm) at the center, NaN if unknown
+#       circularity, color_fill, size_consistency and score are from 0 to 1
+#       contour is the region's contour as given (search window coordinates,
+#           downscaled by the pyramid)
+Candidate = collections.namedtuple('Candidate', ['x', 'y', 'radius', 'area', 'distance', 'circularity',
+                                                 'color_fill', 'size_consistency', 'score', 'contour'])
+
+# Share of its bounding box a disk fills
+DISK_EXTENT = math.pi / 4
+
+
+# Desc: Score every contour of a mask.
+#       contours are the contours of the color mask after erode/dilate (from
+#           cv2.findContours, search window coordinates)
+#       color_mask is the color mask before erode/dilate (search window)
+#       point_cloud is the full resolution point cloud
+#       calibration is the CameraCalibration of the frame
+#       scale and offset move search window coordinates to full resolution:
+#           full = search * scale + offset
+#       min_area is the smallest contour area (search window pixels) that is scored
+#       max_candidates is how many of the best candidates are returned (None for all)
+# Inputs: list contours, numpy array color_mask, numpy array point_cloud, CameraCalibration calibration,
+#         int scale, (int, int) offset, float min_area, int max_candidates
+# Outputs: list of Candidate sorted from best to worst score
+def rank_candidates(contours, color_mask, point_cloud, calibration, scale=1, offset=(0, 0), min_area=4,
+                    max_candidates=8):
+	if len(contours) == 0:
+		return []
+	lengths = np.array([len(contour) for contour in contours], dtype=np.int64)
+	points = np.concatenate(contours).reshape(-1, 2).astype(np.float64)
+	starts = np.zeros(len(contours), dtype=np.int64)
+	np.cumsum(lengths[:-1], out=starts[1:])
+	# the point after every point along its (closed) contour
+	following = np.arange(len(points)) + 1
+	following[starts + lengths - 1] = starts
+	next_points = points[following]
+
+	# area and centroid of every polygon (shoelace formula)
+	cross = points[:, 0] * next_points[:, 1] - next_points[:, 0] * points[:, 1]
+	signed_area = np.add.reduceat(cross, starts) / 2
+	area = np.abs(signed_area)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		center_x = np.add.reduceat((points[:, 0] + next_points[:, 0]) * cross, starts) / (6 * signed_area)
+		center_y = np.add.reduceat((points[:, 1] + next_points[:, 1]) * cross, starts) / (6 * signed_area)
+	# lines and single points have no area; use the mean of their points
+	flat = area < 0.5
+	if flat.any():
+		center_x[flat] = (np.add.reduceat(points[:, 0], starts) / lengths)[flat]
+		center_y[flat] = (np.add.reduceat(points[:, 1], starts) / lengths)[flat]
+
+	keep = np.flatnonzero(area >= min_area)
+	if len(keep) == 0:
+		return []
+	left = np.minimum.reduceat(points[:, 0], starts)[keep]
+	right = np.maximum.reduceat(points[:, 0], starts)[keep]
+	top = np.minimum.reduceat(points[:, 1], starts)[keep]
+	bottom = np.maximum.reduceat(points[:, 1], starts)[keep]
+	area = area[keep]
+	center_x = center_x[keep]
+	center_y = center_y[keep]
+
+	# circularity: a disk has a square bounding box and fills pi/4 of it
+	width = np.maximum(right - left, 1)
+	height = np.maximum(bottom - top, 1)
+	aspect = np.minimum(width, height) / np.maximum(width, height)
+	extent = area / (width * height)
+	circularity = aspect * np.clip(1 - 2 * np.abs(extent / DISK_EXTENT - 1), 0, 1)
+
+	# color fill: colored share of the square inscribed in the circle of the bounding box
+	# (the contour goes through the centers of the edge pixels, so the region is half a pixel bigger)
+	mask_height, mask_width = color_mask.shape[:2]
+	search_radius = (width + height) / 4 + 0.5
+	half_side = np.maximum(search_radius / math.sqrt(2), 0.5)
+	box_x = (left + right) / 2
+	box_y = (top + bottom) / 2
+	x1 = np.clip(np.floor(box_x - half_side + 0.5), 0, mask_width).astype(np.int64)
+	x2 = np.clip(np.floor(box_x + half_side + 0.5), 0, mask_width).astype(np.int64)
+	y1 = np.clip(np.floor(box_y - half_side + 0.5), 0, mask_height).astype(np.int64)
+	y2 = np.clip(np.floor(box_y + half_side + 0.5), 0, mask_height).astype(np.int64)
+	integral = cv2.integral(color_mask, sdepth=cv2.CV_32S)
+	colored = (integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]) / 255.0
+	color_fill = np.clip(colored / np.maximum((x2 - x1) * (y2 - y1), 1), 0, 1)
+
+	# centers and radii in full resolution pixels
+	x = center_x * scale + offset[0] + scale // 2
+	y = center_y * scale + offset[1] + scale // 2
+	radius = search_radius * scale
+
+	# depth: median of the valid points at the center and half a radius around it
+	image_height, image_width = point_cloud.shape[:2]
+	step = radius / 2
+	sample_x = np.stack([x, x - step, x + step, x, x], axis=1)
+	sample_y = np.stack([y, y, y, y - step, y + step], axis=1)
+	sample_x = np.clip(np.round(sample_x), 0, image_width - 1).astype(np.int64)
+	sample_y = np.clip(np.round(sample_y), 0, image_height - 1).astype(np.int64)
+	samples = point_cloud[sample_y, sample_x, :3].astype(np.float64)
+	distances = np.sqrt((samples * samples).sum(axis=2))
+	# NaN/inf points sort last; take the median of the valid ones
+	distances[~np.isfinite(distances)] = np.nan
+	distances.sort(axis=1)
+	valid = np.count_nonzero(np.isfinite(distances), axis=1)
+	distance = distances[np.arange(len(distances)), np.maximum(valid - 1, 0) // 2]
+	distance[valid == 0] = np.nan
+
+	# size consistency: radius against the expected radius of a ball at that depth
+	indices = calibration.table_indices(distance)
+	expected_radius = np.where(indices >= 0, calibration.radius[np.maximum(indices, 0)], 0).astype(np.float64)
+	size_consistency = np.where(expected_radius > 0,
+	                            np.minimum(radius, expected_radius) / np.maximum(radius, np.maximum(expected_radius, 1)),
+	                            0.0)
+
+	score = circularity * color_fill * size_consistency
+	order = np.argsort(-score, kind='mergesort')[:max_candidates]
+	return [Candidate(x=int(x[i]), y=int(y[i]), radius=int(round(radius[i])), area=float(area[i] * scale * scale),
+	                  distance=float(distance[i]), circularity=float(circularity[i]),
+	                  color_fill=float(color_fill[i]), size_consistency=float(size_consistency[i]),
+	                  score=float(score[i]), contour=contours[keep[i]])
+	        for i in order]
@@ -0,0 +1,328 @@
+##############################################
+# Control plane of the tennis ball detection module.
+#
+# Instead of the blocking input() menu, the detection runs as a service
+# that keeps the frame source open and streaming, and an asyncio server
+# accepts commands on a local socket (TCP "host:port" or a Unix socket
+# path) to start and stop the detection and to change the HSV bounds and
+# the morphology iterations at runtime. Results are published with a
+# ResultPublisher (see result_stream.py).
+#
+# Commands and replies are one JSON object per line:
+#   {"command": "start"}                      start the detection
+#   {"command": "stop"}                       stop the detection, the camera stays open
+#   {"command": "set", "hsv_lower": [35, 70, 30], "erosions": 1}
+#       change any of hsv_lower, hsv_upper, erosions, dilations
+#   {"command": "status"}                     current state and parameters
+#   {"command": "quit"}                       stop the service and close the camera
+# Every reply is {"ok": true, "status": {...}} or {"ok": false, "error": "..."}.
+#
+# Requires Python 3.5 or newer (async/await).
+#
+# USAGE
+# python ball_tracker_final.py --control                      run the service (add -r for a recording)
+# python control.py start                                     send commands to the service
+# python control.py set hsv_lower=30,60,30 erosions=1
+# python control.py --address /tmp/ball_control.sock status
+##############################################
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+import numpy as np
+import ball_tracker_final as ball_tracker
+from result_stream import parse_address
+from tracking import BallTracker
+from smoothing import PositionEstimator
+from hsv_lut import HSVLookupTable
+from hsv_calibration import HSV_MAXIMUM
+
+DEFAULT_CONTROL_ADDRESS = ball_tracker.DEFAULT_CONTROL_ADDRESS
+
+
+# Desc: Runs the detection on an opened frame source in a background thread.
+#       The frame source stays open (and a live camera keeps grabbing) while
+#       the detection is stopped, so starting it again is immediate.
+#       publisher is a ResultPublisher that every result is sent to (or None)
+#       The other arguments are the same as find_tennis_ball.
+# Inputs: frame_source, ResultPublisher publisher, int[3] hsv_lower, int[3] hsv_upper, int num_erosions,
+#         int num_dilations, bool tracking, int pyramid_levels, str depth_method, str color_classifier,
+#         bool multi_candidate, bool adaptive_hough, bool circle_shortcut, bool smoothing
+class DetectionService(object):
+	def __init__(self, frame_source, publisher, hsv_lower, hsv_upper, num_erosions, num_dilations,
+	             tracking=False, pyramid_levels=0, depth_method='median', color_classifier='hsv',
+	             multi_candidate=False, adaptive_hough=False, circle_shortcut=False, smoothing=False):
+		self.frame_source = frame_source
+		self.publisher = publisher
+		self.tracker = BallTracker() if tracking else None
+		self.estimator = PositionEstimator() if smoothing else None
+		self.pyramid_levels = pyramid_levels
+		self.depth_method = depth_method
+		self.multi_candidate = multi_candidate
+		self.adaptive_hough = adaptive_hough
+		self.circle_shortcut = circle_shortcut
+		self.lookup_table = HSVLookupTable(hsv_lower, hsv_upper) if color_classifier == 'lut' else None
+		# replaced as a whole by set_parameters, so the detection thread always reads a consistent set
+		self.parameters = {
+			"hsv_lower": [int(value) for value in hsv_lower],
+			"hsv_upper": [int(value) for value in hsv_upper],
+			"erosions": int(num_erosions),
+			"dilations": int(num_dilations),
+		}
+		self.lock = threading.Lock()
+		self.detecting = threading.Event()
+		self.closed = threading.Event()
+		self.thread = None
+		self.finished = False
+		self.frames_grabbed = 0
+		self.frames_processed = 0
+		self.frame_id = 0
+
+	# Desc: Start the capture/detection thread (the detection itself starts stopped)
+	# Inputs:
+	# Outputs:
+	def open(self):
+		self.thread = threading.Thread(target=self._run, name="detection-service")
+		self.thread.daemon = True
+		self.thread.start()
+
+	def _run(self):
+		buffers = ball_tracker.DetectionBuffers()
+		calibration = self.frame_source.calibration
+		while not self.closed.is_set():
+			if not self.detecting.is_set() and not self.frame_source.is_live:
+				# do not use up a recording while the detection is stopped
+				self.detecting.wait(0.1)
+				continue
+			capture_time = time.time()
+			grabbed, frame = self.frame_source.read()
+			if not grabbed:
+				if not self.frame_source.is_live:
+					# end of the recording
+					self.finished = True
+					self.detecting.clear()
+					break
+				continue
+			self.frames_grabbed += 1
+			if not self.detecting.is_set():
+				# keep the camera streaming so the detection starts on a fresh frame
+				continue
+
+			parameters = self.parameters
+			result = ball_tracker.detect_tennis_ball(frame=frame, calibration=calibration,
+			                                         hsv_lower=np.array(parameters["hsv_lower"]),
+			                                         hsv_upper=np.array(parameters["hsv_upper"]),
+			                                         num_erosions=parameters["erosions"],
+			                                         num_dilations=parameters["dilations"],
+			                                         tracker=self.tracker, pyramid_levels=self.pyramid_levels,
+			                                         depth_method=self.depth_method, buffers=buffers,
+			                                         color_classifier=self.lookup_table,
+			                                         multi_candidate=self.multi_candidate,
+			                                         adaptive_hough=self.adaptive_hough,
+			                                         circle_shortcut=self.circle_shortcut)
+			self.frame_id += 1
+			self.frames_processed += 1
+			estimate = self.estimator.update(capture_time, result) if self.estimator is not None else None
+			if self.publisher is not None:
+				self.publisher.publish(self.frame_id, capture_time, result, self.estimator is not None, estimate)
+
+	# Desc: Start the detection
+	# Inputs:
+	# Outputs:
+	def start(self):
+		if self.finished:
+			raise ValueError("the recording has ended")
+		if self.tracker is not None:
+			self.tracker.reset()
+		if self.estimator is not None:
+			self.estimator.reset()
+		self.detecting.set()
+
+	# Desc: Stop the detection; the frame source stays open
+	# Inputs:
+	# Outputs:
+	def stop(self):
+		self.detecting.clear()
+
+	# Desc: Change detection parameters. Only the given parameters change.
+	# Inputs: list hsv_lower, list hsv_upper, int erosions, int dilations
+	# Outputs:
+	def set_parameters(self, hsv_lower=None, hsv_upper=None, erosions=None, dilations=None):
+		with self.lock:
+			parameters = dict(self.parameters)
+			for name, bounds in (("hsv_lower", hsv_lower), ("hsv_upper", hsv_upper)):
+				if bounds is None:
+					continue
+				bounds = [int(value) for value in bounds]
+				if len(bounds) != 3 or any(not 0 <= value <= maximum for value, maximum in zip(bounds, HSV_MAXIMUM)):
+					raise ValueError("{0} must be 3 values within {1}".format(name, list(HSV_MAXIMUM)))
+				parameters[name] = bounds
+			for name, iterations in (("erosions", erosions), ("dilations", dilations)):
+				if iterations is None:
+					continue
+				if int(iterations) < 0:
+					raise ValueError("{0} can not be negative".format(name))
+				parameters[name] = int(iterations)
+			if self.lookup_table is not None:
+				self.lookup_table.set_bounds(parameters["hsv_lower"], parameters["hsv_upper"])
+			self.parameters = parameters
+
+	# Desc: Current state and parameters
+	# Inputs:
+	# Outputs: dict
+	def status(self):
+		status = dict(self.parameters)
+		status.update({
+			"detecting": self.detecting.is_set(),
+			"finished": self.finished,
+			"frames_grabbed": self.frames_grabbed,
+			"frames_processed": self.frames_processed,
+		})
+		return status
+
+	# Desc: Stop the thread and close the frame source
+	# Inputs:
+	# Outputs:
+	def close(self):
+		self.closed.set()
+		self.detecting.set()
+		if self.thread is not None:
+			self.thread.join()
+		self.frame_source.close()
+
+
+# Desc: Run one command on the service
+# Inputs: DetectionService service, dict request
+# Outputs: dict reply
+def handle_command(service, request):
+	command = request.get("command")
+	try:
+		if command == "start":
+			service.start()
+		elif command == "stop":
+			service.stop()
+		elif command == "set":
+			service.set_parameters(**dict((name, request[name]) for name in
+			                              ("hsv_lower", "hsv_upper", "erosions", "dilations") if name in request))
+		elif command not in ("status", "quit"):
+			raise ValueError("unknown command {0!r}".format(command))
+	except (ValueError, TypeError) as error:
+		return {"ok": False, "error": str(error)}
+	return {"ok": True, "status": service.status()}
+
+
+# Desc: Serve commands for the service on a local address until a quit command.
+#       The service is closed when the server exits.
+# Inputs: DetectionService service, str address
+# Outputs:
+async def serve(service, address=DEFAULT_CONTROL_ADDRESS):
+	quit_event = asyncio.Event()
+
+	async def handle_client(reader, writer):
+		while not quit_event.is_set():
+			line = await reader.readline()
+			if not line:
+				break
+			try:
+				request = json.loads(line.decode("utf-8"))
+				if not isinstance(request, dict):
+					raise ValueError("a command is a JSON object")
+			except ValueError as error:
+				reply = {"ok": False, "error": str(error)}
+			else:
+				reply = handle_command(service, request)
+				if request.get("command") == "quit":
+					quit_event.set()
+			writer.write((json.dumps(reply) + "\n").encode("utf-8"))
+			await writer.drain()
+		writer.close()
+
+	family, bind_address = parse_address(address)
+	if family == socket.AF_UNIX:
+		if os.path.exists(bind_address):
+			os.remove(bind_address)
+		server = await asyncio.start_unix_server(handle_client, path=bind_address)
+	else:
+		server = await asyncio.start_server(handle_client, host=bind_address[0], port=bind_address[1])
+	print("Listening for commands on {0}...".format(address))
+	try:
+		await quit_event.wait()
+	finally:
+		server.close()
+		await server.wait_closed()
+		service.close()
+		if family == socket.AF_UNIX and os.path.exists(bind_address):
+			os.remove(bind_address)
+
+
+# Desc: Open the service on a frame source and serve commands until quit or Ctrl+C
+# Inputs: DetectionService service, str address
+# Outputs:
+def run(service, address=DEFAULT_CONTROL_ADDRESS):
+	service.open()
+	loop = asyncio.new_event_loop()
+	task = loop.create_task(serve(service, address))
+	try:
+		loop.run_until_complete(task)
+	except KeyboardInterrupt:
+		task.cancel()
+		try:
+			loop.run_until_complete(task)
+		except asyncio.CancelledError:
+			pass
+	finally:
+		loop.close()
+
+
+# Desc: Send commands to a running service (test client)
+# Inputs: list of dict requests, str address
+# Outputs: list of dict replies
+async def send_commands(requests, address=DEFAULT_CONTROL_ADDRESS):
+	family, connect_address = parse_address(address)
+	if family == socket.AF_UNIX:
+		reader, writer = await asyncio.open_unix_connection(path=connect_address)
+	else:
+		reader, writer = await asyncio.open_connection(host=connect_address[0], port=connect_address[1])
+	replies = []
+	for request in requests:
+		writer.write((json.dumps(request) + "\n").encode("utf-8"))
+		await writer.drain()
+		replies.append(json.loads((await reader.readline()).decode("utf-8")))
+	writer.close()
+	return replies
+
+
+# Desc: Parse a command line command, e.g. "set hsv_lower=30,60,30 erosions=1"
+# Inputs: str command, list of str arguments
+# Outputs: dict request
+def parse_command(command, arguments):
+	request = {"command": command}
+	for argument in arguments:
+		name, _, value = argument.partition("=")
+		values = [int(part) for part in value.split(",")]
+		request[name] = values if name.startswith("hsv") else values[0]
+	return request
+
+
+def main():
+	ap = argparse.ArgumentParser(description="Send a command to the tennis ball detection service")
+	ap.add_argument("--address", default=DEFAULT_CONTROL_ADDRESS,
+		help="host:port or Unix socket path of the service")
+	ap.add_argument("command", choices=["start", "stop", "set", "status", "quit"])
+	ap.add_argument("arguments", nargs="*", help="name=value parameters of the set command")
+	args = ap.parse_args()
+
+	loop = asyncio.new_event_loop()
+	try:
+		replies = loop.run_until_complete(send_commands([parse_command(args.command, args.arguments)],
+		                                                args.address))
+	finally:
+		loop.close()
+	print(json.dumps(replies[0], indent=2))
+
+if __name__ == "__main__":
+	main()
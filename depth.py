@@ -0,0 +1,79 @@
+##############################################
+# Depth estimation from the ZED point cloud for the tennis ball detection
+# module.
+#
+# The point cloud often has NaN/inf at single pixels (see the FUTURE WORK
+# note in coordinates_to_largest_contour), so instead of reading the one
+# pixel at the contour centroid, every point under the contour is used and
+# the invalid ones are filtered out in one NumPy pass.
+##############################################
+
+import math
+import cv2
+import numpy as np
+from calibration import TENNIS_BALL_DIAMETER
+
+
+# Desc: Estimate the x, y, z position (mm from the left lens) of the object
+#       outlined by a contour from the point cloud points under the contour.
+#       point_cloud is the H x W x 3 (or 4) point cloud of the frame; only a
+#           view of the patch under the contour's bounding box is used
+#       contour is a contour in frame coordinates (from cv2.findContours)
+#       method is 'median' (per-axis median of the valid points) or 'trimmed'
+#           (mean of the valid points within tolerance of their median distance,
+#           so the background the mask bleeds onto is left out; it is all on the
+#           far side, so dropping the same share at both ends would not be)
+#       max_samples limits how many points are read; big contours are sampled
+#           on a regular grid
+#       tolerance is how far (mm) from the estimated distance a point can be and
+#           still count as part of the object (default 2 ball diameters)
+#
+#       The confidence is the fraction of points under the contour that have a
+#       valid depth, times the fraction of those within tolerance of the
+#       estimated distance (a contour bleeding onto the background gets a
+#       low confidence). Returns (None, 0.0) if no point has a valid depth.
+# Inputs: numpy array point_cloud, numpy array contour, str method, int max_samples, float tolerance
+# Outputs: numpy array position[3] (or None), float confidence
+def estimate_contour_position(point_cloud, contour, method='median', max_samples=4096,
+                              tolerance=2 * TENNIS_BALL_DIAMETER):
+	image_height, image_width = point_cloud.shape[:2]
+	x, y, w, h = cv2.boundingRect(contour)
+	# keep the bounding box inside the point cloud
+	x2 = min(x + w, image_width)
+	y2 = min(y + h, image_height)
+	x = max(x, 0)
+	y = max(y, 0)
+	if x2 <= x or y2 <= y:
+		return None, 0.0
+
+	# Fill the contour on a mask the size of its bounding box
+	patch_mask = np.zeros((y2 - y, x2 - x), dtype=np.uint8)
+	cv2.drawContours(patch_mask, [contour], -1, 1, thickness=-1, offset=(-x, -y))
+
+	# Sample big patches on a regular grid; slicing keeps these views of the point cloud
+	step = max(1, int(math.sqrt(patch_mask.size / float(max_samples))))
+	patch = point_cloud[y:y2:step, x:x2:step, :3]
+	inside = patch_mask[::step, ::step].astype(bool)
+
+	points = patch[inside]
+	total = len(points)
+	if total == 0:
+		return None, 0.0
+	points = points[np.isfinite(points).all(axis=1)]
+	if len(points) == 0:
+		return None, 0.0
+
+	distances = np.sqrt((points * points).sum(axis=1))
+	position = None
+	if method == 'trimmed':
+		near = np.abs(distances - np.median(distances)) <= tolerance
+		# empty only when the two middle points are far apart
+		if near.any():
+			position = points[near].mean(axis=0)
+	if position is None:
+		position = np.median(points, axis=0)
+
+	distance = math.sqrt(float((position * position).sum()))
+	consistent = np.count_nonzero(np.abs(distances - distance) <= tolerance)
+	confidence = (len(points) / float(total)) * (consistent / float(len(points)))
+	return position, float(confidence)
@@ -0,0 +1,236 @@
+##############################################
+# Offline evaluation of the tennis ball detection over a recorded session
+# with labeled ball positions. Every combination of the given detection
+# parameters is evaluated headlessly, spread over all CPU cores.
+#
+# USAGE
+# python evaluate.py --recording path/to/session --param2 10 15 20 --erosions 1 2 3
+# python evaluate.py --recording path/to/session --labels labels.csv --output results.json
+#
+# The labels are a CSV file (labels.csv in the recording by default) with
+# the header "frame,x,y,distance": the frame index, the pixel coordinates
+# of the ball center and optionally the distance to the ball in mm.
+# Frames that are not listed have no ball.
+##############################################
+
+import argparse
+import collections
+import csv
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import time
+import numpy as np
+import ball_tracker_final as ball_tracker
+from frame_source import open_recording
+from hsv_lut import HSVLookupTable
+from instrumentation import StageTimer
+
+# Parameters that can be varied, with their defaults
+DEFAULT_CONFIG = collections.OrderedDict([
+	("param1", 200),
+	("param2", 15),
+	("band_low", .8),
+	("band_high", 1.2),
+	("erosions", ball_tracker.DEFAULT_EROSIONS),
+	("dilations", ball_tracker.DEFAULT_DILATIONS),
+	("pyramid", 0),
+	("depth", "median"),
+	("classifier", "hsv"),
+	("candidates", 0),
+	("adaptive", 0),
+	("shortcut", 0),
+])
+
+
+# Desc: Read the labels file
+# Inputs: str path
+# Outputs: dict frame index -> (x, y, distance or None)
+def load_labels(path):
+	labels = {}
+	with open(path) as labels_file:
+		for row in csv.DictReader(labels_file):
+			distance = row.get("distance")
+			labels[int(row["frame"])] = (float(row["x"]), float(row["y"]),
+			                             float(distance) if distance else None)
+	return labels
+
+
+# Desc: Every combination of the parameter values given on the command line
+# Inputs: dict parameter -> list of values (missing parameters use DEFAULT_CONFIG)
+# Outputs: list of dict configs
+def config_grid(values):
+	names = list(DEFAULT_CONFIG.keys())
+	choices = [values.get(name) or [DEFAULT_CONFIG[name]] for name in names]
+	return [collections.OrderedDict(zip(names, combination)) for combination in itertools.product(*choices)]
+
+
+# Desc: Run the detection with one config on frames [start, stop) of a
+#       recording. Runs in a worker process.
+# Inputs: tuple (int config_index, dict config, str recording, int start, int stop)
+# Outputs: int config_index, list of (frame, found, detected, x, y, distance), dict stage -> durations
+def evaluate_chunk(task):
+	config_index, config, recording, start, stop = task
+	frame_source = open_recording(recording)
+	frame_source.open()
+	frame_source.seek(start)
+	hsv_lower = np.array(ball_tracker.DEFAULT_HSV_LOWER)
+	hsv_upper = np.array(ball_tracker.DEFAULT_HSV_UPPER)
+	lookup_table = HSVLookupTable(hsv_lower, hsv_upper) if config["classifier"] == "lut" else None
+	buffers = ball_tracker.DetectionBuffers()
+	timer = StageTimer(window=None)
+	records = []
+
+	for frame_index in range(start, stop):
+		grabbed, frame = frame_source.read()
+		if not grabbed:
+			break
+		begin = timer.clock()
+		result = ball_tracker.detect_tennis_ball(frame=frame, calibration=frame_source.calibration,
+		                                         hsv_lower=hsv_lower, hsv_upper=hsv_upper,
+		                                         num_erosions=config["erosions"], num_dilations=config["dilations"],
+		                                         pyramid_levels=config["pyramid"], depth_method=config["depth"],
+		                                         buffers=buffers, color_classifier=lookup_table,
+		                                         hough_param1=config["param1"], hough_param2=config["param2"],
+		                                         radius_band=None if config["adaptive"] else
+		                                         (config["band_low"], config["band_high"]),
+		                                         multi_candidate=bool(config["candidates"]),
+		                                         adaptive_hough=bool(config["adaptive"]),
+		                                         circle_shortcut=bool(config["shortcut"]), timer=timer)
+		timer.record('total', begin)
+		# the detected circle is the best position; otherwise the guess from the color region
+		x, y = (result.circle or result.guess_circle or (None, None))[:2]
+		records.append((frame_index, result.found, result.detected, x, y, result.distance))
+	frame_source.close()
+	return config_index, records, dict((stage, list(durations)) for stage, durations in timer.durations.items())
+
+
+# Desc: Precision and recall of the predictions of one level ('found' or
+#       'detected'). A prediction is correct when it is within tolerance pixels
+#       of the labeled ball center.
+# Inputs: list records, dict labels, str level, float tolerance
+# Outputs: float precision, float recall, list of distance errors (mm) of correct predictions
+def score_records(records, labels, level, tolerance):
+	true_positives = 0
+	predicted = 0
+	distance_errors = []
+	for frame_index, found, detected, x, y, distance in records:
+		positive = detected if level == 'detected' else found
+		if not positive:
+			continue
+		predicted += 1
+		label = labels.get(frame_index)
+		if label is not None and math.hypot(x - label[0], y - label[1]) <= tolerance:
+			true_positives += 1
+			if label[2] is not None and distance is not None:
+				distance_errors.append(abs(distance - label[2]))
+	labeled = sum(1 for record in records if record[0] in labels)
+	precision = true_positives / float(predicted) if predicted else float('nan')
+	recall = true_positives / float(labeled) if labeled else float('nan')
+	return precision, recall, distance_errors
+
+
+# Desc: Evaluate every config over the recording with a process pool
+# Inputs: str recording, dict labels, list configs, int workers, int chunk_size, float tolerance
+# Outputs: list of dict with the metrics of each config
+def evaluate(recording, labels, configs, workers=None, chunk_size=50, tolerance=10.0):
+	frame_source = open_recording(recording)
+	frame_source.open()
+	num_frames = len(frame_source)
+	frame_source.close()
+
+	tasks = [(config_index, config, recording, start, min(start + chunk_size, num_frames))
+	         for config_index, config in enumerate(configs)
+	         for start in range(0, num_frames, chunk_size)]
+	records = [[] for config in configs]
+	durations = [collections.OrderedDict() for config in configs]
+
+	pool = multiprocessing.Pool(processes=workers)
+	try:
+		for config_index, chunk_records, chunk_durations in pool.imap_unordered(evaluate_chunk, tasks):
+			records[config_index].extend(chunk_records)
+			for stage, stage_durations in chunk_durations.items():
+				durations[config_index].setdefault(stage, []).extend(stage_durations)
+	finally:
+		pool.close()
+		pool.join()
+
+	results = []
+	for config, config_records, config_durations in zip(configs, records, durations):
+		found_precision, found_recall, distance_errors = score_records(config_records, labels, 'found', tolerance)
+		detected_precision, detected_recall, _ = score_records(config_records, labels, 'detected', tolerance)
+		timing = collections.OrderedDict(
+			(stage, [float(value) for value in np.percentile(1000 * np.array(values), (50, 95, 99))])
+			for stage, values in config_durations.items())
+		results.append({
+			"config": config,
+			"frames": len(config_records),
+			"found_precision": found_precision, "found_recall": found_recall,
+			"detected_precision": detected_precision, "detected_recall": detected_recall,
+			"distance_error_mean_mm": float(np.mean(distance_errors)) if distance_errors else float('nan'),
+			"distance_error_p95_mm": float(np.percentile(distance_errors, 95)) if distance_errors else float('nan'),
+			"timing_ms_p50_p95_p99": timing,
+		})
+	return results
+
+
+# Desc: Print the metrics of every config
+# Inputs: list results (from evaluate)
+# Outputs:
+def print_results(results):
+	for result in results:
+		config = ", ".join("{0}={1}".format(name, value) for name, value in result["config"].items()
+		                   if value != DEFAULT_CONFIG[name]) or "defaults"
+		print("\n{0} ({1} frames)".format(config, result["frames"]))
+		print("  found:    precision {0:.3f}  recall {1:.3f}".format(result["found_precision"], result["found_recall"]))
+		print("  detected: precision {0:.3f}  recall {1:.3f}".format(result["detected_precision"],
+		                                                              result["detected_recall"]))
+		print("  distance error: {0:.1f} mm mean, {1:.1f} mm p95".format(result["distance_error_mean_mm"],
+		                                                                 result["distance_error_p95_mm"]))
+		print("  {0:>14} {1:>8} {2:>8} {3:>8}".format("stage (ms)", "p50", "p95", "p99"))
+		for stage, (p50, p95, p99) in result["timing_ms_p50_p95_p99"].items():
+			print("  {0:>14} {1:>8.2f} {2:>8.2f} {3:>8.2f}".format(stage, p50, p95, p99))
+
+
+def main():
+	ap = argparse.ArgumentParser(description="Evaluate the tennis ball detection on a labeled recording")
+	ap.add_argument("-r", "--recording", required=True, help="path to a recorded session")
+	ap.add_argument("-l", "--labels", help="labels CSV file (default: labels.csv in the recording)")
+	ap.add_argument("-o", "--output", help="write the results to this JSON file")
+	ap.add_argument("-w", "--workers", type=int, default=None, help="worker processes (default: CPU count)")
+	ap.add_argument("--chunk-size", type=int, default=50, help="frames per task")
+	ap.add_argument("--tolerance", type=float, default=10.0,
+		help="pixels between the predicted and labeled ball center to count as correct")
+	ap.add_argument("--param1", type=int, nargs="+", help="HoughCircles Canny thresholds to try")
+	ap.add_argument("--param2", type=int, nargs="+", help="HoughCircles accumulator thresholds to try")
+	ap.add_argument("--band-low", type=float, nargs="+", help="lower radius band factors to try (0.8)")
+	ap.add_argument("--band-high", type=float, nargs="+", help="upper radius band factors to try (1.2)")
+	ap.add_argument("--erosions", type=int, nargs="+", help="erosion iterations to try")
+	ap.add_argument("--dilations", type=int, nargs="+", help="dilation iterations to try")
+	ap.add_argument("--pyramid", type=int, nargs="+", help="pyramid levels to try")
+	ap.add_argument("--depth", nargs="+", choices=["pixel", "median", "trimmed"], help="depth methods to try")
+	ap.add_argument("--classifier", nargs="+", choices=["hsv", "lut"], help="color classifiers to try")
+	ap.add_argument("--candidates", type=int, nargs="+", choices=[0, 1],
+		help="1 to score every color region instead of using the largest one")
+	ap.add_argument("--adaptive", type=int, nargs="+", choices=[0, 1],
+		help="1 to pick the Hough settings by distance (ignores --band-low/--band-high)")
+	ap.add_argument("--shortcut", type=int, nargs="+", choices=[0, 1],
+		help="1 to skip the Hough transform for clearly round color regions")
+	args = vars(ap.parse_args())
+
+	labels = load_labels(args["labels"] or os.path.join(args["recording"], "labels.csv"))
+	configs = config_grid(args)
+	print("Evaluating {0} configurations...".format(len(configs)))
+	start = time.time()
+	results = evaluate(recording=args["recording"], labels=labels, configs=configs, workers=args["workers"],
+	                   chunk_size=args["chunk_size"], tolerance=args["tolerance"])
+	print_results(results)
+	print("\nEvaluated in {0:.1f} seconds.".format(time.time() - start))
+	if args["output"]:
+		with open(args["output"], "w") as output_file:
+			json.dump(results, output_file, indent=2)
+
+if __name__ == "__main__":
+	main()
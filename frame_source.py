@@ -0,0 +1,342 @@
+##############################################
+# Frame sources for the tennis ball detection module.
+#
+# A frame source hands the detection code one Frame at a time:
+#   (left BGR image, XYZ point cloud, focal length fx, focal length fy)
+# so the same detection code can run on the ZED camera on the rover or
+# on a recorded session on a laptop.
+#
+# Recorded sessions are a directory with:
+#   left.npy         N x H x W x C uint8 stack of left images (BGR or BGRA)
+#   xyz.npy          N x H x W x 3 (or 4) float32 stack of point clouds (mm)
+#   calibration.npz  fx, fy (and optionally cx, cy) in pixels of the left camera
+# or a single .npz file holding the arrays 'left', 'xyz', 'fx' and 'fy'
+# (and optionally 'cx' and 'cy').
+# The .npy stacks are memory-mapped, so replaying a session does not load
+# it into memory and runs as fast as the detection code can go.
+# Sessions recorded while detecting (ball_tracker_final.py --save) use the
+# compact chunked format of recorder.py; open_recording picks the frame
+# source that reads a recording.
+#
+# Opening the ZED takes seconds, so the program keeps the frame source open
+# in a CameraSession and lends it to one mode at a time.
+##############################################
+
+import collections
+import os
+import sys
+import numpy as np
+from calibration import CameraCalibration, calibration_from_zed
+from instrumentation import NULL_TIMER
+
+
+# Desc: One frame handed to the detection code.
+#       image is the left image (H x W x 3 BGR or H x W x 4 BGRA, uint8)
+#       point_cloud is the XYZ point cloud aligned on the left image
+#           (H x W x 3 or H x W x 4, float32, millimeters from the left lens)
+#       fx, fy are the focal lengths of the left camera in pixels
+Frame = collections.namedtuple('Frame', ['image', 'point_cloud', 'fx', 'fy'])
+
+
+# Desc: Frame source backed by the ZED camera. The pyzed modules are only
+#       imported when the camera is opened, so this file can be imported on
+#       a computer without the ZED SDK.
+#
+#       read() mirrors cv2.VideoCapture.read(): it returns (grabbed, frame)
+#       and grabbed is False when the camera did not deliver a new frame.
+#
+#       The camera information is read once when the camera is opened and kept
+#       in calibration (CameraCalibration), camera_fps, firmware_version and
+#       serial_number, so nothing asks the ZED SDK for it per frame.
+class ZEDFrameSource(object):
+	is_live = True
+
+	def __init__(self):
+		self.zed = None
+		self.runtime_parameters = None
+		self.left_image = None
+		self.point_cloud = None
+		self.calibration = None
+		self.camera_fps = None
+		self.firmware_version = None
+		self.serial_number = None
+
+	# Desc: Open the ZED camera with millimeter units and STANDARD sensing mode.
+	#       Exits the program if the camera can not be opened.
+	# Inputs:
+	# Outputs:
+	def open(self):
+		import pyzed.camera as zcam
+		import pyzed.defines as sl
+		import pyzed.types as tp
+		import pyzed.core as core
+		self._sl = sl
+		self._tp = tp
+
+		# Create a PyZEDCamera object
+		self.zed = zcam.PyZEDCamera()
+
+		# Create a PyInitParameters object and set configuration parameters
+		init_params = zcam.PyInitParameters()
+		init_params.coordinate_units = sl.PyUNIT.PyUNIT_MILLIMETER  # Use milliliter units (for depth measurements)
+
+		# Open the camera
+		if not self.zed.is_opened():
+			print("Opening ZED Camera...")
+		status = self.zed.open(init_params)
+		if status != tp.PyERROR_CODE.PySUCCESS:
+			print(repr(status))
+			exit()
+
+		# Create and set PyRuntimeParameters after opening the camera
+		self.runtime_parameters = zcam.PyRuntimeParameters()
+		self.runtime_parameters.sensing_mode = sl.PySENSING_MODE.PySENSING_MODE_STANDARD  # Use STANDARD sensing mode
+
+		# Initialize arrays with proper format from ZED SDK
+		self.left_image = core.PyMat()
+		self.point_cloud = core.PyMat()
+
+		# The camera information does not change while the camera is open
+		camera_information = self.zed.get_camera_information()
+		resolution = self.zed.get_resolution()
+		self.calibration = calibration_from_zed(camera_information, width=resolution.width,
+		                                        height=resolution.height)
+		self.camera_fps = self.zed.get_camera_fps()
+		self.firmware_version = camera_information.firmware_version
+		self.serial_number = camera_information.serial_number
+
+	# Desc: Grab a frame and retrieve the left image and the XYZ point cloud.
+	#       timer records the grab and retrieve stages (see instrumentation.py)
+	# Inputs: StageTimer timer
+	# Outputs: bool grabbed, Frame frame (None if not grabbed)
+	def read(self, timer=NULL_TIMER):
+		t = timer.clock()
+		if self.zed.grab(self.runtime_parameters) != self._tp.PyERROR_CODE.PySUCCESS:
+			return False, None
+		t = timer.record('grab', t)
+
+		# Retrieve left image
+		self.zed.retrieve_image(self.left_image, self._sl.PyVIEW.PyVIEW_LEFT)
+		t = timer.record('retrieve_image', t)
+		# Retrieve colored point cloud. Point cloud is aligned on the left camera
+		self.zed.retrieve_measure(self.point_cloud, self._sl.PyMEASURE.PyMEASURE_XYZ)
+		timer.record('retrieve_measure', t)
+
+		return True, Frame(image=self.left_image.get_data(), point_cloud=self.point_cloud.get_data(),
+		                   fx=self.calibration.fx, fy=self.calibration.fy)
+
+	# Desc: Helper function to print ZED camera information
+	# Inputs:
+	# Outputs:
+	def print_information(self):
+		print("Resolution: {0}, {1}.".format(self.calibration.width, self.calibration.height))
+		print("Camera FPS: {0}.".format(self.camera_fps))
+		print("Firmware: {0}.".format(self.firmware_version))
+		print("Serial number: {0}.\n".format(self.serial_number))
+		sys.stdout.flush()
+
+	# Desc: Close the camera
+	# Inputs:
+	# Outputs:
+	def close(self):
+		if self.zed is not None:
+			self.zed.close()
+			self.zed = None
+
+
+# Desc: Frame source that replays a recorded session (see top of file for
+#       the format) as fast as it is read. With loop=True the recording
+#       restarts from the first frame instead of ending.
+#
+#       read() returns (False, None) once the recording has ended.
+# Inputs: str path, bool loop
+class FileFrameSource(object):
+	is_live = False
+
+	def __init__(self, path, loop=False):
+		self.path = path
+		self.loop = loop
+		self.images = None
+		self.point_clouds = None
+		self.calibration = None
+		self.frame_index = 0
+
+	# Desc: Memory-map (or lazily load for .npz files) the recorded stacks
+	# Inputs:
+	# Outputs:
+	def open(self):
+		if os.path.isdir(self.path):
+			self.images = np.load(os.path.join(self.path, 'left.npy'), mmap_mode='r')
+			self.point_clouds = np.load(os.path.join(self.path, 'xyz.npy'), mmap_mode='r')
+			calibration = np.load(os.path.join(self.path, 'calibration.npz'))
+		else:
+			# .npz archives can not be memory-mapped; the arrays are read on first access
+			calibration = np.load(self.path)
+			self.images = calibration['left']
+			self.point_clouds = calibration['xyz']
+
+		height, width = self.images.shape[1:3]
+		# cx, cy are optional in a recording; default to the center of the image
+		cx = float(calibration['cx']) if 'cx' in calibration else (width - 1) / 2.0
+		cy = float(calibration['cy']) if 'cy' in calibration else (height - 1) / 2.0
+		self.calibration = CameraCalibration(fx=float(calibration['fx']), fy=float(calibration['fy']),
+		                                     cx=cx, cy=cy, width=width, height=height)
+		self.frame_index = 0
+
+		if len(self.images) != len(self.point_clouds):
+			print("Recording has {0} images but {1} point clouds.".format(len(self.images), len(self.point_clouds)))
+			exit()
+
+	def __len__(self):
+		return len(self.images)
+
+	# Desc: Return the next recorded frame
+	#       timer records the read stage (see instrumentation.py)
+	# Inputs: StageTimer timer
+	# Outputs: bool grabbed, Frame frame (None if the recording ended)
+	def read(self, timer=NULL_TIMER):
+		t = timer.clock()
+		if self.frame_index >= len(self.images):
+			if not self.loop or len(self.images) == 0:
+				return False, None
+			self.frame_index = 0
+
+		i = self.frame_index
+		self.frame_index += 1
+		# np.array copies the frame out of the memory-map so the detection code
+		# can draw on the image without writing to the recording
+		frame = Frame(image=np.array(self.images[i]), point_cloud=self.point_clouds[i],
+		              fx=self.calibration.fx, fy=self.calibration.fy)
+		timer.record('read', t)
+		return True, frame
+
+	# Desc: Make the next read() return the frame at index
+	# Inputs: int index
+	# Outputs:
+	def seek(self, index):
+		self.frame_index = index
+
+	# Desc: Print information about the recording
+	# Inputs:
+	# Outputs:
+	def print_information(self):
+		print("Recording: {0}".format(self.path))
+		print("Resolution: {0}, {1}.".format(self.calibration.width, self.calibration.height))
+		print("Frames: {0}.\n".format(len(self.images)))
+		sys.stdout.flush()
+
+	# Desc: Release the recorded stacks
+	# Inputs:
+	# Outputs:
+	def close(self):
+		self.images = None
+		self.point_clouds = None
+
+
+# Desc: Frame source (not opened) of a recorded session: a ChunkedFrameSource
+#       for a recording written by recorder.py, otherwise a FileFrameSource
+# Inputs: str path, bool loop
+# Outputs: ChunkedFrameSource or FileFrameSource
+def open_recording(path, loop=False):
+	# recorder.py imports this file, so it is imported here
+	import recorder
+	if recorder.is_chunked_recording(path):
+		return recorder.ChunkedFrameSource(path, loop=loop)
+	return FileFrameSource(path, loop=loop)
+
+
+# Desc: Keeps one frame source (the ZED camera and its runtime parameters and
+#       PyMat buffers, or a recording) open for the whole program and lends it
+#       to one mode at a time (detection, HSV tuning, control service), so
+#       switching modes does not close and reopen the camera.
+#
+#       acquire() opens the frame source on first use and returns a
+#       SessionFrameSource that the mode uses like any frame source; closing
+#       it gives the frame source back to the session instead of closing it.
+#       A recording restarts from its first frame every time it is acquired.
+#       loop is the default loop setting of a recording
+# Inputs: frame source (ZEDFrameSource or FileFrameSource, not opened), bool loop
+class CameraSession(object):
+	def __init__(self, frame_source, loop=False):
+		self.frame_source = frame_source
+		self.loop = loop
+		self.is_open = False
+		self.active = None
+
+	# Desc: Open the frame source if it is not open yet
+	# Inputs:
+	# Outputs:
+	def open(self):
+		if not self.is_open:
+			self.frame_source.open()
+			self.is_open = True
+
+	# Desc: Lend the frame source to a mode. Raises RuntimeError if another
+	#       mode is still using it.
+	#       loop=True restarts a recording when it ends, whatever the session default
+	# Inputs: bool loop
+	# Outputs: SessionFrameSource
+	def acquire(self, loop=False):
+		if self.active is not None:
+			raise RuntimeError("the camera is already used by another mode")
+		self.open()
+		if not self.frame_source.is_live:
+			self.frame_source.loop = loop or self.loop
+			self.frame_source.seek(0)
+		self.active = SessionFrameSource(self)
+		return self.active
+
+	# Desc: Take the frame source back from a mode
+	# Inputs: SessionFrameSource lease
+	# Outputs:
+	def release(self, lease):
+		if self.active is lease:
+			self.active = None
+
+	# Desc: Close the frame source
+	# Inputs:
+	# Outputs:
+	def close(self):
+		self.active = None
+		if self.is_open:
+			self.frame_source.close()
+			self.is_open = False
+
+
+# Desc: The frame source of a CameraSession as lent to one mode. Reads from
+#       the session's frame source; close() gives it back to the session.
+# Inputs: CameraSession session
+class SessionFrameSource(object):
+	def __init__(self, session):
+		self.session = session
+		self.frame_source = session.frame_source
+		self.is_live = self.frame_source.is_live
+		self.calibration = self.frame_source.calibration
+
+	def open(self):
+		pass
+
+	def read(self, timer=NULL_TIMER):
+		return self.frame_source.read(timer=timer)
+
+	def print_information(self):
+		self.frame_source.print_information()
+
+	def close(self):
+		self.session.release(self)
+
+
+# Desc: Save a session in the format read by FileFrameSource.
+#       images is a N x H x W x C uint8 array (or list of images)
+#       point_clouds is a N x H x W x 3 (or 4) float32 array (or list)
+#       calibration is the CameraCalibration of the left camera
+# Inputs: str path, images, point_clouds, CameraCalibration calibration
+# Outputs:
+def write_recording(path, images, point_clouds, calibration):
+	if not os.path.isdir(path):
+		os.makedirs(path)
+	np.save(os.path.join(path, 'left.npy'), np.asarray(images, dtype=np.uint8))
+	np.save(os.path.join(path, 'xyz.npy'), np.asarray(point_clouds, dtype=np.float32))
+	np.savez(os.path.join(path, 'calibration.npz'), fx=calibration.fx, fy=calibration.fy,
+	         cx=calibration.cx, cy=calibration.cy)
+
@@ -0,0 +1,133 @@
+##############################################
+# Automatic HSV filter calibration for the tennis ball detection module.
+#
+# Instead of stepping every HSV bound by 1 per keypress, the HSV tuning mode
+# (adjust_hsv_filter in ball_tracker_final.py) can gather ball pixels over
+# several frames, either from circles confirmed by the detection ('a') or
+# from a region selected by the user ('o'), and set the filter from them:
+#   bounds       per channel percentiles of the sampled pixels, widened by a
+#                margin (the extreme pixels are glare, shadow and edge blur)
+#   erosions     the fewest erosions after which eroding more removes no
+#                more spurious regions (outside the ball) on the last few
+#                sampled frames: speckle goes, but regions of the ball color
+#                that erosion can not remove do not add erosions
+#   dilations    one more than the erosions, so the ball grows back to its
+#                size and its holes are closed (as the defaults, 2 and 3)
+# Only the disk inside the sampled circle (shrunk by shrink) is used, so the
+# edge pixels blended with the background are left out.
+##############################################
+
+import collections
+import cv2
+import numpy as np
+
+HSV_MAXIMUM = (179, 255, 255)
+
+
+# Desc: HSV pixels of an image inside a circle
+#       shrink is the share of the radius that is sampled
+# Inputs: cv2 frame image (BGR or BGRA), (x, y, radius) circle, float shrink
+# Outputs: N x 3 uint8 array of HSV pixels
+def circle_pixels(image, circle, shrink=.8):
+	x, y, radius = circle
+	radius = radius * shrink
+	height, width = image.shape[:2]
+	x1, x2 = max(int(x - radius), 0), min(int(x + radius) + 1, width)
+	y1, y2 = max(int(y - radius), 0), min(int(y + radius) + 1, height)
+	if x2 <= x1 or y2 <= y1:
+		return np.empty((0, 3), dtype=np.uint8)
+	crop = image[y1:y2, x1:x2]
+	hsv = cv2.cvtColor(np.ascontiguousarray(crop[:, :, :3]), cv2.COLOR_BGR2HSV)
+	dy, dx = np.ogrid[y1 - y:y2 - y, x1 - x:x2 - x]
+	return hsv[dx * dx + dy * dy <= radius * radius]
+
+
+# Desc: Gathers ball pixels over several frames and computes the HSV filter
+#       from them.
+#       max_pixels is how many pixels are kept per sample (evenly spaced), so
+#           close balls do not outweigh far ones
+#       max_frames is how many of the last sampled frames are kept to choose
+#           the morphology (a full frame each, so a long tuning session does
+#           not keep every one of them)
+# Inputs: int max_pixels, int max_frames
+class HSVSampler(object):
+	def __init__(self, max_pixels=2000, max_frames=10):
+		self.max_pixels = max_pixels
+		self.max_frames = max_frames
+		self.samples = []
+		# (image, circle) of the last sampled frames, to choose the morphology
+		self.frames = collections.deque(maxlen=max_frames)
+
+	def __len__(self):
+		return len(self.samples)
+
+	# Desc: Sample the ball pixels inside a circle of an image
+	# Inputs: cv2 frame image, (x, y, radius) circle
+	# Outputs: int number of pixels sampled
+	def add_circle(self, image, circle, shrink=.8):
+		pixels = circle_pixels(image, circle, shrink)
+		if len(pixels) == 0:
+			return 0
+		step = max(len(pixels) // self.max_pixels, 1)
+		self.samples.append(pixels[::step])
+		self.frames.append((image[:, :, :3].copy(), circle))
+		return len(self.samples[-1])
+
+	# Desc: Forget every sample
+	# Inputs:
+	# Outputs:
+	def clear(self):
+		self.samples = []
+		self.frames.clear()
+
+	# Desc: HSV bounds from the percentiles of the samples
+	#       percentiles is the (low, high) percentile of each channel
+	#       margin is how much the bounds are widened for each channel
+	# Inputs: (float, float) percentiles, int[3] margin
+	# Outputs: numpy int[3] hsv_lower, numpy int[3] hsv_upper (None, None without samples)
+	def bounds(self, percentiles=(2, 98), margin=(3, 20, 20)):
+		if not self.samples:
+			return None, None
+		pixels = np.concatenate(self.samples)
+		low, high = np.percentile(pixels, percentiles, axis=0)
+		hsv_lower = np.clip(np.floor(low) - margin, 0, HSV_MAXIMUM).astype(int)
+		hsv_upper = np.clip(np.ceil(high) + margin, 0, HSV_MAXIMUM).astype(int)
+		return hsv_lower, hsv_upper
+
+	# Desc: Number of erosions and dilations for an HSV filter: the fewest
+	#       erosions (up to max_erosions, and while every ball keeps some pixels)
+	#       that leave as few spurious regions outside the balls of the last
+	#       max_frames sampled frames as any number of erosions does, and one
+	#       more dilation.
+	# Inputs: int[3] hsv_lower, int[3] hsv_upper, int max_erosions
+	# Outputs: int num_erosions, int num_dilations (None, None without samples)
+	def morphology(self, hsv_lower, hsv_upper, max_erosions=4):
+		if not self.frames:
+			return None, None
+		masks = []
+		outside = []
+		for image, (x, y, radius) in self.frames:
+			masks.append(cv2.inRange(cv2.cvtColor(image, cv2.COLOR_BGR2HSV), np.array(hsv_lower),
+			                         np.array(hsv_upper)))
+			# a bit larger than the ball, so its blurred edge is not counted as spurious
+			outside_ball = np.full(masks[-1].shape, 255, dtype=np.uint8)
+			cv2.circle(outside_ball, (int(x), int(y)), int(radius * 1.2) + 1, 0, -1)
+			outside.append(outside_ball)
+
+		spurious = []
+		for erosions in range(max_erosions + 1):
+			regions = 0
+			for mask, outside_ball in zip(masks, outside):
+				eroded = cv2.erode(mask, None, iterations=erosions)
+				if np.count_nonzero(cv2.bitwise_and(eroded, cv2.bitwise_not(outside_ball))) == 0:
+					# eroding this much removes a ball
+					regions = None
+					break
+				regions += cv2.connectedComponents(cv2.bitwise_and(eroded, outside_ball))[0] - 1
+			if regions is None:
+				break
+			spurious.append(regions)
+		if not spurious:
+			return 0, 1
+		num_erosions = spurious.index(min(spurious))
+		return num_erosions, num_erosions + 1
@@ -0,0 +1,91 @@
+##############################################
+# Lookup-table color classifier for the tennis ball detection module.
+#
+# Instead of converting every frame from BGR to HSV and calling
+# cv2.inRange, every BGR color (quantized to a number of bits per channel)
+# is converted to HSV once and classified against the HSV bounds into a
+# table. A frame is then segmented with a single table lookup per pixel.
+#
+# The HSV value of every table entry is kept, so when a single bound
+# changes (adjust_hsv_filter) only that channel is re-tested.
+##############################################
+
+import cv2
+import numpy as np
+
+
+# Desc: BGR to mask lookup table for the HSV bounds.
+#       hsv_lower is an array with 3 indices (Hue, Saturation, Value/Brightness)
+#       hsv_upper is an array with 3 indices (Hue, Saturation, Value/Brightness)
+#       bits is how many of the most significant bits of each B, G, R value are
+#           used (6 bits per channel = 262144 table entries)
+# Inputs: int[3] hsv_lower, int[3] hsv_upper, int bits
+class HSVLookupTable(object):
+	def __init__(self, hsv_lower, hsv_upper, bits=6):
+		self.bits = bits
+		self.shift = 8 - bits
+		levels = 1 << bits
+
+		# HSV of the center of every quantized BGR cell, in index order b, g, r
+		centers = (np.arange(levels, dtype=np.uint16) << self.shift) + ((1 << self.shift) >> 1)
+		b, g, r = np.meshgrid(centers, centers, centers, indexing='ij')
+		bgr = np.dstack([b.ravel(), g.ravel(), r.ravel()]).astype(np.uint8)
+		self.hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV).reshape(-1, 3)
+
+		self.hsv_lower = np.zeros(3, dtype=np.int32)
+		self.hsv_upper = np.zeros(3, dtype=np.int32)
+		self.channel_in_range = [None, None, None]
+		self.table = None
+		self.set_bounds(hsv_lower, hsv_upper)
+
+	# Desc: Set both HSV bounds, re-testing only the channels that changed
+	# Inputs: int[3] hsv_lower, int[3] hsv_upper
+	# Outputs:
+	def set_bounds(self, hsv_lower, hsv_upper):
+		changed = False
+		for channel in range(3):
+			if (self.channel_in_range[channel] is None or
+					self.hsv_lower[channel] != hsv_lower[channel] or
+					self.hsv_upper[channel] != hsv_upper[channel]):
+				self.hsv_lower[channel] = hsv_lower[channel]
+				self.hsv_upper[channel] = hsv_upper[channel]
+				self._test_channel(channel)
+				changed = True
+		if changed:
+			self._combine()
+
+	# Desc: Change a single bound and update the table
+	#       low_or_high is 0 for the lower bound and 1 for the upper bound
+	#       channel is 0 for hue, 1 for saturation and 2 for value/brightness
+	# Inputs: int low_or_high, int channel, int value
+	# Outputs:
+	def set_bound(self, low_or_high, channel, value):
+		bounds = self.hsv_upper if low_or_high else self.hsv_lower
+		if bounds[channel] == value:
+			return
+		bounds[channel] = value
+		self._test_channel(channel)
+		self._combine()
+
+	def _test_channel(self, channel):
+		values = self.hsv[:, channel]
+		self.channel_in_range[channel] = (values >= self.hsv_lower[channel]) & (values <= self.hsv_upper[channel])
+
+	def _combine(self):
+		in_range = self.channel_in_range[0] & self.channel_in_range[1] & self.channel_in_range[2]
+		# replace the whole table at once so detection threads never see a half built table
+		self.table = in_range.astype(np.uint8) * 255
+
+	# Desc: Segment a BGR (or BGRA) image: 255 where the color is inside the HSV
+	#       bounds, 0 elsewhere, same as cv2.inRange on the HSV image.
+	# Inputs: cv2 image, numpy array dst (optional H x W uint8 output)
+	# Outputs: numpy array mask
+	def apply(self, image, dst=None):
+		table = self.table
+		shift = self.shift
+		index = np.right_shift(image[..., 0], shift).astype(np.uint32)
+		index <<= self.bits
+		index |= image[..., 1] >> shift
+		index <<= self.bits
+		index |= image[..., 2] >> shift
+		return np.take(table, index, out=dst, mode='clip')
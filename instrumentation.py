@@ -0,0 +1,148 @@
+##############################################
+# Per-stage timing for the tennis ball detection module.
+#
+# The detection code passes a timer through every stage:
+#     t = timer.clock()
+#     hsv = cv2.cvtColor(...)
+#     t = timer.record('cvtColor', t)
+# record() stores how long the stage took and returns the current time, so
+# the next stage starts timing from there. NULL_TIMER does nothing and is
+# used when timing is turned off, so the cost of the instrumentation is a
+# couple of empty method calls per stage.
+#
+# A StageTimer keeps a rolling window of the last durations of every stage
+# (p50/p95/p99 over the window), can draw an FPS/latency overlay on the
+# displayed frame and can dump a trace of every recorded stage to a CSV or
+# JSON file.
+##############################################
+
+import collections
+import csv
+import json
+import time
+import cv2
+import numpy as np
+
+
+# Desc: Records the duration (seconds) of every stage.
+#       window is how many of the last durations of each stage are kept for the
+#           percentiles (None keeps all of them)
+#       trace keeps every (frame, stage, start, duration) for dump()
+#
+#       The timer can be shared by the capture and detection threads.
+# Inputs: int window, bool trace
+class StageTimer(object):
+	def __init__(self, window=300, trace=False):
+		self.window = window
+		self.durations = collections.OrderedDict()
+		self.frame_times = collections.deque(maxlen=window or 300)
+		self.frame_count = 0
+		self.trace = [] if trace else None
+		self.start_time = time.perf_counter()
+
+	# Desc: Current time in seconds
+	# Inputs:
+	# Outputs: float
+	def clock(self):
+		return time.perf_counter()
+
+	# Desc: Record a stage that started at start and ended now
+	# Inputs: str stage, float start (from clock())
+	# Outputs: float now
+	def record(self, stage, start):
+		now = time.perf_counter()
+		self.add(stage, now - start, start)
+		return now
+
+	# Desc: Record a duration measured somewhere else (e.g. capture to display latency)
+	# Inputs: str stage, float seconds, float start
+	# Outputs:
+	def add(self, stage, seconds, start=None):
+		durations = self.durations.get(stage)
+		if durations is None:
+			durations = self.durations.setdefault(stage, collections.deque(maxlen=self.window))
+		durations.append(seconds)
+		if self.trace is not None:
+			if start is None:
+				start = time.perf_counter() - seconds
+			self.trace.append((self.frame_count, stage, start - self.start_time, seconds))
+
+	# Desc: Mark the end of a displayed frame, for the FPS
+	# Inputs:
+	# Outputs:
+	def end_frame(self):
+		self.frame_times.append(time.perf_counter())
+		self.frame_count += 1
+
+	# Desc: Frames per second over the rolling window
+	# Inputs:
+	# Outputs: float
+	def fps(self):
+		if len(self.frame_times) < 2:
+			return 0.0
+		return (len(self.frame_times) - 1) / (self.frame_times[-1] - self.frame_times[0])
+
+	# Desc: Percentiles of the duration of every stage in milliseconds
+	# Inputs: list percentiles
+	# Outputs: OrderedDict stage -> list of milliseconds (one per percentile)
+	def percentiles(self, percentiles=(50, 95, 99)):
+		result = collections.OrderedDict()
+		for stage, durations in list(self.durations.items()):
+			if durations:
+				result[stage] = [float(value) for value in np.percentile(1000 * np.array(durations), percentiles)]
+		return result
+
+	# Desc: Draw the FPS and the p50/p95/p99 of every stage on the frame
+	# Inputs: cv2 frame
+	# Outputs:
+	def draw_overlay(self, cv_frame):
+		lines = ["FPS: {0:.1f}".format(self.fps())]
+		for stage, (p50, p95, p99) in self.percentiles().items():
+			lines.append("{0}: {1:.1f} / {2:.1f} / {3:.1f} ms".format(stage, p50, p95, p99))
+		for i, line in enumerate(lines):
+			position = (10, 20 + 18 * i)
+			cv2.putText(cv_frame, line, position, cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 3)
+			cv2.putText(cv_frame, line, position, cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+
+	# Desc: Print the FPS and the p50/p95/p99 of every stage
+	# Inputs:
+	# Outputs:
+	def print_summary(self):
+		print("Frame rate: {0:.1f} FPS".format(self.fps()))
+		print("{0:>18} {1:>8} {2:>8} {3:>8}".format("stage (ms)", "p50", "p95", "p99"))
+		for stage, (p50, p95, p99) in self.percentiles().items():
+			print("{0:>18} {1:>8.2f} {2:>8.2f} {3:>8.2f}".format(stage, p50, p95, p99))
+
+	# Desc: Write the trace to a .csv file (frame, stage, start_ms, duration_ms
+	#       rows) or a .json file (the trace rows and the percentiles)
+	# Inputs: str path
+	# Outputs:
+	def dump(self, path):
+		rows = [(frame, stage, 1000 * start, 1000 * duration) for frame, stage, start, duration in self.trace or []]
+		if path.endswith(".json"):
+			with open(path, "w") as trace_file:
+				json.dump({"fps": self.fps(), "percentiles_ms": self.percentiles(),
+				           "trace": [{"frame": frame, "stage": stage, "start_ms": start, "duration_ms": duration}
+				                     for frame, stage, start, duration in rows]}, trace_file)
+		else:
+			with open(path, "w") as trace_file:
+				writer = csv.writer(trace_file)
+				writer.writerow(["frame", "stage", "start_ms", "duration_ms"])
+				writer.writerows(rows)
+
+
+# Desc: Timer that records nothing, for when timing is turned off
+class NullTimer(object):
+	def clock(self):
+		return 0.0
+
+	def record(self, stage, start):
+		return 0.0
+
+	def add(self, stage, seconds, start=None):
+		pass
+
+	def end_frame(self):
+		pass
+
+NULL_TIMER = NullTimer()
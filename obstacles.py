@@ -0,0 +1,223 @@
+##############################################
+# Obstacle detection from the ZED point cloud (SRS 5.3).
+#
+# Runs on the same point cloud as the tennis ball detection, every frame
+# (ball_tracker_final.py --obstacles):
+#   subsample    every step-th pixel in both directions, only finite points
+#                closer than max_range
+#   ground       plane fitted with RANSAC: all the hypotheses are drawn and
+#                scored at once (one matrix product of the points with the
+#                plane normals), the plane of the previous frame is one more
+#                hypothesis, and the best one is refined with a least squares
+#                fit of its inliers. Planes tilted more than max_tilt from the
+#                camera's down direction are rejected (walls, rocks).
+#   flags        points higher than obstacle_height above the ground are
+#                obstacles (too large to drive over), points lower than
+#                cliff_depth below it are cliffs (a drop the camera sees past)
+#   histogram    the flagged points are binned by azimuth into num_sectors
+#                sectors over the field of view: for every sector the number
+#                of points and the horizontal distance (mm) to the nearest one
+# The ZED camera frame is used throughout: x right, y down, z forward, mm.
+#
+# USAGE
+# python ball_tracker_final.py --obstacles      draw the obstacles while detecting the ball
+##############################################
+
+import collections
+import math
+import cv2
+import numpy as np
+
+# Desc: Obstacles of one frame
+#       plane is (normal, offset), the height of a point p above the ground being
+#           normal.dot(p) + offset (None if no ground was found)
+#       ground_fraction is the share of the sampled points on the ground
+#       sector_edges are the num_sectors + 1 azimuth edges (radians) of the sectors
+#       obstacle_count, cliff_count are the flagged points in every sector
+#       obstacle_distance, cliff_distance are the horizontal distances (mm) to the
+#           nearest flagged point in every sector (inf if fewer than min_points)
+#       points are the flagged points (N x 3, camera frame), pixels their (x, y)
+#           pixels and labels their label (OBSTACLE or CLIFF)
+#       ground_points are the sampled points on the ground (camera frame), for
+#           the free space of an OccupancyGrid (see occupancy.py)
+ObstacleMap = collections.namedtuple('ObstacleMap', ['plane', 'ground_fraction', 'sector_edges',
+                                                     'obstacle_count', 'obstacle_distance', 'cliff_count',
+                                                     'cliff_distance', 'points', 'pixels', 'labels',
+                                                     'ground_points'])
+
+OBSTACLE = 1
+CLIFF = 2
+
+
+# Desc: Finds the ground plane and the obstacles and cliffs in point clouds
+#       (see top of file).
+#       calibration is the CameraCalibration, for the field of view
+#       step is the subsampling step in pixels
+#       iterations is the number of RANSAC hypotheses
+#       inlier_threshold is how far (mm) from the plane a ground point can be
+#       max_tilt is how far (degrees) the ground normal can be from the camera's up
+#       obstacle_height and cliff_depth are in mm above and below the ground
+#       max_range is the farthest (mm) a point is used (the depth gets noisy)
+#       num_sectors is the number of azimuth sectors of the histogram
+#       min_points is how many flagged points a sector needs to have a distance
+#       score_points is how many of the sampled points score the hypotheses
+# Inputs: CameraCalibration calibration, int step, int iterations, float inlier_threshold,
+#         float max_tilt, float obstacle_height, float cliff_depth, float max_range, int num_sectors,
+#         int min_points, int score_points, int seed
+class ObstacleDetector(object):
+	def __init__(self, calibration, step=8, iterations=32, inlier_threshold=40.0, max_tilt=30.0,
+	             obstacle_height=150.0, cliff_depth=200.0, max_range=8000.0, num_sectors=32, min_points=3,
+	             score_points=2000, seed=0):
+		self.step = step
+		self.iterations = iterations
+		self.inlier_threshold = inlier_threshold
+		self.min_up = math.cos(math.radians(max_tilt))
+		self.obstacle_height = obstacle_height
+		self.cliff_depth = cliff_depth
+		self.max_range = max_range
+		self.num_sectors = num_sectors
+		self.min_points = min_points
+		self.score_points = score_points
+		self.random = np.random.RandomState(seed)
+		half_fov = math.atan(max(calibration.cx, calibration.width - calibration.cx) / calibration.fx)
+		self.sector_edges = np.linspace(-half_fov, half_fov, num_sectors + 1)
+		self.sector_scale = num_sectors / (2 * half_fov)
+		self.half_fov = half_fov
+		self.plane = None
+		self.grid = None
+
+	# Desc: Forget the ground plane of the previous frame
+	# Inputs:
+	# Outputs:
+	def reset(self):
+		self.plane = None
+
+	# Desc: Obstacles and cliffs of a point cloud
+	# Inputs: ZED point cloud (H x W x 3 or 4)
+	# Outputs: ObstacleMap
+	def detect(self, point_cloud):
+		points, pixels = self._subsample(point_cloud)
+		# the points are in row order, so the lower half of the image is at the end
+		plane, ground_fraction = self._fit_ground(points, int(np.searchsorted(pixels[:, 1],
+		                                                                      point_cloud.shape[0] // 2)))
+		self.plane = plane
+		if plane is None:
+			empty = np.zeros(self.num_sectors, dtype=np.int64)
+			no_distance = np.full(self.num_sectors, np.inf, dtype=np.float32)
+			no_points = np.empty((0, 3), dtype=np.float32)
+			return ObstacleMap(plane=None, ground_fraction=0.0, sector_edges=self.sector_edges,
+			                   obstacle_count=empty, obstacle_distance=no_distance, cliff_count=empty.copy(),
+			                   cliff_distance=no_distance.copy(), points=no_points,
+			                   pixels=np.empty((0, 2), dtype=np.int64), labels=np.empty(0, dtype=np.uint8),
+			                   ground_points=no_points)
+
+		normal, offset = plane
+		height = points.dot(normal) + np.float32(offset)
+		labels = np.zeros(len(points), dtype=np.uint8)
+		labels[height > self.obstacle_height] = OBSTACLE
+		labels[height < -self.cliff_depth] = CLIFF
+		flagged = labels > 0
+		ground_points = points[np.abs(height) < self.inlier_threshold]
+		points = points[flagged]
+		labels = labels[flagged]
+
+		azimuth = np.arctan2(points[:, 0], points[:, 2])
+		distance = np.hypot(points[:, 0], points[:, 2])
+		sector = np.clip(((azimuth + self.half_fov) * self.sector_scale).astype(np.int64), 0, self.num_sectors - 1)
+		obstacle_count, obstacle_distance = self._histogram(sector, distance, labels == OBSTACLE)
+		cliff_count, cliff_distance = self._histogram(sector, distance, labels == CLIFF)
+		return ObstacleMap(plane=plane, ground_fraction=ground_fraction, sector_edges=self.sector_edges,
+		                   obstacle_count=obstacle_count, obstacle_distance=obstacle_distance,
+		                   cliff_count=cliff_count, cliff_distance=cliff_distance, points=points,
+		                   pixels=pixels[flagged], labels=labels, ground_points=ground_points)
+
+	# Desc: Every step-th point of the point cloud that is finite and in range
+	# Inputs: ZED point cloud
+	# Outputs: N x 3 float32 points, N x 2 int64 pixels (x, y)
+	def _subsample(self, point_cloud):
+		height, width = point_cloud.shape[:2]
+		if self.grid is None or self.grid[0] != (height, width):
+			grid_y, grid_x = np.mgrid[self.step // 2:height:self.step, self.step // 2:width:self.step]
+			self.grid = ((height, width), np.stack([grid_x.ravel(), grid_y.ravel()], axis=1))
+		pixels = self.grid[1]
+		points = point_cloud[self.step // 2::self.step, self.step // 2::self.step]
+		points = points.reshape(-1, points.shape[2])
+		# NaN and inf compare False, so they are dropped here too (the ZED
+		# point cloud has x and y NaN exactly where z is)
+		depth = points[:, 2]
+		keep = (depth > 0) & (depth < self.max_range)
+		return np.ascontiguousarray(points[keep, :3], dtype=np.float32), pixels[keep]
+
+	# Desc: RANSAC ground plane (see top of file). The hypotheses are drawn from
+	#       the points from first_sample on (the lower part of the image, where
+	#       the ground is).
+	# Inputs: N x 3 float32 points, int first_sample
+	# Outputs: (float[3] normal, float offset) or None, float share of the points on the plane
+	def _fit_ground(self, points, first_sample=0):
+		if len(points) < 3:
+			return None, 0.0
+		if len(points) - first_sample < 3:
+			first_sample = 0
+		samples = points[self.random.randint(first_sample, len(points), size=(self.iterations, 3))]
+		normals = np.cross(samples[:, 1] - samples[:, 0], samples[:, 2] - samples[:, 0])
+		lengths = np.sqrt((normals * normals).sum(axis=1))
+		valid = lengths > 1e-6
+		normals[valid] /= lengths[valid, None]
+		# the normal points up, which is -y in the camera frame
+		normals[normals[:, 1] > 0] *= -1
+		valid &= -normals[:, 1] >= self.min_up
+		normals = normals[valid]
+		offsets = -(normals * samples[valid, 0]).sum(axis=1)
+		if self.plane is not None:
+			normals = np.vstack([normals, self.plane[0][None, :]])
+			offsets = np.append(offsets, self.plane[1])
+		if len(normals) == 0:
+			return None, 0.0
+
+		scoring = np.ascontiguousarray(points[::max(len(points) // self.score_points, 1)])
+		residuals = np.abs(scoring.dot(normals.T.astype(np.float32)) + offsets.astype(np.float32))
+		best = int(np.argmax((residuals < self.inlier_threshold).sum(axis=0)))
+
+		# least squares refinement: the normal is the direction of least variance of the inliers
+		inliers = points[np.abs(points.dot(normals[best].astype(np.float32)) + np.float32(offsets[best])) <
+		                 self.inlier_threshold]
+		if len(inliers) < 3:
+			return None, 0.0
+		center = inliers.mean(axis=0)
+		centered = inliers - center
+		normal = np.linalg.eigh(centered.T.dot(centered).astype(np.float64))[1][:, 0]
+		if normal[1] > 0:
+			normal = -normal
+		if -normal[1] < self.min_up:
+			normal = normals[best].astype(np.float64)
+		# float32 like the points, so the products below do not convert them
+		normal = normal.astype(np.float32)
+		offset = -float(normal.dot(center))
+		ground = np.count_nonzero(np.abs(points.dot(normal) + np.float32(offset)) < self.inlier_threshold)
+		return (normal, offset), ground / float(len(points))
+
+	def _histogram(self, sector, distance, selected):
+		count = np.bincount(sector[selected], minlength=self.num_sectors)
+		nearest = np.full(self.num_sectors, np.inf, dtype=np.float32)
+		np.minimum.at(nearest, sector[selected], distance[selected])
+		nearest[count < self.min_points] = np.inf
+		return count, nearest
+
+
+# Desc: Draw the flagged points (obstacles red, cliffs magenta) and the polar
+#       histogram as a bar along the bottom of the frame, one segment per sector
+#       colored from red (near) to green (clear or farther than far)
+# Inputs: cv2 frame image, ObstacleMap obstacle_map, CameraCalibration calibration, float far
+# Outputs:
+def draw_obstacles(image, obstacle_map, calibration, far=4000.0):
+	height, width = image.shape[:2]
+	for label, color in ((OBSTACLE, (0, 0, 255)), (CLIFF, (255, 0, 255))):
+		pixels = obstacle_map.pixels[obstacle_map.labels == label]
+		image[pixels[:, 1], pixels[:, 0], :3] = color
+	nearest = np.minimum(obstacle_map.obstacle_distance, obstacle_map.cliff_distance)
+	# sector edges in pixels: x = cx + fx * tan(azimuth)
+	edges = np.clip(calibration.cx + calibration.fx * np.tan(obstacle_map.sector_edges), 0, width - 1).astype(int)
+	for sector, distance in enumerate(nearest):
+		clear = min(distance / far, 1.0)
+		cv2.rectangle(image, (int(edges[sector]), height - 8), (int(edges[sector + 1]), height - 1),
+		              (0, int(255 * clear), int(255 * (1 - clear))), -1)
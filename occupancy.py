@@ -0,0 +1,494 @@
+##############################################
+# Rolling occupancy grid and route planner (SRS 5.2 and 5.4).
+#
+# OccupancyGrid is a fixed size square of cells around the rover, in world
+# coordinates (mm, x and y on the ground, the heading counterclockwise from
+# the x axis). Every cell holds the log odds of being occupied: the ground
+# points of an ObstacleMap (see obstacles.py) lower it, the obstacle and
+# cliff points raise it, once per cell and update, clamped to +-limit.
+# The array is never reallocated: a world cell (ix, iy) always lives at
+# array index (iy mod size, ix mod size), so when the rover gets further
+# than recenter * size cells from the center, the grid scrolls by moving
+# its origin and clearing only the rows and columns that enter it.
+#
+# GridPlanner finds the shortest 8-connected route on the grid with
+# D* Lite: the costs of the last plan are kept, and when the moves allowed
+# out of cells change only the costs that depend on them are repaired, so
+# replanning after a few changed cells or a few cells of rover motion is
+# much cheaper than a new search. Unknown cells are free. The clearance of
+# a cell is its distance to the nearest occupied cell; cells closer than
+# the rover's inflation radius are blocked. Occupied cells can never be
+# entered, and a blocked cell only from a cell with no more clearance, so a
+# rover inside the inflation of an obstacle can still back away from it
+# but no route goes into it. A goal outside the grid is reached through
+# the edge of the grid, each edge cell costing its straight line distance
+# to the goal. A scroll of the grid or a new goal starts a new search.
+# plan_astar is the one-shot A* search over the same costs.
+#
+# USAGE
+# python benchmarks.py occupancy --sizes 100 200 400    update and replan times
+##############################################
+
+import heapq
+import math
+import cv2
+import numpy as np
+
+SQRT2 = math.sqrt(2)
+INF = float('inf')
+# (row offset, column offset, cost) of the 8 neighbors of a cell
+NEIGHBORS = ((-1, -1, SQRT2), (-1, 0, 1.0), (-1, 1, SQRT2), (0, -1, 1.0), (0, 1, 1.0), (1, -1, SQRT2),
+             (1, 0, 1.0), (1, 1, SQRT2))
+
+
+# Desc: Occupancy grid around the rover (see top of file)
+#       size is the number of cells along each side
+#       resolution is the side of a cell in mm
+#       hit and miss are the log odds added for an obstacle and a ground observation
+#       limit clamps the log odds, so a cell can change its state quickly
+#       threshold is the log odds above which a cell is occupied
+#       recenter is how far (share of size) the rover can get from the center
+#           before the grid scrolls
+# Inputs: int size, float resolution, float hit, float miss, float limit, float threshold, float recenter
+class OccupancyGrid(object):
+	def __init__(self, size=200, resolution=50.0, hit=.85, miss=-.4, limit=3.5, threshold=.5, recenter=.25):
+		self.size = size
+		self.resolution = resolution
+		self.hit = hit
+		self.miss = miss
+		self.limit = limit
+		self.threshold = threshold
+		self.recenter = int(recenter * size)
+		self.log_odds = np.zeros((size, size), dtype=np.float32)
+		# world cell (ix, iy) of local cell (0, 0), the rover starts at the center
+		self.origin = (-(size // 2), -(size // 2))
+		self.scrolls = 0
+
+	# Desc: World cell of a world position
+	# Inputs: float x, float y
+	# Outputs: int ix, int iy
+	def cell(self, x, y):
+		return int(math.floor(x / self.resolution)), int(math.floor(y / self.resolution))
+
+	# Desc: Scroll the grid if the rover is too far from its center
+	# Inputs: float x, float y (rover position in mm)
+	# Outputs: bool True if the grid scrolled
+	def move_to(self, x, y):
+		ix, iy = self.cell(x, y)
+		half = self.size // 2
+		if abs(ix - self.origin[0] - half) <= self.recenter and abs(iy - self.origin[1] - half) <= self.recenter:
+			return False
+		self.scroll((ix - half, iy - half))
+		return True
+
+	# Desc: Move the origin, clearing the rows and columns that enter the grid
+	# Inputs: (int, int) origin (world cell of local cell (0, 0))
+	# Outputs:
+	def scroll(self, origin):
+		for axis, old, new in ((1, self.origin[0], origin[0]), (0, self.origin[1], origin[1])):
+			if new > old:
+				entering = np.arange(max(old + self.size, new), new + self.size)
+			else:
+				entering = np.arange(new, min(old, new + self.size))
+			if axis == 0:
+				self.log_odds[entering % self.size, :] = 0
+			else:
+				self.log_odds[:, entering % self.size] = 0
+		self.origin = (int(origin[0]), int(origin[1]))
+		self.scrolls += 1
+
+	# Desc: Add one observation to every cell that holds some of the points;
+	#       points outside the grid are ignored
+	# Inputs: N x 2 array of world (x, y) mm, float value (log odds, e.g. hit or miss)
+	# Outputs: int number of cells updated
+	def add_points(self, points, value):
+		if len(points) == 0:
+			return 0
+		ix = np.floor(points[:, 0] / self.resolution).astype(np.int64) - self.origin[0]
+		iy = np.floor(points[:, 1] / self.resolution).astype(np.int64) - self.origin[1]
+		inside = (ix >= 0) & (ix < self.size) & (iy >= 0) & (iy < self.size)
+		cells = np.unique(((iy[inside] + self.origin[1]) % self.size) * self.size +
+		                  (ix[inside] + self.origin[0]) % self.size)
+		flat = self.log_odds.reshape(-1)
+		flat[cells] = np.clip(flat[cells] + value, -self.limit, self.limit)
+		return len(cells)
+
+	# Desc: Add the ground, obstacle and cliff points of an ObstacleMap seen from
+	#       a rover pose. The points are projected onto the ground plane of the
+	#       map, so the camera pitch does not matter.
+	# Inputs: (float x, float y, float heading) pose, ObstacleMap obstacle_map
+	# Outputs:
+	def update(self, pose, obstacle_map):
+		if obstacle_map.plane is None:
+			return
+		self.move_to(pose[0], pose[1])
+		up = np.asarray(obstacle_map.plane[0], dtype=np.float64)
+		forward = np.array([0.0, 0.0, 1.0]) - up[2] * up
+		forward /= np.linalg.norm(forward)
+		right = np.cross(forward, up)
+		# heading is counterclockwise, so the rover's right is the heading minus 90 degrees
+		cos_heading, sin_heading = math.cos(pose[2]), math.sin(pose[2])
+		transform = np.outer(forward, [cos_heading, sin_heading]) + np.outer(right, [sin_heading, -cos_heading])
+		offset = np.array([pose[0], pose[1]])
+		self.add_points(obstacle_map.ground_points.dot(transform) + offset, self.miss)
+		self.add_points(obstacle_map.points.dot(transform) + offset, self.hit)
+
+	# Desc: Occupied cells, in array order (see local)
+	# Inputs:
+	# Outputs: size x size bool array
+	def occupied(self):
+		return self.log_odds > self.threshold
+
+	# Desc: An array in array order rolled to local order, row = iy - origin y,
+	#       column = ix - origin x (a copy)
+	# Inputs: size x size array
+	# Outputs: size x size array
+	def local(self, array):
+		return np.roll(array, (-(self.origin[1] % self.size), -(self.origin[0] % self.size)), axis=(0, 1))
+
+	# Desc: Local cell (row, column) of a world position (may be outside the grid)
+	# Inputs: float x, float y
+	# Outputs: int row, int column
+	def to_local(self, x, y):
+		ix, iy = self.cell(x, y)
+		return iy - self.origin[1], ix - self.origin[0]
+
+	# Desc: World position (mm) of the center of a local cell
+	# Inputs: int row, int column
+	# Outputs: float x, float y
+	def to_world(self, row, column):
+		return (column + self.origin[0] + .5) * self.resolution, (row + self.origin[1] + .5) * self.resolution
+
+
+# Desc: Octile distance (cells) between two local flat indices
+def _octile(a, b, size):
+	dr = abs(a // size - b // size)
+	dc = abs(a % size - b % size)
+	return dr + dc + (SQRT2 - 2) * min(dr, dc)
+
+
+# Desc: Cost (cells) of every local cell to the goal when it ends the route:
+#       0 for the goal cell, or if the goal is outside the grid, the straight
+#       line distance from every edge cell to it
+# Inputs: OccupancyGrid grid, (float, float) goal (mm)
+# Outputs: dict flat index -> cost
+def _goal_costs(grid, goal):
+	size = grid.size
+	row, column = grid.to_local(*goal)
+	if 0 <= row < size and 0 <= column < size:
+		return {row * size + column: 0.0}
+	goal_row = goal[1] / grid.resolution - grid.origin[1] - .5
+	goal_column = goal[0] / grid.resolution - grid.origin[0] - .5
+	costs = {}
+	for index in range(size):
+		for edge_row, edge_column in ((0, index), (size - 1, index), (index, 0), (index, size - 1)):
+			costs[edge_row * size + edge_column] = math.hypot(goal_row - edge_row, goal_column - edge_column)
+	return costs
+
+
+# Desc: Moves the route can make from every cell of a grid, in local order:
+#       bit k is set when it can go to the neighbor NEIGHBORS[k]. The clearance
+#       of a cell is its distance (cells) to the nearest occupied cell; the route
+#       never goes into an occupied cell or off the grid, and into a blocked cell
+#       (clearance radius or less) only if it does not get closer to the obstacle.
+#       A free cell can never go into a blocked one, so the blocked cells only
+#       have moves where the rover at start can get to them; elsewhere they keep
+#       no cost, which would otherwise be repaired whenever an obstacle grows.
+# Inputs: OccupancyGrid grid, int radius, int start (local flat index)
+# Outputs: size x size uint8 array
+def _moves(grid, radius, start):
+	size = grid.size
+	free = (~grid.local(grid.occupied())).view(np.uint8)
+	clearance = cv2.distanceTransform(free, cv2.DIST_L2, cv2.DIST_MASK_5)
+	# free cells with a border of blocked cells off the grid
+	clear = np.zeros((size + 2, size + 2), dtype=np.uint8)
+	clear[1:-1, 1:-1] = clearance > radius
+	moves = np.zeros((size, size), dtype=np.uint8)
+	for bit, (dr, dc, _) in enumerate(NEIGHBORS):
+		moves |= clear[1 + dr:1 + dr + size, 1 + dc:1 + dc + size] * np.uint8(1 << bit)
+	moves *= clear[1:-1, 1:-1]
+
+	# the blocked cells the rover can get to from start
+	clearance = clearance.reshape(-1)
+	flat_moves = moves.reshape(-1)
+	escape = [start] if clearance.item(start) <= radius else []
+	reached = set(escape)
+	while escape:
+		u = escape.pop()
+		clearance_u = clearance.item(u)
+		row, column = divmod(u, size)
+		moves_u = 0
+		for bit, (dr, dc, _) in enumerate(NEIGHBORS):
+			r = row + dr
+			c = column + dc
+			if 0 <= r < size and 0 <= c < size:
+				v = r * size + c
+				clearance_v = clearance.item(v)
+				if clearance_v > 0 and (clearance_v > radius or clearance_v >= clearance_u):
+					moves_u |= 1 << bit
+					if clearance_v <= radius and v not in reached:
+						reached.add(v)
+						escape.append(v)
+		flat_moves[u] = moves_u
+	return moves
+
+
+# Desc: Route from the flat index start down the costs g to a goal cell, as
+#       world positions of its turns
+def _follow(grid, start, g, goal_costs, moves):
+	size = grid.size
+	cells = [start]
+	u = start
+	for _ in range(size * size):
+		best = goal_costs.get(u, INF)
+		following = None
+		moves_u = moves[u]
+		for bit, (dr, dc, cost) in enumerate(NEIGHBORS):
+			if moves_u >> bit & 1:
+				v = u + dr * size + dc
+				if cost + g[v] < best:
+					best = cost + g[v]
+					following = v
+		if following is None:
+			break
+		u = following
+		cells.append(u)
+	return _turns(grid, cells)
+
+
+# Desc: World positions of the first, last and turning cells of a route
+# Inputs: OccupancyGrid grid, list of local flat indices cells
+# Outputs: list of (x, y)
+def _turns(grid, cells):
+	size = grid.size
+	waypoints = [grid.to_world(*divmod(cells[0], size))]
+	for previous, cell, following in zip(cells, cells[1:], cells[2:]):
+		if cell - previous != following - cell:
+			waypoints.append(grid.to_world(*divmod(cell, size)))
+	if len(cells) > 1:
+		waypoints.append(grid.to_world(*divmod(cells[-1], size)))
+	return waypoints
+
+
+# Desc: Incremental route planner on an OccupancyGrid (see top of file)
+#       inflation is the radius (mm) occupied cells are grown by, about half the
+#           width of the rover plus a margin
+# Inputs: OccupancyGrid grid, float inflation
+class GridPlanner(object):
+	def __init__(self, grid, inflation=300.0):
+		self.grid = grid
+		self.radius = int(math.ceil(inflation / grid.resolution))
+		self.origin = None
+		self.goal_cell = None
+		# cells expanded by the last plan and since the planner was made
+		self.expanded = 0
+		self.total_expanded = 0
+		self.searches = 0
+
+	# Desc: Start a new search: every cost is unknown and the goal cells are queued
+	def _reset(self, moves, goal):
+		size = self.grid.size
+		self.origin = self.grid.origin
+		self.goal_cell = self.grid.cell(*goal)
+		self.goal_costs = _goal_costs(self.grid, goal)
+		self.moves_array = moves
+		self.moves = moves.reshape(-1).tolist()
+		self.g = [INF] * (size * size)
+		self.rhs = [INF] * (size * size)
+		self.keys = [None] * (size * size)
+		self.queue = []
+		self.km = 0.0
+		self.last = self.start
+		for u, cost in self.goal_costs.items():
+			self.rhs[u] = cost
+			self._push(u)
+		self.searches += 1
+
+	def _key(self, u):
+		value = min(self.g[u], self.rhs[u])
+		# rounded, so the same sum added up in another order ties with the key of
+		# the start instead of stopping the search before a cell it must expand
+		return round(value + _octile(self.start, u, self.grid.size) + self.km, 9), value
+
+	def _push(self, u):
+		key = self._key(u)
+		self.keys[u] = key
+		heapq.heappush(self.queue, (key[0], key[1], u))
+
+	# Desc: Recompute the cost of u from its neighbors and queue it if it changed.
+	#       The cost of every cell, blocked or not, is its goal cost or the
+	#       cheapest of its moves (see _moves) plus the cost of that neighbor.
+	def _update(self, u):
+		size = self.grid.size
+		g = self.g
+		moves_u = self.moves[u]
+		rhs = self.goal_costs.get(u, INF)
+		for bit, (dr, dc, cost) in enumerate(NEIGHBORS):
+			if moves_u >> bit & 1:
+				v = u + dr * size + dc
+				if cost + g[v] < rhs:
+					rhs = cost + g[v]
+		self.rhs[u] = rhs
+		if self.g[u] != rhs:
+			self._push(u)
+		else:
+			self.keys[u] = None
+
+	def _update_neighbors(self, u):
+		size = self.grid.size
+		row, column = divmod(u, size)
+		for dr, dc, cost in NEIGHBORS:
+			r = row + dr
+			c = column + dc
+			if 0 <= r < size and 0 <= c < size:
+				self._update(r * size + c)
+
+	# Desc: The cost of u went down: the neighbors that can move into u can
+	#       only get cheaper through it
+	def _relax_neighbors(self, u):
+		size = self.grid.size
+		g_u = self.g[u]
+		rhs = self.rhs
+		g = self.g
+		moves = self.moves
+		row, column = divmod(u, size)
+		for bit, (dr, dc, cost) in enumerate(NEIGHBORS):
+			r = row - dr
+			c = column - dc
+			if 0 <= r < size and 0 <= c < size:
+				# the neighbor moves into u with the move bit
+				v = r * size + c
+				if cost + g_u < rhs[v] and moves[v] >> bit & 1:
+					rhs[v] = cost + g_u
+					if g[v] != rhs[v]:
+						self._push(v)
+					else:
+						self.keys[v] = None
+
+	def _compute(self):
+		start = self.start
+		queue = self.queue
+		expanded = 0
+		while queue:
+			k1, k2, u = queue[0]
+			if self.keys[u] != (k1, k2):
+				# outdated entry
+				heapq.heappop(queue)
+				continue
+			start_key = self._key(start)
+			if (k1, k2) >= start_key and self.rhs[start] == self.g[start]:
+				break
+			heapq.heappop(queue)
+			key = self._key(u)
+			if (k1, k2) < key:
+				self.keys[u] = key
+				heapq.heappush(queue, (key[0], key[1], u))
+				continue
+			self.keys[u] = None
+			expanded += 1
+			if self.g[u] > self.rhs[u]:
+				self.g[u] = self.rhs[u]
+				self._relax_neighbors(u)
+			else:
+				self.g[u] = INF
+				self._update(u)
+				self._update_neighbors(u)
+		self.expanded = expanded
+		self.total_expanded += expanded
+
+	# Desc: Route from start to goal on the current grid, repairing the last plan
+	#       where the moves changed
+	# Inputs: (float, float) start, (float, float) goal (world mm)
+	# Outputs: list of (x, y) world positions of the route's turns, from the
+	#          start to the goal (or to the edge of the grid towards it);
+	#          None if there is no route
+	def plan(self, start, goal):
+		size = self.grid.size
+		row, column = self.grid.to_local(*start)
+		if not (0 <= row < size and 0 <= column < size):
+			return None
+		self.start = row * size + column
+		moves = _moves(self.grid, self.radius, self.start)
+		if self.origin != self.grid.origin or self.goal_cell != self.grid.cell(*goal):
+			self._reset(moves, goal)
+		else:
+			if self.start != self.last:
+				self.km += _octile(self.last, self.start, size)
+				self.last = self.start
+			# the moves of a cell only change its own cost
+			changed = np.flatnonzero(moves != self.moves_array).tolist()
+			self.moves_array = moves
+			for u in changed:
+				self.moves[u] = int(moves.flat[u])
+				self._update(u)
+		self._compute()
+		if self.g[self.start] == INF:
+			return None
+		return _follow(self.grid, self.start, self.g, self.goal_costs, self.moves)
+
+
+# Desc: One-shot A* route on an OccupancyGrid, with the same costs as GridPlanner
+# Inputs: OccupancyGrid grid, (float, float) start, (float, float) goal, float inflation
+# Outputs: list of (x, y) world positions of the route's turns (None if there is no route),
+#          int cells expanded
+def plan_astar(grid, start, goal, inflation=300.0):
+	size = grid.size
+	row, column = grid.to_local(*start)
+	if not (0 <= row < size and 0 <= column < size):
+		return None, 0
+	radius = int(math.ceil(inflation / grid.resolution))
+	start = row * size + column
+	moves = _moves(grid, radius, start).reshape(-1).tolist()
+	goal_costs = _goal_costs(grid, goal)
+	# heuristic: octile distance to the goal cell, or straight line distance to
+	# a goal outside the grid (no route through an edge cell is shorter)
+	goal_row, goal_column = grid.to_local(*goal)
+	inside = 0 <= goal_row < size and 0 <= goal_column < size
+	goal_index = goal_row * size + goal_column
+	goal_row = goal[1] / grid.resolution - grid.origin[1] - .5
+	goal_column = goal[0] / grid.resolution - grid.origin[0] - .5
+
+	def heuristic(u):
+		if inside:
+			return _octile(u, goal_index, size)
+		r, c = divmod(u, size)
+		return math.hypot(goal_row - r, goal_column - c)
+
+	g = {start: 0.0}
+	parents = {start: None}
+	queue = [(heuristic(start), 0.0, start)]
+	closed = set()
+	expanded = 0
+	best_end = None
+	best_cost = INF
+	while queue:
+		f, cost_so_far, u = heapq.heappop(queue)
+		if u in closed or cost_so_far > g[u]:
+			continue
+		if f >= best_cost:
+			break
+		closed.add(u)
+		expanded += 1
+		if u in goal_costs and cost_so_far + goal_costs[u] < best_cost:
+			best_cost = cost_so_far + goal_costs[u]
+			best_end = u
+		moves_u = moves[u]
+		for bit, (dr, dc, step) in enumerate(NEIGHBORS):
+			if moves_u >> bit & 1:
+				v = u + dr * size + dc
+				if v in closed:
+					continue
+				cost = cost_so_far + step
+				if cost < g.get(v, INF):
+					g[v] = cost
+					parents[v] = u
+					heapq.heappush(queue, (cost + heuristic(v), cost, v))
+	if best_end is None:
+		return None, expanded
+	cells = []
+	u = best_end
+	while u is not None:
+		cells.append(u)
+		u = parents[u]
+	cells.reverse()
+	return _turns(grid, cells), expanded
@@ -0,0 +1,318 @@
+##############################################
+# Visual odometry and stall detection (SRS 5.5).
+#
+# A stall is drive commands being sent while the rover does not move. The
+# MotionEstimator measures the motion of the camera from each frame of the
+# detection loop (ball_tracker_final.py --odometry) to the next one it gets;
+# with the pipeline frames can be dropped in between:
+#   features     corners (cv2.goodFeaturesToTrack) of a grayscale image
+#                downscaled to width pixels, found again only when fewer
+#                than min_features are still tracked
+#   flow         pyramidal Lucas-Kanade optical flow of the corners from the
+#                previous frame to this one. With 3 pyramid levels the search
+#                follows the ground through about half a second of driving at
+#                600 mm/s; frames more than max_gap seconds apart are not
+#                matched, so a long stall of the loop gives no motion instead
+#                of a wrong one
+#   motion       the corners are lifted to 3D with the point clouds of both
+#                frames and the rigid motion between them is fitted (Kabsch),
+#                refitted once without the corners that do not agree (moving
+#                things, bad depth)
+# The StallDetector keeps the motion of the last window seconds with running
+# sums and reports a stall when the rover was commanded to drive for the
+# whole window but the net translation and rotation over it stayed under
+# min_translation and min_rotation. Frames without a valid motion (no
+# texture, no depth) count as unknown, not as standing still.
+#
+# USAGE
+# python odometry.py -r path/to/session --drive 600            simulate driving at 600 mm/s all along
+# python odometry.py -r path/to/session --commands commands.csv
+# python ball_tracker_final.py --odometry --drive 600             alongside the ball detection
+# The commands file has the header "frame,speed": the commanded speed (mm/s)
+# from that frame on.
+##############################################
+
+import argparse
+import bisect
+import collections
+import csv
+import math
+import sys
+import time
+import cv2
+import numpy as np
+from frame_source import open_recording
+
+# Desc: Motion of the camera from the previous frame to this one
+#       translation is (x, y, z) in mm in the previous camera frame (x right, y down, z forward)
+#       rotation is the rotation vector (radians, cv2.Rodrigues) of the camera
+#       flow is the median motion of the tracked corners in full resolution pixels
+#       tracked is how many corners were tracked, inliers how many fit the motion
+#       valid is False when the motion could not be measured
+Motion = collections.namedtuple('Motion', ['translation', 'rotation', 'flow', 'tracked', 'inliers', 'valid'])
+
+NO_MOTION = Motion(translation=(0.0, 0.0, 0.0), rotation=(0.0, 0.0, 0.0), flow=0.0, tracked=0, inliers=0,
+                   valid=False)
+
+
+# Desc: Rigid motion (R, t) with target = R source + t, least squares (Kabsch)
+# Inputs: N x 3 arrays source and target
+# Outputs: 3 x 3 rotation, float[3] translation
+def fit_rigid(source, target):
+	source_center = source.mean(axis=0)
+	target_center = target.mean(axis=0)
+	u, s, vt = np.linalg.svd((source - source_center).T.dot(target - target_center))
+	# no reflection
+	d = 1.0 if np.linalg.det(vt.T.dot(u.T)) > 0 else -1.0
+	rotation = vt.T.dot(np.diag([1.0, 1.0, d])).dot(u.T)
+	return rotation, target_center - rotation.dot(source_center)
+
+
+# Desc: Measures the motion of the camera between the frames it is given (see top of file)
+#       width is the width of the downscaled image the corners are tracked on
+#       max_features is how many corners are found, min_features how many must
+#           still be tracked before new ones are found
+#       min_inliers is how many corners with depth the motion needs
+#       max_depth is the farthest (mm) a corner is used (the depth gets noisy)
+#       inlier_threshold is the smallest residual (mm) a corner is rejected with
+#       max_gap is how far apart (seconds) two frames can be and still be matched
+# Inputs: int width, int max_features, int min_features, int min_inliers, float max_depth,
+#         float inlier_threshold, float max_gap
+class MotionEstimator(object):
+	def __init__(self, width=320, max_features=150, min_features=50, min_inliers=12, max_depth=10000.0,
+	             inlier_threshold=30.0, max_gap=.5):
+		self.width = width
+		self.max_gap = max_gap
+		self.max_features = max_features
+		self.min_features = min_features
+		self.min_inliers = min_inliers
+		self.max_depth = max_depth
+		self.inlier_threshold = inlier_threshold
+		self.lk_parameters = dict(winSize=(15, 15), maxLevel=3,
+		                          criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+		self.reset()
+
+	# Desc: Forget the previous frame
+	# Inputs:
+	# Outputs:
+	def reset(self):
+		self.timestamp = None
+		self.gray = None
+		self.corners = None
+		self.points = None
+
+	# Desc: 3D points of the point cloud under corners of the downscaled image,
+	#       interpolated between the 4 nearest pixels (the depth of the ground
+	#       changes a lot from one row to the next far away)
+	# Inputs: ZED point cloud, N x 2 corners, float scale from the downscaled image to the point cloud
+	# Outputs: N x 3 points (NaN without depth or farther than max_depth)
+	def _lift(self, point_cloud, corners, scale):
+		height, width = point_cloud.shape[:2]
+		x = np.clip(corners[:, 0] * scale - .5, 0, width - 1.001)
+		y = np.clip(corners[:, 1] * scale - .5, 0, height - 1.001)
+		x0 = x.astype(np.int64)
+		y0 = y.astype(np.int64)
+		fx = (x - x0)[:, None]
+		fy = (y - y0)[:, None]
+		points = (point_cloud[y0, x0, :3] * ((1 - fx) * (1 - fy)) + point_cloud[y0, x0 + 1, :3] * (fx * (1 - fy)) +
+		          point_cloud[y0 + 1, x0, :3] * ((1 - fx) * fy) + point_cloud[y0 + 1, x0 + 1, :3] * (fx * fy))
+		# NaN and inf compare False
+		points[~((points[:, 2] > 0) & (points[:, 2] < self.max_depth))] = np.nan
+		return points
+
+	# Desc: Motion of the camera since the previous frame given to update
+	#       timestamp is when the frame was captured (seconds)
+	# Inputs: float timestamp, Frame frame (image and point cloud)
+	# Outputs: Motion (NO_MOTION for the first frame or after a gap of more than max_gap)
+	def update(self, timestamp, frame):
+		image = frame.image
+		height, width = image.shape[:2]
+		scale = width / float(self.width)
+		small = cv2.resize(image, (self.width, int(round(height / scale))), interpolation=cv2.INTER_AREA)
+		gray = cv2.cvtColor(small, cv2.COLOR_BGRA2GRAY if small.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+
+		motion = NO_MOTION
+		corners = None
+		points = None
+		if self.timestamp is not None and timestamp - self.timestamp > self.max_gap:
+			self.corners = None
+		self.timestamp = timestamp
+		if self.gray is not None and self.corners is not None and len(self.corners) > 0:
+			tracked, status, _ = cv2.calcOpticalFlowPyrLK(self.gray, gray, self.corners, None, **self.lk_parameters)
+			status = status.ravel() == 1
+			corners = tracked[status]
+			previous_corners = self.corners[status]
+			previous_points = self.points[status]
+			points = self._lift(frame.point_cloud, corners.reshape(-1, 2), scale)
+			flow = float(np.median(np.sqrt(((corners - previous_corners) ** 2).sum(axis=2)))) * scale \
+				if len(corners) else 0.0
+			motion = self._fit(previous_points, points, flow, len(corners))
+
+		if corners is None or len(corners) < self.min_features:
+			corners = cv2.goodFeaturesToTrack(gray, maxCorners=self.max_features, qualityLevel=0.01, minDistance=8)
+			points = self._lift(frame.point_cloud, corners.reshape(-1, 2), scale) if corners is not None else None
+		self.gray = gray
+		self.corners = corners
+		self.points = points
+		return motion
+
+	def _fit(self, previous_points, points, flow, tracked):
+		both = np.isfinite(previous_points).all(axis=1) & np.isfinite(points).all(axis=1)
+		source = previous_points[both]
+		target = points[both]
+		if len(source) < self.min_inliers:
+			return NO_MOTION._replace(flow=flow, tracked=tracked)
+		rotation, translation = fit_rigid(source, target)
+		residuals = np.sqrt(((source.dot(rotation.T) + translation - target) ** 2).sum(axis=1))
+		inliers = residuals < max(3 * float(np.median(residuals)), self.inlier_threshold)
+		if np.count_nonzero(inliers) < self.min_inliers:
+			return NO_MOTION._replace(flow=flow, tracked=tracked)
+		rotation, translation = fit_rigid(source[inliers], target[inliers])
+		# the points moved by (R, t), so the camera moved by the inverse
+		camera_translation = -rotation.T.dot(translation)
+		rotation_vector = cv2.Rodrigues(rotation.T)[0].ravel()
+		return Motion(translation=tuple(float(value) for value in camera_translation),
+		              rotation=tuple(float(value) for value in rotation_vector), flow=flow, tracked=tracked,
+		              inliers=int(np.count_nonzero(inliers)), valid=True)
+
+
+# Desc: Reports a stall when the rover is commanded to drive but does not
+#       move (see top of file)
+#       window is how long (seconds) the rover must be commanded and not move
+#       min_translation is the net translation (mm) over the window that counts as moving
+#       min_rotation is the net rotation (degrees) over the window that counts as moving
+#       min_valid is the share of the frames of the window that need a valid motion
+# Inputs: float window, float min_translation, float min_rotation, float min_valid
+class StallDetector(object):
+	def __init__(self, window=1.5, min_translation=60.0, min_rotation=3.0, min_valid=.6):
+		self.window = window
+		self.min_translation = min_translation
+		self.min_rotation = math.radians(min_rotation)
+		self.min_valid = min_valid
+		self.reset()
+
+	# Desc: Forget the window
+	# Inputs:
+	# Outputs:
+	def reset(self):
+		# (timestamp, translation, rotation, commanded, valid) of the frames of the window
+		self.history = collections.deque()
+		self.translation = np.zeros(3)
+		self.rotation = np.zeros(3)
+		self.commanded = 0
+		self.valid = 0
+		self.stalled = False
+
+	# Desc: Add the motion and drive command of a frame
+	#       commanded is True while drive commands are sent
+	# Inputs: float timestamp, Motion motion, bool commanded
+	# Outputs: bool True while stalled
+	def update(self, timestamp, motion, commanded):
+		translation = np.array(motion.translation) if motion.valid else np.zeros(3)
+		rotation = np.array(motion.rotation) if motion.valid else np.zeros(3)
+		self.history.append((timestamp, translation, rotation, bool(commanded), motion.valid))
+		self.translation += translation
+		self.rotation += rotation
+		self.commanded += bool(commanded)
+		self.valid += motion.valid
+		# keep the frames of the last window seconds, plus the one before them, so the window is covered
+		while len(self.history) > 1 and timestamp - self.history[1][0] >= self.window:
+			_, old_translation, old_rotation, old_commanded, old_valid = self.history.popleft()
+			self.translation -= old_translation
+			self.rotation -= old_rotation
+			self.commanded -= old_commanded
+			self.valid -= old_valid
+
+		frames = len(self.history)
+		self.stalled = (timestamp - self.history[0][0] >= self.window and self.commanded == frames and
+		                self.valid >= self.min_valid * frames and
+		                math.sqrt(self.translation.dot(self.translation)) < self.min_translation and
+		                math.sqrt(self.rotation.dot(self.rotation)) < self.min_rotation)
+		return self.stalled
+
+	# Desc: Net translation (mm) and rotation (degrees) over the window
+	# Inputs:
+	# Outputs: float translation, float rotation
+	def net_motion(self):
+		return (math.sqrt(self.translation.dot(self.translation)),
+		        math.degrees(math.sqrt(self.rotation.dot(self.rotation))))
+
+
+# Desc: Draw the motion of the camera in the top right corner of the frame: the
+#       translation since the previous frame (mm) and STALL in red while stalled
+# Inputs: cv2 frame image, Motion motion, bool stalled
+# Outputs:
+def draw_motion(image, motion, stalled=False):
+	width = image.shape[1]
+	if motion.valid:
+		text = "{0:.0f} mm {1}/{2}".format(math.sqrt(sum(value * value for value in motion.translation)),
+		                                   motion.inliers, motion.tracked)
+	else:
+		text = "no motion {0}".format(motion.tracked)
+	cv2.putText(image, text, (width - 160, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
+	if stalled:
+		cv2.putText(image, "STALL", (width - 160, 45), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+
+
+# Desc: Read a drive commands file (see top of file)
+# Inputs: str path
+# Outputs: sorted list of int frames, list of float speeds (mm/s) of the commands
+def load_commands(path):
+	with open(path) as commands_file:
+		commands = sorted((int(row["frame"]), float(row["speed"])) for row in csv.DictReader(commands_file))
+	return [command[0] for command in commands], [command[1] for command in commands]
+
+
+# Desc: Commanded speed at a frame: the speed of the last command at or before it
+# Inputs: sorted list of int frames, list of float speeds (from load_commands), int frame
+# Outputs: float speed (0 before the first command)
+def commanded_speed(frames, speeds, frame):
+	position = bisect.bisect_right(frames, frame)
+	return speeds[position - 1] if position else 0.0
+
+
+def main():
+	ap = argparse.ArgumentParser(description="Replay a recorded session with simulated drive commands and "
+	                                         "report the visual odometry and stalls")
+	ap.add_argument("-r", "--recording", required=True, help="path to a recorded session")
+	ap.add_argument("--commands", help="drive commands CSV file (frame,speed)")
+	ap.add_argument("--drive", type=float, default=0.0, help="without --commands, constant commanded speed (mm/s)")
+	ap.add_argument("--fps", type=float, default=30.0, help="frame rate of the recording")
+	ap.add_argument("--window", type=float, default=1.5, help="seconds of no motion while driving for a stall")
+	args = ap.parse_args()
+
+	command_frames, command_speeds = load_commands(args.commands) if args.commands else ([0], [args.drive])
+	frame_source = open_recording(args.recording)
+	frame_source.open()
+	estimator = MotionEstimator()
+	detector = StallDetector(window=args.window)
+	durations = []
+	stalled_frames = 0
+	stalled = False
+	frame_index = 0
+	while True:
+		grabbed, frame = frame_source.read()
+		if not grabbed:
+			break
+		timestamp = frame_index / args.fps
+		start = time.perf_counter()
+		motion = estimator.update(timestamp, frame)
+		durations.append(time.perf_counter() - start)
+		speed = commanded_speed(command_frames, command_speeds, frame_index)
+		if detector.update(timestamp, motion, speed > 0) != stalled:
+			stalled = detector.stalled
+			translation, rotation = detector.net_motion()
+			print("frame {0}: {1} ({2:.0f} mm, {3:.1f} deg in the last {4} s, commanded {5:.0f} mm/s)".format(
+				frame_index, "stall detected" if stalled else "stall over", translation, rotation, args.window,
+				speed))
+			sys.stdout.flush()
+		stalled_frames += stalled
+		frame_index += 1
+	frame_source.close()
+	if durations:
+		print("{0} frames, {1} stalled. Odometry {2:.2f} ms p50, {3:.2f} ms p95 per frame.".format(
+			frame_index, stalled_frames, 1000 * np.percentile(durations, 50), 1000 * np.percentile(durations, 95)))
+
+
+if __name__ == "__main__":
+	main()
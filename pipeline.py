@@ -0,0 +1,245 @@
+##############################################
+# Threaded capture/detection pipeline for the tennis ball detection module.
+#
+# A capture thread reads frames from the frame source into a small ring
+# buffer, one or more detection workers take the newest frame from it and
+# the caller (display/output stage) takes the newest result. Frames and
+# results that are overtaken by newer ones are dropped instead of queued,
+# so the latency from capture to output stays bounded by a few frames.
+##############################################
+
+import collections
+import queue
+import threading
+import time
+import numpy as np
+from frame_source import Frame
+from instrumentation import NULL_TIMER
+
+
+# Desc: Small ring buffer with a latest-item-wins policy. put() never blocks;
+#       when the buffer is full the oldest item is overwritten. get() returns
+#       the newest item and drops everything older than it. on_drop is called
+#       with every dropped item.
+# Inputs: int size, function on_drop
+class LatestFrameBuffer(object):
+	def __init__(self, size=2, on_drop=None):
+		self.items = collections.deque(maxlen=size)
+		self.condition = threading.Condition()
+		self.closed = False
+		self.dropped = 0
+		self.on_drop = on_drop
+
+	# Desc: Add an item, overwriting the oldest item if the buffer is full
+	# Inputs: item
+	# Outputs:
+	def put(self, item):
+		with self.condition:
+			if len(self.items) == self.items.maxlen:
+				self._drop(self.items.popleft())
+			self.items.append(item)
+			self.condition.notify()
+
+	# Desc: Wait up to timeout seconds (forever if None) for an item and return
+	#       the newest one. Returns None on timeout or when the buffer is closed
+	#       and empty; without a timeout, only when it is closed and empty.
+	# Inputs: float timeout
+	# Outputs: newest item or None
+	def get(self, timeout=None):
+		with self.condition:
+			deadline = None if timeout is None else time.time() + timeout
+			# another getter can take the item between the notify and this
+			# thread waking up, so wait again until there is one
+			while not self.items and not self.closed:
+				if deadline is None:
+					self.condition.wait()
+				else:
+					remaining = deadline - time.time()
+					if remaining <= 0:
+						break
+					self.condition.wait(remaining)
+			if not self.items:
+				return None
+			item = self.items.pop()
+			while self.items:
+				self._drop(self.items.popleft())
+			return item
+
+	def _drop(self, item):
+		self.dropped += 1
+		if self.on_drop is not None:
+			self.on_drop(item)
+
+	# Desc: Wake up everyone waiting in get(); no more items will be added
+	# Inputs:
+	# Outputs:
+	def close(self):
+		with self.condition:
+			self.closed = True
+			self.condition.notify_all()
+
+
+# Desc: Pool of preallocated frames. Live frames are copied into a free frame
+#       of the pool instead of a new array, and the frame goes back to the pool
+#       once it has been displayed or dropped. If every frame of the pool is in
+#       use, copy() returns None and the new frame is dropped.
+# Inputs: int size
+class FramePool(object):
+	def __init__(self, size):
+		self.size = size
+		self.free = queue.Queue()
+		self.allocated = 0
+
+	# Desc: Copy a frame into a free frame of the pool
+	# Inputs: Frame frame
+	# Outputs: Frame (None if the pool is exhausted)
+	def copy(self, frame):
+		try:
+			pooled = self.free.get_nowait()
+			if (pooled.image.shape != frame.image.shape or
+					pooled.point_cloud.shape != frame.point_cloud.shape):
+				pooled = None
+				self.allocated -= 1
+		except queue.Empty:
+			pooled = None
+		if pooled is None:
+			if self.allocated >= self.size:
+				return None
+			pooled = Frame(image=np.empty_like(frame.image), point_cloud=np.empty_like(frame.point_cloud),
+			               fx=frame.fx, fy=frame.fy)
+			self.allocated += 1
+		np.copyto(pooled.image, frame.image)
+		np.copyto(pooled.point_cloud, frame.point_cloud)
+		return pooled
+
+	# Desc: Give a frame back to the pool
+	# Inputs: Frame frame
+	# Outputs:
+	def release(self, frame):
+		self.free.put(frame)
+
+
+# Desc: Runs the capture thread and detection workers.
+#       frame_source is an opened frame source (see frame_source.py)
+#       detect is called as detect(frame) from the worker threads and returns
+#           the detection result for the frame
+#       num_workers is how many detection threads to run
+#       buffer_size is the size of the capture ring buffer
+#       timer records the capture stages (see instrumentation.py)
+#
+#       Results are returned by get_result() as tuples
+#           (frame_id, capture_time, frame, result)
+#       where capture_time is from time.time() when the frame was read.
+#       Pass every returned result to release() once the frame is no longer used.
+# Inputs: frame_source, function detect, int num_workers, int buffer_size, StageTimer timer
+class DetectionPipeline(object):
+	def __init__(self, frame_source, detect, num_workers=2, buffer_size=2, timer=NULL_TIMER):
+		self.frame_source = frame_source
+		self.timer = timer
+		self.detect = detect
+		self.num_workers = num_workers
+		# enough frames for the ring buffer, the workers, the results and the display
+		self.pool = FramePool(size=buffer_size + 2 * num_workers + 2)
+		self.frames = LatestFrameBuffer(size=buffer_size, on_drop=self.release)
+		self.results = LatestFrameBuffer(size=num_workers, on_drop=self.release)
+		self.stop_event = threading.Event()
+		self.threads = []
+		self.workers_running = 0
+		self.workers_lock = threading.Lock()
+		self.frames_captured = 0
+		self.frames_processed = 0
+		self.last_frame_id = -1
+
+	# Desc: Start the capture thread and the detection workers
+	# Inputs:
+	# Outputs:
+	def start(self):
+		self.workers_running = self.num_workers
+		self.threads = [threading.Thread(target=self._capture, name="capture")]
+		for i in range(self.num_workers):
+			self.threads.append(threading.Thread(target=self._work, name="detect-{0}".format(i)))
+		for thread in self.threads:
+			thread.daemon = True
+			thread.start()
+
+	# Desc: Capture thread. The ZED SDK writes every grab into the same PyMat
+	#       buffers, so live frames are copied into the frame pool before being
+	#       handed to a worker.
+	# Inputs:
+	# Outputs:
+	def _capture(self):
+		frame_id = 0
+		while not self.stop_event.is_set():
+			grabbed, frame = self.frame_source.read(timer=self.timer)
+			if not grabbed:
+				# end of a recording
+				if not self.frame_source.is_live:
+					break
+				continue
+			if self.frame_source.is_live:
+				t = self.timer.clock()
+				frame = self.pool.copy(frame)
+				self.timer.record('copy', t)
+				if frame is None:
+					continue
+			self.frames.put((frame_id, time.time(), frame))
+			self.frames_captured += 1
+			frame_id += 1
+		self.frames.close()
+
+	# Desc: Detection worker. Takes the newest captured frame, runs detect on it
+	#       and publishes the result.
+	# Inputs:
+	# Outputs:
+	def _work(self):
+		while not self.stop_event.is_set():
+			item = self.frames.get()
+			if item is None:
+				# only once the capture has ended and every frame was taken
+				break
+			frame_id, capture_time, frame = item
+			result = self.detect(frame)
+			self.results.put((frame_id, capture_time, frame, result))
+			with self.workers_lock:
+				self.frames_processed += 1
+		with self.workers_lock:
+			self.workers_running -= 1
+			if self.workers_running == 0:
+				self.results.close()
+
+	# Desc: Return the newest result that is newer than the last returned one.
+	#       Results that finish out of order (several workers) are dropped.
+	#       Returns None on timeout or when the pipeline has finished.
+	# Inputs: float timeout
+	# Outputs: (frame_id, capture_time, frame, result) or None
+	def get_result(self, timeout=None):
+		item = self.results.get(timeout=timeout)
+		if item is None:
+			return None
+		if item[0] <= self.last_frame_id:
+			self.release(item)
+			return None
+		self.last_frame_id = item[0]
+		return item
+
+	# Desc: Give the frame of a captured frame or result back to the frame pool
+	# Inputs: tuple item (from the ring buffers or get_result)
+	# Outputs:
+	def release(self, item):
+		if self.frame_source.is_live:
+			self.pool.release(item[2])
+
+	# Desc: True once the capture has ended and every result has been taken
+	# Inputs:
+	# Outputs: bool
+	def is_finished(self):
+		return self.results.closed and not self.results.items
+
+	# Desc: Stop the capture thread and the detection workers
+	# Inputs:
+	# Outputs:
+	def stop(self):
+		self.stop_event.set()
+		self.frames.close()
+		for thread in self.threads:
+			thread.join()
@@ -0,0 +1,344 @@
+##############################################
+# Recorder of the tennis ball detection module.
+#
+# Records the left images, the depth and the detection results of a
+# detection run (ball_tracker_final.py --save) in a compact format for the
+# TX2's limited storage, and replays them by frame id. A recording is a
+# directory with:
+#   recording.json   width, height, JPEG quality and format version
+#   calibration.npz  fx, fy, cx, cy of the left camera (as in frame_source.py)
+#   chunkNNNNN.bin   the frames, one after the other: the left image as a JPEG
+#                    followed by the depth (Z) as H x W float16 (mm). A new
+#                    chunk is started once a chunk holds chunk_bytes.
+#   index.csv        one line per frame (INDEX_FIELDS), appended once the frame
+#                    is in its chunk: where the frame is and the detection result
+# Frame ids count every frame given to the recorder, so the ids of dropped
+# frames are missing from the index and the ids stay unique when several
+# detection runs are recorded into one recording.
+#
+# Only the depth is stored: the ZED point cloud of the rectified left image
+# is X = (u - cx) Z / fx, Y = (v - cy) Z / fy, so X and Y are computed back
+# from the calibration on replay. float16 keeps 4 mm steps at 5 m.
+# A 720p frame takes about 1.8 MB of depth and 50-150 kB of JPEG instead of
+# 14.8 MB in the .npy stacks.
+#
+# The capture loop only copies the image and the depth into a free slot
+# (a few ms at 720p); encoding and writing run on a background thread.
+# If the writer falls behind and every slot is in use, the frame is not
+# recorded (counted in dropped) instead of stalling the capture.
+#
+# USAGE
+# python ball_tracker_final.py --save path/to/session     record while detecting
+# python ball_tracker_final.py -r path/to/session         replay it (any recording format)
+# python recorder.py path/to/session                      print the recorded detection results
+##############################################
+
+import csv
+import json
+import os
+import queue
+import sys
+import threading
+import cv2
+import numpy as np
+from calibration import CameraCalibration
+from frame_source import Frame
+from instrumentation import NULL_TIMER
+from result_stream import Record, make_record
+
+RECORDING_VERSION = 1
+INDEX_FIELDS = ['frame_id', 'timestamp', 'chunk', 'offset', 'image_bytes', 'depth_bytes', 'found', 'detected',
+                'distance', 'azimuth', 'elevation', 'confidence']
+
+
+# Desc: True if path is a recording written by SessionRecorder
+# Inputs: str path
+# Outputs: bool
+def is_chunked_recording(path):
+	return os.path.isfile(os.path.join(path, 'index.csv'))
+
+
+# Desc: Records frames and detection results on a background thread.
+#       path is the directory of the new recording (it must not hold a recording)
+#       calibration is the CameraCalibration of the frame source
+#       jpeg_quality is the JPEG quality of the left images (0 to 100)
+#       chunk_bytes is the size after which a new chunk file is started
+#       slots is how many frames can wait for the writer before frames are dropped
+# Inputs: str path, CameraCalibration calibration, int jpeg_quality, int chunk_bytes, int slots
+class SessionRecorder(object):
+	def __init__(self, path, calibration, jpeg_quality=90, chunk_bytes=64 << 20, slots=8):
+		self.path = path
+		self.calibration = calibration
+		self.jpeg_quality = jpeg_quality
+		self.chunk_bytes = chunk_bytes
+		self.free = queue.Queue()
+		for i in range(slots):
+			self.free.put(None)
+		self.pending = queue.Queue()
+		self.thread = None
+		self.index_file = None
+		self.chunk_file = None
+		self.chunk = -1
+		self.frame_id = 0
+		self.recorded = 0
+		self.dropped = 0
+		self.written_bytes = 0
+
+	# Desc: Create the recording and start the writer thread. Exits the program
+	#       if the directory already holds a recording.
+	# Inputs:
+	# Outputs:
+	def open(self):
+		if is_chunked_recording(self.path):
+			print("{0} already holds a recording.".format(self.path))
+			exit()
+		if not os.path.isdir(self.path):
+			os.makedirs(self.path)
+		calibration = self.calibration
+		with open(os.path.join(self.path, 'recording.json'), 'w') as metadata_file:
+			json.dump({"version": RECORDING_VERSION, "width": calibration.width, "height": calibration.height,
+			           "jpeg_quality": self.jpeg_quality, "depth": "float16"}, metadata_file)
+		np.savez(os.path.join(self.path, 'calibration.npz'), fx=calibration.fx, fy=calibration.fy,
+		         cx=calibration.cx, cy=calibration.cy)
+		self.index_file = open(os.path.join(self.path, 'index.csv'), 'w')
+		self.index_file.write(",".join(INDEX_FIELDS) + "\n")
+		self.index_file.flush()
+		self.thread = threading.Thread(target=self._write, name="recorder")
+		self.thread.daemon = True
+		self.thread.start()
+
+	# Desc: Record a frame and its detection result. Never blocks: if no slot is
+	#       free the frame is dropped. Call it before drawing on the frame.
+	#       timestamp is time.time() when the frame was captured
+	#       timer records the copy (see instrumentation.py)
+	# Inputs: float timestamp, Frame frame, DetectionResult result, StageTimer timer
+	# Outputs: bool True if the frame will be recorded
+	def record(self, timestamp, frame, result, timer=NULL_TIMER):
+		t = timer.clock()
+		frame_id = self.frame_id
+		self.frame_id += 1
+		try:
+			slot = self.free.get_nowait()
+		except queue.Empty:
+			self.dropped += 1
+			return False
+		image, point_cloud = frame.image, frame.point_cloud
+		height, width = image.shape[:2]
+		if slot is None or slot[0].shape[:2] != (height, width):
+			slot = (np.empty((height, width, 3), dtype=np.uint8), np.empty((height, width), dtype=np.float32))
+		if image.ndim == 3 and image.shape[2] == 4:
+			cv2.cvtColor(image, cv2.COLOR_BGRA2BGR, dst=slot[0])
+		else:
+			np.copyto(slot[0], image)
+		np.copyto(slot[1], point_cloud[:, :, 2])
+		self.pending.put((frame_id, timestamp, slot, make_record(frame_id, timestamp, result)))
+		timer.record('record', t)
+		return True
+
+	# Desc: Writer thread. Encodes every pending frame, appends it to the current
+	#       chunk and then its line to the index.
+	# Inputs:
+	# Outputs:
+	def _write(self):
+		while True:
+			item = self.pending.get()
+			if item is None:
+				break
+			frame_id, timestamp, slot, record = item
+			encoded, jpeg = cv2.imencode('.jpg', slot[0], [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+			depth = slot[1].astype(np.float16).tobytes()
+			self.free.put(slot)
+			if not encoded:
+				self.dropped += 1
+				continue
+			jpeg = jpeg.tobytes()
+
+			if self.chunk_file is None or self.chunk_file.tell() >= self.chunk_bytes:
+				self._next_chunk()
+			offset = self.chunk_file.tell()
+			self.chunk_file.write(jpeg)
+			self.chunk_file.write(depth)
+			self.chunk_file.flush()
+			# the index only points at frames that are in their chunk
+			self.index_file.write("{0},{1!r},{2},{3},{4},{5},{6},{7},{8!r},{9!r},{10!r},{11!r}\n".format(
+				frame_id, timestamp, self.chunk, offset, len(jpeg), len(depth), int(record.found),
+				int(record.detected), record.distance, record.azimuth, record.elevation, record.confidence))
+			self.index_file.flush()
+			self.recorded += 1
+			self.written_bytes += len(jpeg) + len(depth)
+
+	def _next_chunk(self):
+		if self.chunk_file is not None:
+			self.chunk_file.close()
+		self.chunk += 1
+		self.chunk_file = open(os.path.join(self.path, 'chunk{0:05d}.bin'.format(self.chunk)), 'wb')
+
+	# Desc: Write the pending frames and close the recording
+	# Inputs:
+	# Outputs:
+	def close(self):
+		if self.thread is not None:
+			self.pending.put(None)
+			self.thread.join()
+			self.thread = None
+		if self.chunk_file is not None:
+			self.chunk_file.close()
+			self.chunk_file = None
+		if self.index_file is not None:
+			self.index_file.close()
+			self.index_file = None
+
+
+# Desc: Random access to the frames and detection results of a recording
+#       written by SessionRecorder. A partly written last line of the index
+#       (the program was killed while recording) is ignored.
+# Inputs: str path
+class RecordingReader(object):
+	def __init__(self, path):
+		self.path = path
+		with open(os.path.join(path, 'recording.json')) as metadata_file:
+			self.metadata = json.load(metadata_file)
+		if self.metadata.get("version") != RECORDING_VERSION:
+			raise ValueError("{0} is a version {1} recording, expected version {2}".format(
+				path, self.metadata.get("version"), RECORDING_VERSION))
+		calibration = np.load(os.path.join(path, 'calibration.npz'))
+		self.width = int(self.metadata["width"])
+		self.height = int(self.metadata["height"])
+		self.calibration = CameraCalibration(fx=float(calibration['fx']), fy=float(calibration['fy']),
+		                                     cx=float(calibration['cx']), cy=float(calibration['cy']),
+		                                     width=self.width, height=self.height)
+		self.entries = []
+		with open(os.path.join(path, 'index.csv')) as index_file:
+			for row in csv.DictReader(index_file):
+				try:
+					self.entries.append(self._parse_entry(row))
+				except (TypeError, ValueError):
+					break
+		self.positions = dict((entry[0], position) for position, entry in enumerate(self.entries))
+		self.frame_ids = [entry[0] for entry in self.entries]
+		# X and Y per mm of depth of every pixel
+		self.ray_x = ((np.arange(self.width, dtype=np.float32) - self.calibration.cx) / self.calibration.fx)[None, :]
+		self.ray_y = ((np.arange(self.height, dtype=np.float32) - self.calibration.cy) / self.calibration.fy)[:, None]
+		self.chunk_files = {}
+
+	def _parse_entry(self, row):
+		record = Record(frame_id=int(row['frame_id']), timestamp=float(row['timestamp']),
+		                found=row['found'] == '1', detected=row['detected'] == '1',
+		                distance=float(row['distance']), azimuth=float(row['azimuth']),
+		                elevation=float(row['elevation']), confidence=float(row['confidence']),
+		                smoothed=False, vx=float('nan'), vy=float('nan'), vz=float('nan'))
+		return (record.frame_id, int(row['chunk']), int(row['offset']), int(row['image_bytes']),
+		        int(row['depth_bytes']), record)
+
+	def __len__(self):
+		return len(self.entries)
+
+	# Desc: Frame at a position of the recording (0 to len - 1)
+	# Inputs: int position
+	# Outputs: Frame
+	def frame_at(self, position):
+		frame_id, chunk, offset, image_bytes, depth_bytes, record = self.entries[position]
+		chunk_file = self.chunk_files.get(chunk)
+		if chunk_file is None:
+			chunk_file = open(os.path.join(self.path, 'chunk{0:05d}.bin'.format(chunk)), 'rb')
+			self.chunk_files[chunk] = chunk_file
+		chunk_file.seek(offset)
+		data = chunk_file.read(image_bytes + depth_bytes)
+		image = cv2.imdecode(np.frombuffer(data[:image_bytes], dtype=np.uint8), cv2.IMREAD_COLOR)
+		depth = np.frombuffer(data[image_bytes:], dtype=np.float16).reshape(self.height, self.width)
+		point_cloud = np.empty((self.height, self.width, 3), dtype=np.float32)
+		point_cloud[:, :, 2] = depth
+		z = point_cloud[:, :, 2]
+		with np.errstate(invalid='ignore'):
+			np.multiply(z, self.ray_x, out=point_cloud[:, :, 0])
+			np.multiply(z, self.ray_y, out=point_cloud[:, :, 1])
+		return Frame(image=image, point_cloud=point_cloud, fx=self.calibration.fx, fy=self.calibration.fy)
+
+	# Desc: Frame with a frame id (KeyError if it was not recorded)
+	# Inputs: int frame_id
+	# Outputs: Frame
+	def read_frame(self, frame_id):
+		return self.frame_at(self.positions[frame_id])
+
+	# Desc: Recorded detection result of a frame id (KeyError if it was not recorded)
+	# Inputs: int frame_id
+	# Outputs: Record (see result_stream.py)
+	def result(self, frame_id):
+		return self.entries[self.positions[frame_id]][5]
+
+	def close(self):
+		for chunk_file in self.chunk_files.values():
+			chunk_file.close()
+		self.chunk_files = {}
+
+
+# Desc: Frame source that replays a recording written by SessionRecorder (see
+#       frame_source.py for the frame source interface). With loop=True the
+#       recording restarts from the first frame instead of ending.
+# Inputs: str path, bool loop
+class ChunkedFrameSource(object):
+	is_live = False
+
+	def __init__(self, path, loop=False):
+		self.path = path
+		self.loop = loop
+		self.reader = None
+		self.calibration = None
+		self.frame_index = 0
+
+	def open(self):
+		self.reader = RecordingReader(self.path)
+		self.calibration = self.reader.calibration
+		self.frame_index = 0
+
+	def __len__(self):
+		return len(self.reader)
+
+	# Desc: Return the next recorded frame
+	#       timer records the read stage (see instrumentation.py)
+	# Inputs: StageTimer timer
+	# Outputs: bool grabbed, Frame frame (None if the recording ended)
+	def read(self, timer=NULL_TIMER):
+		t = timer.clock()
+		if self.frame_index >= len(self.reader):
+			if not self.loop or len(self.reader) == 0:
+				return False, None
+			self.frame_index = 0
+		frame = self.reader.frame_at(self.frame_index)
+		self.frame_index += 1
+		timer.record('read', t)
+		return True, frame
+
+	# Desc: Make the next read() return the frame at index
+	# Inputs: int index
+	# Outputs:
+	def seek(self, index):
+		self.frame_index = index
+
+	def print_information(self):
+		print("Recording: {0}".format(self.path))
+		print("Resolution: {0}, {1}.".format(self.calibration.width, self.calibration.height))
+		print("Frames: {0}.\n".format(len(self.reader)))
+		sys.stdout.flush()
+
+	def close(self):
+		if self.reader is not None:
+			self.reader.close()
+			self.reader = None
+
+
+def main():
+	if len(sys.argv) != 2:
+		print("usage: python recorder.py path/to/session")
+		return
+	reader = RecordingReader(sys.argv[1])
+	print("{0} frames, {1} x {2}".format(len(reader), reader.width, reader.height))
+	for frame_id in reader.frame_ids:
+		record = reader.result(frame_id)
+		if record.found:
+			print("frame {0}: {1} at {2:.2f} m".format(frame_id, "detected" if record.detected else "guessed",
+			                                           record.distance / 1000))
+	reader.close()
+
+if __name__ == "__main__":
+	main()
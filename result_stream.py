@@ -0,0 +1,203 @@
+##############################################
+# Result stream of the tennis ball detection module.
+#
+# The headless detection mode (ball_tracker_final.py --headless) publishes
+# every detection result as one datagram on a local socket, for the
+# navigation stack and the comms base to read instead of the printed text.
+# Datagrams never block the detection loop: if nobody is listening or the
+# reader is too slow, the results are dropped.
+#
+# The address is either "host:port" (UDP) or the path of a Unix datagram
+# socket. Every datagram holds one record, either binary (RECORD_STRUCT,
+# 42 bytes, little endian):
+#   uint8   version      RECORD_VERSION
+#   uint8   flags        bit 0 = found (color region), bit 1 = detected (circle),
+#                        bit 2 = smoothed (see below)
+#   uint32  frame_id
+#   float64 timestamp    time.time() when the frame was captured
+#   float32 distance     mm from the left lens (NaN if not found)
+#   float32 azimuth      radians (NaN if not found)
+#   float32 elevation    radians (NaN if not found)
+#   float32 confidence   fraction of valid depth under the color region
+#   float32 vx, vy, vz   velocity in mm/s in the ZED camera frame (NaN if not smoothed)
+# or the same fields as a JSON object.
+#
+# With --smooth the position is the estimate of smoothing.PositionEstimator
+# instead of the raw measurement of the frame: found means the estimate is
+# valid (there is a recent measurement, even if this frame has none) and the
+# confidence is the confidence of the estimate.
+#
+# USAGE
+# python result_stream.py                  listen on the default address and print every record
+# python result_stream.py /tmp/ball.sock   listen on a Unix datagram socket
+##############################################
+
+import collections
+import json
+import math
+import os
+import socket
+import struct
+import sys
+
+DEFAULT_ADDRESS = "127.0.0.1:5805"
+RECORD_VERSION = 2
+RECORD_STRUCT = struct.Struct('<BBIdfffffff')
+FLAG_FOUND = 1
+FLAG_DETECTED = 2
+FLAG_SMOOTHED = 4
+# Fields that are NaN when missing (null in JSON)
+OPTIONAL_FIELDS = ('distance', 'azimuth', 'elevation', 'vx', 'vy', 'vz')
+
+# Desc: One published detection result
+Record = collections.namedtuple('Record', ['frame_id', 'timestamp', 'found', 'detected', 'distance',
+                                           'azimuth', 'elevation', 'confidence', 'smoothed', 'vx', 'vy', 'vz'])
+
+
+# Desc: Parse an address: "host:port" for UDP, anything else is a Unix socket path
+# Inputs: str address
+# Outputs: int socket family, address for socket.bind/sendto
+def parse_address(address):
+	host, _, port = address.rpartition(":")
+	if host and port.isdigit():
+		return socket.AF_INET, (host, int(port))
+	return socket.AF_UNIX, address
+
+
+# Desc: Build a Record from a detection result (see ball_tracker_final.DetectionResult)
+#       and optionally its smoothed estimate (see smoothing.PositionEstimator,
+#       None while it has no recent measurement)
+# Inputs: int frame_id, float timestamp, DetectionResult result, bool smoothed, PositionEstimate estimate
+# Outputs: Record
+def make_record(frame_id, timestamp, result, smoothed=False, estimate=None):
+	nan = float('nan')
+	if smoothed:
+		if estimate is None:
+			return Record(frame_id, timestamp, False, False, nan, nan, nan, 0.0, True, nan, nan, nan)
+		vx, vy, vz = estimate.velocity
+		return Record(frame_id, timestamp, True, bool(result.detected), float(estimate.distance),
+		              float(estimate.azimuth), float(estimate.elevation), float(estimate.confidence), True,
+		              vx, vy, vz)
+	if not result.found:
+		return Record(frame_id, timestamp, False, False, nan, nan, nan, 0.0, False, nan, nan, nan)
+	return Record(frame_id, timestamp, True, bool(result.detected), float(result.distance),
+	              float(result.azimuth), float(result.elevation), float(result.depth_confidence or 0.0), False,
+	              nan, nan, nan)
+
+
+# Desc: Encode a record as a binary or JSON datagram
+# Inputs: Record record, str record_format ('binary' or 'json')
+# Outputs: bytes
+def encode_record(record, record_format='binary'):
+	if record_format == 'json':
+		fields = record._asdict()
+		# JSON has no NaN, missing values are null
+		for name in OPTIONAL_FIELDS:
+			if math.isnan(fields[name]):
+				fields[name] = None
+		return json.dumps(fields, separators=(',', ':')).encode('utf-8')
+	flags = (FLAG_FOUND if record.found else 0) | (FLAG_DETECTED if record.detected else 0) | \
+		(FLAG_SMOOTHED if record.smoothed else 0)
+	return RECORD_STRUCT.pack(RECORD_VERSION, flags, record.frame_id & 0xffffffff, record.timestamp,
+	                          record.distance, record.azimuth, record.elevation, record.confidence,
+	                          record.vx, record.vy, record.vz)
+
+
+# Desc: Decode a binary or JSON datagram
+# Inputs: bytes data
+# Outputs: Record (None if the datagram is not a record)
+def decode_record(data):
+	if data[:1] == b'{':
+		try:
+			fields = json.loads(data.decode('utf-8'))
+			for name in OPTIONAL_FIELDS:
+				if fields.get(name) is None:
+					fields[name] = float('nan')
+			fields.setdefault('smoothed', False)
+			return Record(**fields)
+		except (ValueError, TypeError):
+			return None
+	if len(data) != RECORD_STRUCT.size or bytearray(data)[0] != RECORD_VERSION:
+		return None
+	version, flags, frame_id, timestamp, distance, azimuth, elevation, confidence, vx, vy, vz = \
+		RECORD_STRUCT.unpack(data)
+	return Record(frame_id, timestamp, bool(flags & FLAG_FOUND), bool(flags & FLAG_DETECTED),
+	              distance, azimuth, elevation, confidence, bool(flags & FLAG_SMOOTHED), vx, vy, vz)
+
+
+# Desc: Publishes detection results as datagrams to a local address.
+#       Sending never blocks; results that can not be sent (no listener,
+#       full socket buffer) are counted in dropped.
+# Inputs: str address, str record_format ('binary' or 'json')
+class ResultPublisher(object):
+	def __init__(self, address=DEFAULT_ADDRESS, record_format='binary'):
+		self.family, self.address = parse_address(address)
+		self.record_format = record_format
+		self.socket = socket.socket(self.family, socket.SOCK_DGRAM)
+		self.socket.setblocking(False)
+		self.sent = 0
+		self.dropped = 0
+
+	# Desc: Publish the result of one frame, smoothed when an estimator is used
+	#       (see make_record)
+	# Inputs: int frame_id, float timestamp, DetectionResult result, bool smoothed, PositionEstimate estimate
+	# Outputs:
+	def publish(self, frame_id, timestamp, result, smoothed=False, estimate=None):
+		data = encode_record(make_record(frame_id, timestamp, result, smoothed, estimate), self.record_format)
+		try:
+			self.socket.sendto(data, self.address)
+			self.sent += 1
+		except (socket.error, OSError):
+			self.dropped += 1
+
+	def close(self):
+		self.socket.close()
+
+
+# Desc: Receives the records published to a local address
+# Inputs: str address
+class ResultSubscriber(object):
+	def __init__(self, address=DEFAULT_ADDRESS):
+		self.family, self.address = parse_address(address)
+		self.socket = socket.socket(self.family, socket.SOCK_DGRAM)
+		if self.family == socket.AF_UNIX and os.path.exists(self.address):
+			os.remove(self.address)
+		self.socket.bind(self.address)
+
+	# Desc: Wait up to timeout seconds (forever if None) for the next record
+	# Inputs: float timeout
+	# Outputs: Record (None on timeout or if the datagram is not a record)
+	def receive(self, timeout=None):
+		self.socket.settimeout(timeout)
+		try:
+			data = self.socket.recv(4096)
+		except socket.timeout:
+			return None
+		return decode_record(data)
+
+	def close(self):
+		self.socket.close()
+		if self.family == socket.AF_UNIX and os.path.exists(self.address):
+			os.remove(self.address)
+
+
+def main():
+	subscriber = ResultSubscriber(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_ADDRESS)
+	print("Listening on {0}...".format(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_ADDRESS))
+	try:
+		while True:
+			record = subscriber.receive()
+			if record is None or not record.found:
+				continue
+			print("{0} frame {1}: {2} at {3:.2f} m, rotate {4:.2f} deg, elevate {5:.2f} deg".format(
+				record.timestamp, record.frame_id, "detected" if record.detected else "guessed",
+				record.distance / 1000, math.degrees(record.azimuth), math.degrees(record.elevation)) +
+				(", {0:.2f} m/s, confidence {1:.2f}".format(math.sqrt(record.vx ** 2 + record.vy ** 2 + record.vz ** 2)
+				                                          / 1000, record.confidence) if record.smoothed else ""))
+	except KeyboardInterrupt:
+		pass
+	finally:
+		subscriber.close()
+
+if __name__ == "__main__":
+	main()
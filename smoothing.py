@@ -0,0 +1,165 @@
+##############################################
+# Temporal smoothing of the rover coordinates of the tennis ball.
+#
+# The detection gives a raw distance/azimuth/elevation every frame, either
+# from a detected circle or guessed from the color region alone. The
+# PositionEstimator keeps the last few measurements in fixed-size ring
+# buffers and fuses them into one estimate:
+#   outliers     a measurement further from the median of the window than
+#                gate times the scaled median absolute deviation (MAD) is
+#                rejected; if most of the window would be rejected in a row,
+#                the ball really moved and the window starts over from it
+#   position     weighted linear fit of the window over time, read at the
+#                time of the frame (detected circles weigh more than guesses)
+#   velocity     slope of that fit, in mm per second
+#   confidence   share of the last frames with an accepted measurement times
+#                their mean weight, from 0 to 1
+# The fit is done in the ZED camera frame (x right, y down, z forward, mm),
+# so the azimuth does not wrap and the velocity is a real speed. Every
+# update works on the window only, so its cost does not grow with the track.
+##############################################
+
+import collections
+import math
+import numpy as np
+
+# Desc: Smoothed position of the ball
+#       distance (mm), azimuth and elevation (radians) as get_rover_coordinates
+#       velocity is (vx, vy, vz) in mm per second in the ZED camera frame
+#       speed is the norm of velocity in mm per second
+#       confidence is from 0 to 1
+#       samples is how many measurements the estimate is fused from
+#       outlier is True when the measurement of this frame was rejected
+PositionEstimate = collections.namedtuple('PositionEstimate', ['distance', 'azimuth', 'elevation', 'velocity',
+                                                               'speed', 'confidence', 'samples', 'outlier'])
+
+# MAD of a normal distribution times this is its standard deviation
+MAD_TO_SIGMA = 1.4826
+
+
+# Desc: Fuses the detection results of consecutive frames (see top of file).
+#       window is the size of the ring buffers (frames)
+#       gate is how many scaled MADs from the median a measurement may be
+#       min_samples is how many measurements the window needs before the gate is used
+#       max_age is how old (seconds) a measurement can be and still be used
+#       min_spread and relative_spread are the smallest scale of the gate, in mm
+#           and as a share of the distance (the depth noise grows with it), so a
+#           still ball with a MAD near 0 does not reject every new measurement
+#       guess_weight is the weight of a position guessed from the color region
+#           against a detected circle (1)
+# Inputs: int window, float gate, int min_samples, float max_age, float min_spread, float relative_spread,
+#         float guess_weight
+class PositionEstimator(object):
+	def __init__(self, window=9, gate=3.5, min_samples=3, max_age=1.0, min_spread=30.0, relative_spread=.03,
+	             guess_weight=.5):
+		self.window = window
+		self.gate = gate
+		self.min_samples = min_samples
+		self.max_age = max_age
+		self.min_spread = min_spread
+		self.relative_spread = relative_spread
+		self.guess_weight = guess_weight
+		self.points = np.zeros((window, 3))
+		self.times = np.zeros(window)
+		self.weights = np.zeros(window)
+		# accepted measurement or not, for each of the last window frames
+		self.hits = np.zeros(window, dtype=bool)
+		self.rejected = 0
+		self.reset()
+
+	# Desc: Forget every measurement
+	# Inputs:
+	# Outputs:
+	def reset(self):
+		self.weights[:] = 0
+		self.hits[:] = False
+		self.head = 0
+		self.frame = 0
+		self.rejected_in_row = 0
+
+	# Desc: Add the detection result of a frame and return the estimate
+	#       timestamp is time.time() when the frame was captured
+	# Inputs: float timestamp, DetectionResult result
+	# Outputs: PositionEstimate (None while there is no recent measurement)
+	def update(self, timestamp, result):
+		outlier = False
+		if result.found:
+			point = to_camera_frame(result.distance, result.azimuth, result.elevation)
+			weight = (1.0 if result.detected else self.guess_weight) * min(max(result.depth_confidence or 0, .1), 1)
+			outlier = self._is_outlier(timestamp, point)
+			if outlier:
+				self.rejected += 1
+				self.rejected_in_row += 1
+				if self.rejected_in_row > self.window // 2:
+					# not an outlier but a ball that moved: start over from it
+					self.reset()
+					outlier = False
+			if not outlier:
+				self.rejected_in_row = 0
+				self.points[self.head] = point
+				self.times[self.head] = timestamp
+				self.weights[self.head] = weight
+				self.head = (self.head + 1) % self.window
+		self.hits[self.frame % self.window] = result.found and not outlier
+		self.frame += 1
+		return self._estimate(timestamp, outlier)
+
+	# Desc: Measurements of the window that are recent enough
+	# Inputs: float timestamp
+	# Outputs: numpy bool array
+	def _valid(self, timestamp):
+		return (self.weights > 0) & (timestamp - self.times <= self.max_age)
+
+	def _is_outlier(self, timestamp, point):
+		valid = self._valid(timestamp)
+		if np.count_nonzero(valid) < self.min_samples:
+			return False
+		points = self.points[valid]
+		median = np.median(points, axis=0)
+		deviations = np.sqrt(((points - median) ** 2).sum(axis=1))
+		scale = max(MAD_TO_SIGMA * np.median(deviations), self.min_spread,
+		            self.relative_spread * math.sqrt(median.dot(median)))
+		return math.sqrt(((point - median) ** 2).sum()) > self.gate * scale
+
+	def _estimate(self, timestamp, outlier):
+		valid = self._valid(timestamp)
+		samples = int(np.count_nonzero(valid))
+		if samples == 0:
+			return None
+		weights = self.weights[valid]
+		points = self.points[valid]
+		times = self.times[valid] - timestamp
+		total = weights.sum()
+		mean_time = weights.dot(times) / total
+		mean_point = weights.dot(points) / total
+		spread = weights.dot((times - mean_time) ** 2)
+		if samples >= 2 and spread > 1e-9:
+			velocity = (weights * (times - mean_time)).dot(points - mean_point) / spread
+		else:
+			velocity = np.zeros(3)
+		# the fit read at the time of the frame (time 0)
+		x, y, z = mean_point - velocity * mean_time
+		distance, elevation, azimuth = from_camera_frame(x, y, z)
+		confidence = np.count_nonzero(self.hits[:min(self.frame, self.window)]) / float(self.window) * \
+			total / samples
+		return PositionEstimate(distance=distance, azimuth=azimuth, elevation=elevation,
+		                        velocity=tuple(float(v) for v in velocity),
+		                        speed=float(math.sqrt(velocity.dot(velocity))), confidence=float(confidence),
+		                        samples=samples, outlier=outlier)
+
+
+# Desc: ZED camera frame point (x right, y down, z forward) of rover coordinates
+#       (the inverse of get_rover_coordinates in ball_tracker_final.py)
+# Inputs: float distance, float azimuth, float elevation
+# Outputs: numpy float[3]
+def to_camera_frame(distance, azimuth, elevation):
+	hxz = distance * math.cos(elevation)
+	return np.array([hxz * math.sin(azimuth), -distance * math.sin(elevation), hxz * math.cos(azimuth)])
+
+
+# Desc: Rover coordinates of a ZED camera frame point (as get_rover_coordinates)
+# Inputs: float x, float y, float z
+# Outputs: float distance, float elevation, float azimuth
+def from_camera_frame(x, y, z):
+	hxz = math.hypot(x, z)
+	return float(math.hypot(hxz, y)), float(-math.atan2(y, hxz)), float(math.atan2(x, z))
@@ -0,0 +1,117 @@
+##############################################
+# Temporal tracking for the tennis ball detection module.
+#
+# Once the ball has been found, a constant-velocity Kalman filter predicts
+# where it will be on the next frame and only a search window around that
+# prediction is processed. After too many frames without finding the ball
+# in the window, the tracker resets and the full frame is scanned again.
+##############################################
+
+import threading
+import cv2
+import numpy as np
+
+
+# Desc: Constant-velocity tracker of the tennis ball position on the image.
+#       max_misses is how many frames in a row the ball can be missing from the
+#           search window before falling back to a full-frame scan
+#       window_scale is the half size of the search window in ball radii
+#       min_window is the smallest half size of the search window in pixels
+#
+#       The tracker can be shared by several detection threads; every method
+#       holds a lock.
+# Inputs: int max_misses, float window_scale, int min_window
+class BallTracker(object):
+	def __init__(self, max_misses=5, window_scale=3.0, min_window=40):
+		self.max_misses = max_misses
+		self.window_scale = window_scale
+		self.min_window = min_window
+		self.lock = threading.Lock()
+		self.kalman = None
+		self.radius = 0
+		self.misses = 0
+
+	# Desc: True when the ball is locked and only a search window is scanned
+	# Inputs:
+	# Outputs: bool
+	def is_locked(self):
+		return self.kalman is not None
+
+	# Desc: Predict the ball position on the next frame and return the search
+	#       window (x1, y1, x2, y2) around it, clipped to the image. Returns
+	#       None when the full frame has to be scanned. The window grows with
+	#       the predicted speed and with every missed frame.
+	# Inputs: int image_width, int image_height
+	# Outputs: (x1, y1, x2, y2) or None
+	def predict(self, image_width, image_height):
+		with self.lock:
+			if self.kalman is None:
+				return None
+			x, y, vx, vy = self.kalman.predict().ravel()
+			half = (max(self.min_window, self.window_scale * self.radius) + max(abs(vx), abs(vy))) \
+				* (1 + self.misses)
+			x1 = int(max(0, x - half))
+			y1 = int(max(0, y - half))
+			x2 = int(min(image_width, x + half))
+			y2 = int(min(image_height, y + half))
+			if x2 <= x1 or y2 <= y1:
+				# the prediction left the frame
+				self._reset()
+				return None
+			return x1, y1, x2, y2
+
+	# Desc: Update the tracker with the ball found at (x, y) with the radius,
+	#       starting a new track if the tracker was not locked.
+	# Inputs: float x, float y, float radius
+	# Outputs:
+	def update(self, x, y, radius):
+		with self.lock:
+			if self.kalman is None:
+				self.kalman = _constant_velocity_filter(x, y)
+			else:
+				self.kalman.correct(np.array([[x], [y]], dtype=np.float32))
+			self.radius = radius
+			self.misses = 0
+
+	# Desc: Record a frame where the ball was not found. After max_misses
+	#       frames in a row the tracker resets.
+	# Inputs:
+	# Outputs:
+	def miss(self):
+		with self.lock:
+			if self.kalman is None:
+				return
+			self.misses += 1
+			if self.misses > self.max_misses:
+				self._reset()
+
+	# Desc: Forget the ball; the next frame is scanned in full
+	# Inputs:
+	# Outputs:
+	def reset(self):
+		with self.lock:
+			self._reset()
+
+	def _reset(self):
+		self.kalman = None
+		self.radius = 0
+		self.misses = 0
+
+
+# Desc: Create a Kalman filter with state (x, y, vx, vy) in pixels and pixels
+#       per frame, measuring (x, y), starting at rest at (x, y).
+# Inputs: float x, float y
+# Outputs: cv2.KalmanFilter
+def _constant_velocity_filter(x, y):
+	kalman = cv2.KalmanFilter(4, 2)
+	kalman.transitionMatrix = np.array([[1, 0, 1, 0],
+	                                    [0, 1, 0, 1],
+	                                    [0, 0, 1, 0],
+	                                    [0, 0, 0, 1]], dtype=np.float32)
+	kalman.measurementMatrix = np.array([[1, 0, 0, 0],
+	                                     [0, 1, 0, 0]], dtype=np.float32)
+	kalman.processNoiseCov = np.diag([1, 1, 4, 4]).astype(np.float32)
+	kalman.measurementNoiseCov = np.eye(2, dtype=np.float32) * 4
+	kalman.errorCovPost = np.diag([4, 4, 100, 100]).astype(np.float32)
+	kalman.statePost = np.array([[x], [y], [0], [0]], dtype=np.float32)
+	return kalman
@@ -0,0 +1,260 @@
+##############################################
+# Video feed of the tennis ball detection module (SRS 4.4 and 5.9).
+#
+# The annotated frames of the detection loop (ball_tracker_final.py
+# --stream) are sent as JPEG images over TCP to the comms base station.
+# The detection loop only hands over the newest frame, downscaled to the
+# stream width; a background thread encodes it and sends it. While a frame
+# is being encoded or sent, newer frames replace the waiting one, so a slow
+# link lowers the frame rate of the stream instead of slowing the detection.
+# The stream frame rate is also capped (max_fps) so frames that would be
+# dropped anyway are not copied.
+#
+# The receiver listens on the address and the streamer connects to it,
+# reconnecting every few seconds while it can not. The address is either
+# "host:port" (TCP) or the path of a Unix socket. Every frame is a header
+# (FRAME_HEADER, 17 bytes, little endian) followed by the JPEG image:
+#   uint8   version      FRAME_VERSION
+#   uint32  frame_id
+#   float64 timestamp    time.time() when the frame was captured
+#   uint32  size         bytes of the JPEG image that follows
+#
+# USAGE
+# python video_stream.py                      receive on the default address and show the stream
+# python video_stream.py /tmp/ball_video.sock --no-window
+# python ball_tracker_final.py --stream       send the annotated frames to the receiver
+##############################################
+
+import argparse
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import cv2
+import numpy as np
+from pipeline import LatestFrameBuffer
+from result_stream import parse_address
+
+DEFAULT_VIDEO_ADDRESS = "127.0.0.1:5807"
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct('<BIdI')
+
+
+# Desc: Encodes and sends annotated frames to a VideoReceiver on a background
+#       thread. submit() never blocks.
+#       width is the width of the streamed frames (the height keeps the aspect
+#           ratio; None or 0 keeps the frame size)
+#       quality is the JPEG quality (0 to 100)
+#       max_fps caps the frame rate of the stream (None or 0 for no cap)
+#       send_timeout is how long a send may stall before the connection is
+#           dropped and reopened
+# Inputs: str address, int width, int quality, float max_fps, float send_timeout
+class VideoStreamer(object):
+	def __init__(self, address=DEFAULT_VIDEO_ADDRESS, width=640, quality=70, max_fps=10, send_timeout=2.0,
+	             reconnect_interval=2.0):
+		self.family, self.address = parse_address(address)
+		self.width = width
+		self.quality = quality
+		self.frame_interval = 1.0 / max_fps if max_fps else 0.0
+		self.send_timeout = send_timeout
+		self.reconnect_interval = reconnect_interval
+		self.frames = LatestFrameBuffer(size=1)
+		self.socket = None
+		self.connected = False
+		self.last_connect = None
+		self.last_submit = None
+		self.thread = None
+		self.submitted = 0
+		self.sent = 0
+		self.sent_bytes = 0
+		self.skipped = 0
+
+	# Desc: Start the encoder thread
+	# Inputs:
+	# Outputs:
+	def open(self):
+		self.thread = threading.Thread(target=self._run, name="video-stream")
+		self.thread.daemon = True
+		self.thread.start()
+
+	# Desc: Frames that were not sent: over the frame rate cap, while not
+	#       connected, or replaced by a newer frame while the link was busy
+	# Inputs:
+	# Outputs: int
+	def dropped(self):
+		return self.skipped + self.frames.dropped
+
+	# Desc: Hand over an annotated frame. Returns at once: the frame is dropped
+	#       if it is over the frame rate cap or if the receiver is not connected.
+	#       The frame is downscaled (copied) here, so the caller can reuse it.
+	# Inputs: int frame_id, float timestamp, cv2 frame image
+	# Outputs: bool True if the frame was queued
+	def submit(self, frame_id, timestamp, image):
+		now = time.time()
+		if not self.connected or (self.last_submit is not None and now - self.last_submit < self.frame_interval):
+			self.skipped += 1
+			return False
+		self.last_submit = now
+		height, width = image.shape[:2]
+		if self.width and width > self.width:
+			image = cv2.resize(image, (self.width, int(round(height * self.width / float(width)))),
+			                   interpolation=cv2.INTER_AREA)
+		else:
+			image = image.copy()
+		self.frames.put((frame_id, timestamp, image))
+		self.submitted += 1
+		return True
+
+	def _connect(self):
+		now = time.time()
+		if self.last_connect is not None and now - self.last_connect < self.reconnect_interval:
+			return False
+		self.last_connect = now
+		connection = socket.socket(self.family, socket.SOCK_STREAM)
+		connection.settimeout(self.send_timeout)
+		try:
+			connection.connect(self.address)
+		except (socket.error, OSError):
+			connection.close()
+			return False
+		if self.family == socket.AF_INET:
+			connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.socket = connection
+		self.connected = True
+		return True
+
+	def _disconnect(self):
+		self.connected = False
+		if self.socket is not None:
+			self.socket.close()
+			self.socket = None
+
+	# Desc: Encoder thread. Connects to the receiver, then encodes and sends the
+	#       newest frame until the streamer is closed.
+	# Inputs:
+	# Outputs:
+	def _run(self):
+		while not self.frames.closed:
+			if not self.connected and not self._connect():
+				time.sleep(0.1)
+				continue
+			item = self.frames.get(timeout=0.5)
+			if item is None:
+				continue
+			frame_id, timestamp, image = item
+			encoded, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+			if not encoded:
+				continue
+			data = jpeg.tobytes()
+			try:
+				self.socket.sendall(FRAME_HEADER.pack(FRAME_VERSION, frame_id & 0xffffffff, timestamp, len(data)))
+				self.socket.sendall(data)
+			except (socket.error, OSError):
+				# receiver gone or link stalled for send_timeout
+				self._disconnect()
+				continue
+			self.sent += 1
+			self.sent_bytes += FRAME_HEADER.size + len(data)
+
+	# Desc: Stop the encoder thread and close the connection
+	# Inputs:
+	# Outputs:
+	def close(self):
+		self.frames.close()
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+		self._disconnect()
+
+
+# Desc: Receives the frames sent by a VideoStreamer (test receiver)
+# Inputs: str address
+class VideoReceiver(object):
+	def __init__(self, address=DEFAULT_VIDEO_ADDRESS):
+		self.family, self.address = parse_address(address)
+		self.server = socket.socket(self.family, socket.SOCK_STREAM)
+		if self.family == socket.AF_UNIX:
+			if os.path.exists(self.address):
+				os.remove(self.address)
+		else:
+			self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.server.bind(self.address)
+		self.server.listen(1)
+		self.connection = None
+
+	def _read_exactly(self, size):
+		data = bytearray()
+		while len(data) < size:
+			chunk = self.connection.recv(size - len(data))
+			if not chunk:
+				raise EOFError("the streamer disconnected")
+			data.extend(chunk)
+		return bytes(data)
+
+	# Desc: Wait for the next frame, accepting a new streamer connection if needed
+	# Inputs:
+	# Outputs: int frame_id, float timestamp, cv2 frame image (None if it could not be decoded)
+	def receive(self):
+		while True:
+			if self.connection is None:
+				self.connection = self.server.accept()[0]
+			try:
+				header = self._read_exactly(FRAME_HEADER.size)
+				version, frame_id, timestamp, size = FRAME_HEADER.unpack(header)
+				if version != FRAME_VERSION:
+					raise EOFError("unknown frame version {0}".format(version))
+				data = self._read_exactly(size)
+			except (EOFError, socket.error, OSError):
+				self.connection.close()
+				self.connection = None
+				continue
+			return frame_id, timestamp, cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+	def close(self):
+		if self.connection is not None:
+			self.connection.close()
+		self.server.close()
+		if self.family == socket.AF_UNIX and os.path.exists(self.address):
+			os.remove(self.address)
+
+
+def main():
+	ap = argparse.ArgumentParser(description="Receive the video feed of the tennis ball detection")
+	ap.add_argument("address", nargs="?", default=DEFAULT_VIDEO_ADDRESS,
+		help="host:port or Unix socket path to listen on")
+	ap.add_argument("--no-window", action="store_true", help="only print the frame rate and latency")
+	args = ap.parse_args()
+
+	receiver = VideoReceiver(args.address)
+	print("Listening on {0}...".format(args.address))
+	frames = 0
+	latency = 0.0
+	start = time.time()
+	try:
+		while True:
+			frame_id, timestamp, image = receiver.receive()
+			frames += 1
+			latency += time.time() - timestamp
+			if not args.no_window and image is not None:
+				cv2.imshow('stream', image)
+				if cv2.waitKey(1) == 113:  # for 'q' key
+					break
+			elapsed = time.time() - start
+			if elapsed >= 1:
+				print("{0:.1f} FPS, {1:.0f} ms latency, frame {2}".format(frames / elapsed, 1000 * latency / frames,
+				                                                         frame_id))
+				sys.stdout.flush()
+				frames = 0
+				latency = 0.0
+				start = time.time()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		receiver.close()
+		if not args.no_window:
+			cv2.destroyAllWindows()
+
+if __name__ == "__main__":
+	main()